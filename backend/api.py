@@ -1,57 +1,80 @@
 import asyncio
 import json
 import os
-from bilibili_api import search, video, sync, Credential, user as bili_user
-import httpx
-import base64
+import time
+from urllib.parse import parse_qs, urlparse
+
+from . import cdn
+from . import covers
+from . import net
+from . import ratelimit
+from . import store
+from . import video_cache
+from .cache import TTLCache
 
 CREDENTIAL_FILE = os.path.join("data", "credential.json")
 
-# Initialize Credential (empty for now, or load from env/config if needed)
-# For public videos, empty credential usually works for 360p/480p and basic audio.
-# High quality audio might need SESSDATA.
-credential = Credential()
+# 音频地址缓存：TTL 取自 CDN 地址里的 deadline 参数，缺失时使用默认值
+STREAM_URL_DEFAULT_TTL = 600
+STREAM_URL_EXPIRY_MARGIN = 120
+stream_url_cache = TTLCache(maxsize=512)
+# 视频元数据：内存层负责合并并发请求，持久层见 video_cache
+video_info_cache = TTLCache(maxsize=1024, ttl=600)
+# 批量查询视频信息时同时向上游发出的最大请求数
+VIDEO_BATCH_CONCURRENCY = int(os.environ.get("BILIMUSIC_VIDEO_BATCH_CONCURRENCY", 4))
+VIDEO_BATCH_MAX = 200
+# UP 主投稿列表每页条数（接口上限 50）
+UPLOADS_PAGE_SIZE = 50
+# 搜索结果缓存，key 为 (keyword, page)
+search_cache = TTLCache(maxsize=128, ttl=300)
+# 解析音频地址时是否对主/备用 CDN 地址做并发探测
+CDN_RACE = os.environ.get("BILIMUSIC_CDN_RACE", "1") != "0"
 
+# 登录凭据。未登录时为空，公开视频的普通音质不需要登录，高音质需要 SESSDATA。
+# 启动时只读取字段；bilibili_api.Credential 对象在第一次调用接口时才创建（见 _get_credential）
+CREDENTIAL_FIELDS = ("sessdata", "bili_jct", "dedeuserid", "ac_time_value")
+_credential_data = {}
+credential = None
 
-def load_credential_from_file():
+
+def _get_credential(bili):
     global credential
+    if credential is None:
+        credential = bili.Credential(**_credential_data)
+    return credential
+
+
+def load_credential_from_file():
+    global credential, _credential_data
     if not os.path.exists(CREDENTIAL_FILE):
         return
     try:
         with open(CREDENTIAL_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)
-        credential_local = Credential(
-            sessdata=data.get("sessdata", ""),
-            bili_jct=data.get("bili_jct", ""),
-            dedeuserid=data.get("dedeuserid", ""),
-            ac_time_value=data.get("ac_time_value", ""),
-        )
-        credential = credential_local
+        _credential_data = {name: data.get(name, "") for name in CREDENTIAL_FIELDS}
+        credential = None
     except Exception as e:
         print(f"Load credential error: {e}")
 
 
-def save_credential_to_file(cred: Credential):
-    global credential
+def save_credential_to_file(cred):
+    global credential, _credential_data
     credential = cred
+    _credential_data = {name: getattr(cred, name, "") or "" for name in CREDENTIAL_FIELDS}
+    # 登录状态决定可用的音质，旧的解析结果不再适用
+    stream_url_cache.clear()
     os.makedirs(os.path.dirname(CREDENTIAL_FILE), exist_ok=True)
-    data = {
-        "sessdata": getattr(cred, "sessdata", ""),
-        "bili_jct": getattr(cred, "bili_jct", ""),
-        "dedeuserid": getattr(cred, "dedeuserid", ""),
-        "ac_time_value": getattr(cred, "ac_time_value", ""),
-    }
     try:
         with open(CREDENTIAL_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            json.dump(_credential_data, f, ensure_ascii=False, indent=2)
     except Exception as e:
         print(f"Save credential error: {e}")
 
 
 def get_login_status():
     return {
-        "logged_in": bool(getattr(credential, "sessdata", "")),
-        "dedeuserid": getattr(credential, "dedeuserid", None),
+        "logged_in": bool(_credential_data.get("sessdata")),
+        "dedeuserid": _credential_data.get("dedeuserid") or None,
     }
 
 
@@ -61,14 +84,11 @@ async def get_login_info():
     if base["logged_in"] and base.get("dedeuserid"):
         try:
             uid = int(base["dedeuserid"])
-            u = bili_user.User(uid=uid, credential=credential)
-            data = await u.get_user_info()
-            face_url = data.get("face")
-            face_data_uri = None
-            if face_url:
-                if face_url.startswith("//"):
-                    face_url = "https:" + face_url
-                face_data_uri = await fetch_image_as_data_uri(face_url)
+            bili = await net.bilibili_api()
+            u = bili.user.User(uid=uid, credential=_get_credential(bili))
+            async with ratelimit.limit("user"):
+                data = await u.get_user_info()
+            face_ref = await covers.fetch_cover(data.get("face"))
 
             vip_data = data.get("vip") or {}
             level_info = data.get("level_info") or {}
@@ -76,7 +96,7 @@ async def get_login_info():
             info = {
                 "mid": data.get("mid"),
                 "name": data.get("name") or data.get("uname"),
-                "face": face_data_uri,
+                "face": face_ref,
                 "sign": data.get("sign"),
                 "sex": data.get("sex"),
                 "level": level_info.get("current_level") or data.get("level"),
@@ -90,8 +110,10 @@ async def get_login_info():
 
 
 def logout():
-    global credential
-    credential = Credential()
+    global credential, _credential_data
+    credential = None
+    _credential_data = {}
+    stream_url_cache.clear()
     try:
         if os.path.exists(CREDENTIAL_FILE):
             os.remove(CREDENTIAL_FILE)
@@ -102,156 +124,342 @@ def logout():
 load_credential_from_file()
 
 
-async def fetch_image_as_data_uri(url, client=None):
-    if not url:
-        return None
-
-    close_client = False
-    if client is None:
-        client = httpx.AsyncClient(timeout=10)
-        close_client = True
-
-    try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Referer": "https://www.bilibili.com/",
-        }
-        resp = await client.get(url, headers=headers)
-        resp.raise_for_status()
-        content_type = resp.headers.get("Content-Type", "image/jpeg")
-        b64 = base64.b64encode(resp.content).decode("ascii")
-        return f"data:{content_type};base64,{b64}"
-    except Exception as e:
-        print(f"Fetch image error: {e}")
-        return None
-    finally:
-        if close_client:
-            await client.aclose()
-
-async def search_videos(keyword, page=1):
-    try:
-        # search_type=video
-        res = await search.search_by_type(
+async def _search_page(keyword, page):
+    # search_type=video
+    bili = await net.bilibili_api()
+    async with ratelimit.limit("search"):
+        res = await bili.search.search_by_type(
             keyword,
-            search_type=search.SearchObjectType.VIDEO,
+            search_type=bili.search.SearchObjectType.VIDEO,
             page=page,
             page_size=20,
         )
-        # Format results
-        items = []
-        if 'result' in res and res['result']:
-            async with httpx.AsyncClient(timeout=10) as client:
-                # 先为所有结果构建图片 URL 列表
-                pic_urls = []
-                for item in res['result']:
-                    raw_pic = item.get("pic")
-                    if not raw_pic:
-                        pic_urls.append(None)
-                        continue
-                    pic_url = "https:" + raw_pic if raw_pic.startswith("//") else raw_pic
-                    pic_urls.append(pic_url)
-
-                # 并发请求所有封面图片
-                tasks = [
-                    fetch_image_as_data_uri(url, client=client) if url else asyncio.sleep(0, result=None)
-                    for url in pic_urls
-                ]
-                pic_data_list = await asyncio.gather(*tasks)
-
-                # 组装返回结果
-                for item, pic_data_uri in zip(res['result'], pic_data_list):
-                    items.append({
-                        "bvid": item.get("bvid"),
-                        "title": item.get("title").replace("<em class=\"keyword\">", "").replace("</em>", ""),
-                        "author": item.get("author"),
-                        "pic": pic_data_uri,
-                        "duration": item.get("duration"),
-                        "play": item.get("play")
-                    })
-        return {"items": items, "page": page, "has_more": res.get("numPages", 0) > page}
+    # Format results
+    items = []
+    for item in res.get('result') or []:
+        items.append({
+            "bvid": item.get("bvid"),
+            "title": item.get("title").replace("<em class=\"keyword\">", "").replace("</em>", ""),
+            "author": item.get("author"),
+            # 只登记封面地址，图片由 /covers 按需下载
+            "pic": covers.register(item.get("pic")),
+            "duration": item.get("duration"),
+            "play": item.get("play")
+        })
+    return {"items": items, "page": page, "has_more": res.get("numPages", 0) > page}
+
+
+async def search_videos(keyword, page=1, lazy_covers=False):
+    """
+    lazy_covers=True 时立即返回结果，封面在后台下载，前端请求 /covers/{key} 时再补齐；
+    否则等待本页封面全部下载完成后再返回。
+    """
+    try:
+        result = await search_cache.get_or_load((keyword, page), lambda: _search_page(keyword, page))
+        refs = [item["pic"] for item in result["items"]]
+        if lazy_covers:
+            covers.prefetch(refs)
+        else:
+            # 并发缓存所有封面图片（已缓存的不会重复下载，并发数由 covers 模块限制）
+            await asyncio.gather(*[
+                covers.ensure(covers.key_of(ref)) for ref in refs if ref
+            ])
+        return result
     except Exception as e:
         print(f"Search error: {e}")
         return {"error": str(e)}
 
-async def get_video_details(bvid):
-    try:
-        v = video.Video(bvid=bvid, credential=credential)
+async def _fetch_video_info(bvid):
+    bili = await net.bilibili_api()
+    v = bili.video.Video(bvid=bvid, credential=_get_credential(bili))
+    async with ratelimit.limit("video"):
         info = await v.get_info()
-        
-        pic_data_uri = None
-        pic_url = info.get("pic")
-        if pic_url:
-            if pic_url.startswith("//"):
-                pic_url = "https:" + pic_url
-            pic_data_uri = await fetch_image_as_data_uri(pic_url)
-
-        # Extract pages (P)
-        pages = []
-        if "pages" in info:
-            for p in info["pages"]:
-                pages.append({
-                    "cid": p["cid"],
-                    "page": p["page"],
-                    "part": p["part"],
-                    "duration": p.get("duration") # seconds
-                })
-        
-        return {
-            "bvid": bvid,
-            "title": info.get("title"),
-            "pic": pic_data_uri,
-            "desc": info.get("desc"),
-            "owner": info.get("owner", {}).get("name"),
-            "pages": pages
-        }
+
+    # Extract pages (P)
+    pages = []
+    if "pages" in info:
+        for p in info["pages"]:
+            pages.append({
+                "cid": p["cid"],
+                "page": p["page"],
+                "part": p["part"],
+                "duration": p.get("duration") # seconds
+            })
+
+    return {
+        "bvid": bvid,
+        "title": info.get("title"),
+        "pic_source": covers.normalize_url(info.get("pic")),
+        "desc": info.get("desc"),
+        "owner": info.get("owner", {}).get("name"),
+        "pages": pages
+    }
+
+
+async def get_video_info(bvid, refresh=False):
+    """依次查内存缓存、持久化缓存，都没有时才请求上游"""
+    if refresh:
+        invalidate_video(bvid)
+
+    async def load():
+        data = video_cache.get(bvid)
+        if data is None:
+            data = await _fetch_video_info(bvid)
+            video_cache.put(bvid, data)
+        return data
+
+    return await video_info_cache.get_or_load(bvid, load)
+
+
+def _video_details(data, pic_ref):
+    details = {k: v for k, v in data.items() if k != "pic_source"}
+    details["pic"] = pic_ref
+    return details
+
+
+def invalidate_video(bvid):
+    video_info_cache.invalidate(bvid)
+    video_cache.invalidate(bvid)
+
+
+async def get_video_details(bvid, refresh=False):
+    try:
+        data = await get_video_info(bvid, refresh)
+        pic_ref = await covers.fetch_cover(data["pic_source"])
+        return _video_details(data, pic_ref)
     except Exception as e:
         print(f"Get info error: {e}")
         return {"error": str(e)}
 
-async def get_audio_stream_url(bvid, cid=None):
+
+async def get_videos_batch(bvids, refresh=False):
+    """
+    批量查询视频信息，重复的 bvid 只查询一次，上游请求数受 VIDEO_BATCH_CONCURRENCY 限制。
+    单个视频失败时对应条目为 {"bvid", "error"}，不影响其他条目。封面在后台下载。
+    """
+    semaphore = asyncio.Semaphore(VIDEO_BATCH_CONCURRENCY)
+
+    async def one(bvid):
+        try:
+            async with semaphore:
+                data = await get_video_info(bvid, refresh)
+        except Exception as e:
+            print(f"Get info error: {e}")
+            return {"bvid": bvid, "error": str(e)}
+        return _video_details(data, covers.register(data["pic_source"]))
+
+    items = await asyncio.gather(*[one(bvid) for bvid in dict.fromkeys(bvids)])
+    covers.prefetch(item["pic"] for item in items if "error" not in item)
+    return {"items": items}
+
+
+def songs_from_video(info, pages=None, start=None, end=None):
+    """
+    把 get_video_info 的结果展开为歌曲，每个分 P 一首，时长取各分 P 自己的时长。
+    pages 为要保留的分 P 序号（从 1 开始），start/end 为闭区间，都为空时保留全部分 P。
+    """
+    multi_part = len(info["pages"]) > 1
+    cover = covers.register(info["pic_source"])
+    songs = []
+    for page in info["pages"]:
+        number = page["page"]
+        if pages is not None and number not in pages:
+            continue
+        if (start is not None and number < start) or (end is not None and number > end):
+            continue
+        songs.append({
+            "bvid": info["bvid"],
+            "cid": page["cid"],
+            "title": page["part"] if multi_part else info["title"],
+            "artist": info["owner"],
+            "duration": store.format_duration(page["duration"]),
+            "cover": cover,
+        })
+    return songs
+
+
+async def get_favorite_folders():
+    """当前登录用户的视频收藏夹列表"""
+    uid = _credential_data.get("dedeuserid")
+    if not uid:
+        raise ValueError("Login required")
+    bili = await net.bilibili_api()
+    async with ratelimit.limit("user"):
+        res = await bili.favorite_list.get_video_favorite_list(int(uid), credential=_get_credential(bili))
+    return [
+        {"id": f["id"], "title": f.get("title"), "media_count": f.get("media_count", 0)}
+        for f in (res or {}).get("list") or []
+    ]
+
+
+async def favorite_folder_pages(media_id):
+    """
+    逐页读取收藏夹内容，每页返回 {"title", "total", "items"}。
+    条目里的 cid 是第一个分 P 的 cid，pages 是分 P 数；已失效的视频和非视频条目被跳过。
+    """
+    bili = await net.bilibili_api()
+    page = 1
+    while True:
+        async with ratelimit.limit("user"):
+            res = await bili.favorite_list.get_video_favorite_list_content(
+                media_id, page=page, credential=_get_credential(bili)
+            )
+        info = res.get("info") or {}
+        items = []
+        for media in res.get("medias") or []:
+            # type 2 为视频，attr 非 0 表示视频已失效
+            if media.get("type") != 2 or media.get("attr"):
+                continue
+            items.append({
+                "bvid": media.get("bvid"),
+                "cid": (media.get("ugc") or {}).get("first_cid"),
+                "title": media.get("title"),
+                "artist": (media.get("upper") or {}).get("name"),
+                "duration": media.get("duration"),
+                "pic_source": covers.normalize_url(media.get("cover")),
+                "pages": media.get("page") or 1,
+            })
+        yield {"title": info.get("title"), "total": info.get("media_count"), "items": items}
+        if not res.get("has_more"):
+            return
+        page += 1
+
+
+async def user_upload_pages(mid):
+    """逐页读取 UP 主的投稿，每页返回 {"title", "total", "items"}；投稿列表不含 cid"""
+    bili = await net.bilibili_api()
+    u = bili.user.User(uid=mid, credential=_get_credential(bili))
+    page = 1
+    while True:
+        async with ratelimit.limit("user"):
+            res = await u.get_videos(pn=page, ps=UPLOADS_PAGE_SIZE)
+        vlist = (res.get("list") or {}).get("vlist") or []
+        items = [{
+            "bvid": v.get("bvid"),
+            "cid": None,
+            "title": v.get("title"),
+            "artist": v.get("author"),
+            "duration": v.get("length"),
+            "pic_source": covers.normalize_url(v.get("pic")),
+            "pages": None,
+        } for v in vlist]
+        total = (res.get("page") or {}).get("count", 0)
+        title = vlist[0].get("author") if vlist else None
+        yield {"title": title, "total": total, "items": items}
+        if not vlist or page * UPLOADS_PAGE_SIZE >= total:
+            return
+        page += 1
+
+
+def _url_deadline(url):
+    """Bilibili CDN 地址的 query 中带有过期时间戳 deadline"""
+    try:
+        return int(parse_qs(urlparse(url).query)["deadline"][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def _stream_url_ttl(result):
+    deadlines = [_url_deadline(u) for u in [result["url"], *result["backup_urls"]] if u]
+    deadlines = [d for d in deadlines if d]
+    if not deadlines:
+        return STREAM_URL_DEFAULT_TTL
+    # 留出余量，保证交给前端的地址在开始播放时仍然有效
+    return min(deadlines) - time.time() - STREAM_URL_EXPIRY_MARGIN
+
+
+async def _first_cid(bvid):
+    info = await get_video_info(bvid)
+    return info["pages"][0]["cid"]
+
+
+async def _resolve_audio_stream(bvid, cid, race):
+    bili = await net.bilibili_api()
+    v = bili.video.Video(bvid=bvid, credential=_get_credential(bili))
+
+    # Get download url
+    # fnval=16 (DASH format) is usually better for separate audio/video streams
+    async with ratelimit.limit("playurl"):
+        download_url_data = await v.get_download_url(cid=cid)
+
+    detecter = bili.video.VideoDownloadURLDataDetecter(data=download_url_data)
+    streams = detecter.detect_best_streams()
+
+    # We prefer audio stream.
+    # detect_best_streams() returns a list of streams.
+    # If DASH is available, we look for audio only stream.
+
+    target_url = None
+    backup_urls = []
+    quality = None
+
+    # Check if we have dash audio
+    if 'dash' in download_url_data:
+        # In DASH, audio is usually separate.
+        # Accessing raw dash audio streams
+        audios = download_url_data['dash'].get('audio') or []
+        if audios:
+            # 选码率最高的音轨，主地址和备用地址都作为候选
+            best = max(audios, key=lambda a: a.get('bandwidth') or 0)
+            candidates = [best.get('base_url') or best.get('baseUrl')]
+            candidates += best.get('backup_url') or best.get('backupUrl') or []
+            candidates = list(dict.fromkeys(u for u in candidates if u))
+            quality = best.get('id')
+
+            if candidates:
+                ordered = cdn.rank(candidates)
+                if race:
+                    winner = await cdn.race(net.get_client("media"), ordered)
+                    if winner:
+                        ordered = [winner, *[u for u in ordered if u != winner]]
+                target_url, backup_urls = ordered[0], ordered[1:]
+                cdn.register_alternatives(ordered)
+
+    if not target_url:
+        # Fallback to FLV/MP4 (might be full video file, bandwidth heavy but works)
+        if streams:
+            target_url = streams[0].url
+
+    return {
+        "url": target_url,
+        "backup_urls": backup_urls,
+        "cid": cid,
+        "quality": quality,
+        "user_agent": "Mozilla/5.0",
+        "referer": "https://www.bilibili.com"
+    }
+
+
+async def get_audio_stream_url(bvid, cid=None, race=CDN_RACE):
+    """
+    race=True 时并发探测主地址和所有备用地址，返回最快响应的 CDN 节点；
+    其余地址按主机统计排序后放在 backup_urls 中，供 /stream 中途切换。
+    """
     try:
-        v = video.Video(bvid=bvid, credential=credential)
-        
         # If cid is not provided, get the first page's cid
         if not cid:
-            info = await v.get_info()
-            cid = info["pages"][0]["cid"]
-            
-        # Get download url
-        # fnval=16 (DASH format) is usually better for separate audio/video streams
-        download_url_data = await v.get_download_url(cid=cid)
-        
-        detecter = video.VideoDownloadURLDataDetecter(data=download_url_data)
-        streams = detecter.detect_best_streams()
-        
-        # We prefer audio stream. 
-        # detect_best_streams() returns a list of streams.
-        # If DASH is available, we look for audio only stream.
-        
-        target_url = None
-        
-        # Check if we have dash audio
-        if 'dash' in download_url_data:
-            # In DASH, audio is usually separate.
-            # Accessing raw dash audio streams
-            if 'audio' in download_url_data['dash']:
-                audios = download_url_data['dash']['audio']
-                if audios:
-                    # Sort by bandwidth/quality?
-                    # Usually the first one is good enough or best.
-                    target_url = audios[0]['base_url']
-                    # Backup url? audios[0]['backup_url']
-        
-        if not target_url:
-            # Fallback to FLV/MP4 (might be full video file, bandwidth heavy but works)
-            if streams:
-                target_url = streams[0].url
-
-        return {
-            "url": target_url,
-            "user_agent": "Mozilla/5.0",
-            "referer": "https://www.bilibili.com" 
-        }
+            cid = await _first_cid(bvid)
+
+        # 解析结果按 CDN 地址中的 deadline 缓存，并发请求同一首歌只解析一次；
+        # 是否测速会改变主地址的选择，也作为 key 的一部分
+        result = await stream_url_cache.get_or_load(
+            (bvid, cid, race),
+            lambda: _resolve_audio_stream(bvid, cid, race),
+            ttl=_stream_url_ttl,
+        )
+        if result["backup_urls"]:
+            # 缓存期间主机统计可能已经变化，重新注册候选地址
+            cdn.register_alternatives([result["url"], *result["backup_urls"]])
+        return dict(result)
     except Exception as e:
         print(f"Get audio error: {e}")
         return {"error": str(e)}
+
+
+def get_cache_stats():
+    return {
+        "stream_url": stream_url_cache.stats(),
+        "videos": {"memory": video_info_cache.stats(), "persistent": video_cache.stats()},
+        "search": search_cache.stats(),
+        "cdn_hosts": cdn.stats(),
+    }
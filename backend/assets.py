@@ -0,0 +1,165 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    # brotli 随 bilibili-api-python 安装；缺失时只提供 gzip
+    brotli = None
+
+# 前端静态资源。
+# 启动时把 web/ 下的文件一次性读入内存并计算内容哈希，同时预先压缩好 gzip 版本；
+# brotli 最高压缩级别较慢（三个文件约 175ms），在服务就绪后于后台线程生成，完成前先返回 gzip。
+# index.html 里对 /static/ 的引用改写为带哈希的文件名（js/app.js -> js/app.<hash>.js），
+# 带哈希的地址内容永不变化，可以 immutable 缓存；其余地址通过 ETag 协商。
+
+BROTLI_QUALITY = int(os.environ.get("BILIMUSIC_BROTLI_QUALITY", 11))
+HASH_LENGTH = 10
+# 小于这个大小的文件不压缩
+MIN_COMPRESS_SIZE = 512
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+STATIC_ROUTE = "/static"
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+_STATIC_REF_RE = re.compile(r"""(["'])%s/([^"'?#]+)\1""" % STATIC_ROUTE)
+# 优先级从高到低
+_ENCODINGS = ("br", "gzip")
+_SUFFIX = {"br": "br", "gzip": "gz"}
+
+
+def _hashed_name(path, digest):
+    base, ext = os.path.splitext(path)
+    return f"{base}.{digest}{ext}"
+
+
+class Asset:
+    def __init__(self, path, data, media_type):
+        self.path = path
+        self.media_type = media_type
+        self.digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        self.hashed_path = _hashed_name(path, self.digest)
+        # Content-Encoding -> 内容；identity 总是存在
+        self.variants = {"identity": data}
+        self.compressible = media_type.startswith(_COMPRESSIBLE) and len(data) >= MIN_COMPRESS_SIZE
+        if self.compressible:
+            self._add("gzip", gzip.compress(data, 9, mtime=0))
+
+    def _add(self, encoding, data):
+        # 压缩后没有变小的不保留
+        if len(data) < len(self.variants["identity"]):
+            self.variants[encoding] = data
+
+    def add_brotli(self):
+        if brotli is not None and self.compressible and "br" not in self.variants:
+            self._add("br", brotli.compress(self.variants["identity"], quality=BROTLI_QUALITY))
+
+    def etag(self, encoding):
+        # 不同编码是不同的表示，强 ETag 需要区分
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{_SUFFIX[encoding]}"'
+
+
+def accepted_encodings(header):
+    """解析 Accept-Encoding，返回客户端接受的编码集合（q=0 的除外）"""
+    accepted = set()
+    # 明确列出的编码（包括 q=0 拒绝的），* 不覆盖它们
+    listed = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            listed.add(name)
+        if name and q > 0:
+            accepted.add(name)
+    if "*" in accepted:
+        accepted.update(e for e in _ENCODINGS if e not in listed)
+    return accepted
+
+
+def etag_matches(header, etag):
+    """If-None-Match 是否命中（弱比较）"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+class AssetStore:
+    def __init__(self):
+        # 请求路径（相对 /static/）-> Asset；原始文件名和带哈希的文件名都指向同一个 Asset
+        self._assets = {}
+        self._hashed = set()
+
+    def load(self, root):
+        """读取 root 下的所有文件；HTML 最后处理，以便改写其中的资源引用"""
+        files = []
+        for directory, _, names in os.walk(root):
+            for name in sorted(names):
+                full = os.path.join(directory, name)
+                files.append((os.path.relpath(full, root).replace(os.sep, "/"), full))
+        files.sort(key=lambda item: item[0].endswith(".html"))
+
+        assets, hashed = {}, set()
+        for path, full in files:
+            try:
+                with open(full, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                print(f"Load static asset error: {e}")
+                continue
+            media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            if media_type == "text/html":
+                data = self._rewrite(data, assets)
+            if media_type.startswith("text/"):
+                media_type += "; charset=utf-8"
+            asset = Asset(path, data, media_type)
+            assets[path] = assets[asset.hashed_path] = asset
+            hashed.add(asset.hashed_path)
+        self._assets = assets
+        self._hashed = hashed
+
+    @staticmethod
+    def _rewrite(data, assets):
+        def replace(match):
+            asset = assets.get(match.group(2))
+            if asset is None:
+                return match.group(0)
+            quote = match.group(1)
+            return f"{quote}{STATIC_ROUTE}/{asset.hashed_path}{quote}"
+
+        return _STATIC_REF_RE.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+    def compress_brotli(self):
+        """生成所有资源的 brotli 版本，在后台线程中调用；index.html 优先"""
+        for asset in sorted(set(self._assets.values()), key=lambda a: a.path != "index.html"):
+            asset.add_brotli()
+
+    def get(self, path):
+        """返回 (Asset, 是否为带哈希的地址)，不存在时返回 (None, False)"""
+        return self._assets.get(path), path in self._hashed
+
+    def select(self, asset, accept_encoding):
+        """按 Accept-Encoding 选择编码，返回 (编码, 内容)"""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in _ENCODINGS:
+            if encoding in accepted and encoding in asset.variants:
+                return encoding, asset.variants[encoding]
+        return "identity", asset.variants["identity"]
+
+
+store = AssetStore()
@@ -0,0 +1,238 @@
+import base64
+import json
+import os
+import re
+import threading
+import time
+
+# 本地音频缓存。
+# 每个 (bvid, cid, quality) 对应一个稀疏数据文件和一个 .json 元数据文件，
+# 文件按固定大小的块（BLOCK_SIZE）划分，元数据里的位图记录哪些块已经下载。
+# /stream 只向上游请求缺失的块，已缓存的部分直接从磁盘读取。
+
+CACHE_DIR = os.path.join("data", "audio_cache")
+BLOCK_SIZE = int(os.environ.get("BILIMUSIC_AUDIO_CACHE_BLOCK", 256 * 1024))
+MAX_BYTES = int(os.environ.get("BILIMUSIC_AUDIO_CACHE_MB", 1024)) * 1024 * 1024
+
+_KEY_RE = re.compile(r"[^0-9A-Za-z_-]")
+
+
+def make_key(bvid, cid, quality):
+    return _KEY_RE.sub("", f"{bvid}_{cid}_{quality}")
+
+
+class CacheEntry:
+    def __init__(self, key, size, content_type, block_size, bitmap=None, last_access=None):
+        self.key = key
+        self.size = size
+        self.content_type = content_type
+        self.block_size = block_size
+        self.block_count = (size + block_size - 1) // block_size
+        self.bitmap = bitmap if bitmap is not None else bytearray((self.block_count + 7) // 8)
+        self.last_access = last_access or time.time()
+        # 正在读写该条目的响应数量，淘汰时跳过（Windows 下无法删除打开中的文件）
+        self.active = 0
+        self.data_path = os.path.join(CACHE_DIR, key + ".data")
+        self.meta_path = os.path.join(CACHE_DIR, key + ".json")
+        # 有响应在读写时保持数据文件打开，不必每个块都重新打开一次；
+        # read/write_block 在工作线程中调用，seek 和读写需要在锁内成对进行
+        self._file = None
+        self._file_lock = threading.Lock()
+
+    def has_block(self, index):
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def mark_block(self, index):
+        self.bitmap[index >> 3] |= 1 << (index & 7)
+
+    def block_range(self, index):
+        """返回块 index 覆盖的字节区间 [start, end]"""
+        start = index * self.block_size
+        return start, min(start + self.block_size, self.size) - 1
+
+    @property
+    def cached_blocks(self):
+        return sum(bin(b).count("1") for b in self.bitmap)
+
+    @property
+    def cached_bytes(self):
+        total = self.cached_blocks * self.block_size
+        if self.block_count and self.has_block(self.block_count - 1):
+            # 最后一块通常不满一个 block_size
+            total -= self.block_count * self.block_size - self.size
+        return total
+
+    @property
+    def complete(self):
+        return self.cached_blocks == self.block_count
+
+    def runs(self, first_block, last_block):
+        """把 [first_block, last_block] 划分为连续的 (是否已缓存, 起始块, 结束块) 区段"""
+        result = []
+        for index in range(first_block, last_block + 1):
+            present = self.has_block(index)
+            if result and result[-1][0] == present:
+                result[-1][2] = index
+            else:
+                result.append([present, index, index])
+        return [tuple(r) for r in result]
+
+    def _handle(self):
+        if self._file is None:
+            self._file = open(self.data_path, "r+b")
+        return self._file
+
+    def read(self, offset, length):
+        with self._file_lock:
+            f = self._handle()
+            f.seek(offset)
+            return f.read(length)
+
+    def write_block(self, index, data):
+        with self._file_lock:
+            f = self._handle()
+            f.seek(index * self.block_size)
+            f.write(data)
+            # 位图随后会写入元数据，数据要先落到文件里
+            f.flush()
+        self.mark_block(index)
+
+    def close(self):
+        """关闭数据文件；之后的读写会重新打开"""
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def to_meta(self):
+        return {
+            "size": self.size,
+            "content_type": self.content_type,
+            "block_size": self.block_size,
+            "bitmap": base64.b64encode(bytes(self.bitmap)).decode("ascii"),
+            "last_access": self.last_access,
+        }
+
+
+class AudioCache:
+    def __init__(self, max_bytes=MAX_BYTES, block_size=BLOCK_SIZE):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self._entries = None
+        self._lock = threading.RLock()
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+        self.evictions = 0
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        entries = {}
+        if os.path.isdir(CACHE_DIR):
+            for name in os.listdir(CACHE_DIR):
+                if not name.endswith(".json"):
+                    continue
+                key = name[:-len(".json")]
+                try:
+                    with open(os.path.join(CACHE_DIR, name), "r", encoding="utf-8") as f:
+                        meta = json.load(f)
+                    entry = CacheEntry(
+                        key,
+                        meta["size"],
+                        meta.get("content_type") or "audio/mp4",
+                        meta["block_size"],
+                        bitmap=bytearray(base64.b64decode(meta["bitmap"])),
+                        last_access=meta.get("last_access"),
+                    )
+                except Exception as e:
+                    print(f"Load audio cache entry error: {e}")
+                    continue
+                if os.path.exists(entry.data_path):
+                    entries[key] = entry
+        self._entries = entries
+        return entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is not None:
+                entry.last_access = time.time()
+            return entry
+
+    def create(self, key, size, content_type):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with self._lock:
+            entries = self._load()
+            existing = entries.get(key)
+            if existing is not None and existing.size == size:
+                # 并发的首次请求已经创建了条目；重新创建会清空它正在写入的数据文件
+                return existing
+            entry = CacheEntry(key, size, content_type, self.block_size)
+            # 数据文件按需写入各个块，未写入的区域不会占用实际磁盘空间
+            open(entry.data_path, "wb").close()
+            entries[key] = entry
+            self.save(entry)
+            return entry
+
+    def save(self, entry):
+        with self._lock:
+            if self._load().get(entry.key) is not entry:
+                # 条目已被淘汰或替换
+                return
+            tmp_path = entry.meta_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry.to_meta(), f)
+            os.replace(tmp_path, entry.meta_path)
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._load().pop(key, None)
+            if entry is None:
+                return
+            entry.close()
+            for path in (entry.data_path, entry.meta_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def find_complete(self, bvid, cid):
+        """查找 (bvid, cid) 任意音质下已完整缓存的条目"""
+        prefix = make_key(bvid, cid, "")
+        with self._lock:
+            for key, entry in self._load().items():
+                if key.startswith(prefix) and entry.complete:
+                    return entry
+        return None
+
+    def evict(self):
+        """按最近访问时间淘汰条目，直到总大小不超过上限"""
+        with self._lock:
+            entries = self._load()
+            total = sum(e.cached_bytes for e in entries.values())
+            if total <= self.max_bytes:
+                return
+            for entry in sorted(entries.values(), key=lambda e: e.last_access):
+                if total <= self.max_bytes:
+                    break
+                if entry.active:
+                    continue
+                total -= entry.cached_bytes
+                self.remove(entry.key)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            entries = self._load()
+            return {
+                "entries": len(entries),
+                "complete": sum(1 for e in entries.values() if e.complete),
+                "bytes": sum(e.cached_bytes for e in entries.values()),
+                "max_bytes": self.max_bytes,
+                "hit_bytes": self.hit_bytes,
+                "miss_bytes": self.miss_bytes,
+                "evictions": self.evictions,
+            }
+
+
+cache = AudioCache()
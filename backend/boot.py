@@ -0,0 +1,53 @@
+import os
+import time
+
+# 冷启动各阶段耗时（毫秒）。
+# main.py 在主线程上按顺序 mark 各阶段，服务端 lifespan 记录自己的启动耗时；
+# 总耗时超过 BILIMUSIC_STARTUP_BUDGET_MS 时打印警告，/api/metrics 中也会返回这份报告。
+
+BUDGET_MS = float(os.environ.get("BILIMUSIC_STARTUP_BUDGET_MS", 2000))
+
+_origin = time.perf_counter()
+_last = _origin
+_total = None
+phases = {}
+
+
+def begin(origin):
+    """从 origin（time.perf_counter() 的值，通常在进程入口处取得）开始计时"""
+    global _origin, _last
+    _origin = _last = origin
+
+
+def mark(name):
+    """记录从上一次 mark 到现在的耗时，归入阶段 name"""
+    global _last
+    now = time.perf_counter()
+    phases[name] = round((now - _last) * 1000, 1)
+    _last = now
+
+
+def record(name, seconds):
+    """记录不在主线程顺序上的阶段（例如在服务线程里完成的 lifespan 启动）"""
+    phases[name] = round(seconds * 1000, 1)
+
+
+def finish():
+    """冷启动结束，返回报告；超出预算时打印警告"""
+    global _total
+    _total = round((time.perf_counter() - _origin) * 1000, 1)
+    result = report()
+    text = ", ".join(f"{name} {ms:.0f}ms" for name, ms in result["phases"].items())
+    print(f"Startup: {text}; total {_total:.0f}ms (budget {BUDGET_MS:.0f}ms)")
+    if not result["within_budget"]:
+        print(f"Warning: cold start took {_total:.0f}ms, over the {BUDGET_MS:.0f}ms budget")
+    return result
+
+
+def report():
+    return {
+        "phases": dict(phases),
+        "total_ms": _total,
+        "budget_ms": BUDGET_MS,
+        "within_budget": _total is None or _total <= BUDGET_MS,
+    }
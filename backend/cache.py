@@ -0,0 +1,107 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+# 发起加载的调用被取消时交给等待者的标记
+_RETRY = object()
+
+
+class TTLCache:
+    """
+    进程内的 LRU + TTL 缓存。
+    get_or_load() 带 single-flight：同一个 key 的并发加载只会触发一次上游调用。
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> asyncio.Future
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expired += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_load(self, key, loader, ttl=None):
+        """
+        命中时直接返回缓存值，否则调用 loader() 加载并写入缓存。
+        ttl 可以是秒数，也可以是根据加载结果计算秒数的函数。
+        发起加载的调用被取消时，其他等待者不会跟着失败，而是由其中一个重新加载。
+        """
+        while True:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            self.coalesced += 1
+            value = await asyncio.shield(future)
+            if value is not _RETRY:
+                return value
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            # 被取消的只是发起加载的调用，等待者收到 _RETRY 后重新加载
+            future.set_result(_RETRY)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            self.set(key, value, ttl(value) if callable(ttl) else ttl)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# CDN 节点选择。
+# 记录每个 CDN 主机的延迟/吞吐/失败统计（跨请求保留），
+# 解析音频地址时对主地址和备用地址并发发起小的 Range 探测，取最快响应者。
+
+RACE_TIMEOUT = float(os.environ.get("BILIMUSIC_CDN_RACE_TIMEOUT", 5))
+PROBE_RANGE = "bytes=0-1023"
+# 没有统计数据的主机按这个延迟估计
+DEFAULT_LATENCY = 0.5
+# 最近失败过的主机在排序时加上的惩罚（秒），随时间衰减
+FAILURE_PENALTY = 5.0
+FAILURE_DECAY = 300.0
+EWMA_ALPHA = 0.3
+
+
+class HostStats:
+    def __init__(self):
+        self.latency = None  # 首字节延迟的 EWMA（秒）
+        self.throughput = None  # 吞吐的 EWMA（字节/秒）
+        self.samples = 0
+        self.failures = 0
+        self.last_failure = None
+
+    def score(self):
+        score = self.latency if self.latency is not None else DEFAULT_LATENCY
+        if self.last_failure is not None:
+            age = time.monotonic() - self.last_failure
+            score += FAILURE_PENALTY * max(0.0, 1 - age / FAILURE_DECAY)
+        return score
+
+    def to_dict(self):
+        return {
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "throughput_kbps": round(self.throughput / 1024, 1) if self.throughput is not None else None,
+            "samples": self.samples,
+            "failures": self.failures,
+            "score": round(self.score(), 3),
+        }
+
+
+_hosts = {}
+# 地址 -> 同一音轨的全部候选地址，/stream 据此做中途切换
+_alternatives = OrderedDict()
+_MAX_ALTERNATIVES = 1024
+
+
+def host_of(url):
+    return urlparse(url).hostname or ""
+
+
+def _host(url):
+    host = host_of(url)
+    if host not in _hosts:
+        _hosts[host] = HostStats()
+    return _hosts[host]
+
+
+def _ewma(old, new):
+    return new if old is None else old + EWMA_ALPHA * (new - old)
+
+
+def record_latency(url, seconds):
+    stats = _host(url)
+    stats.latency = _ewma(stats.latency, seconds)
+    stats.samples += 1
+
+
+def record_throughput(url, bytes_per_second):
+    stats = _host(url)
+    stats.throughput = _ewma(stats.throughput, bytes_per_second)
+
+
+def record_failure(url):
+    stats = _host(url)
+    stats.failures += 1
+    stats.last_failure = time.monotonic()
+
+
+def rank(urls):
+    """按主机得分（越低越好）排序，得分相同时保持原顺序"""
+    return sorted(urls, key=lambda u: _host(u).score())
+
+
+def register_alternatives(urls):
+    urls = list(dict.fromkeys(u for u in urls if u))
+    for url in urls:
+        _alternatives[url] = urls
+        _alternatives.move_to_end(url)
+    while len(_alternatives) > _MAX_ALTERNATIVES:
+        _alternatives.popitem(last=False)
+
+
+def alternatives(url):
+    """返回 url 以及同一音轨的其他候选地址（按当前得分排序）"""
+    others = [u for u in _alternatives.get(url, []) if u != url]
+    return [url, *rank(others)]
+
+
+async def _probe(client, url):
+    start = time.perf_counter()
+    async with client.stream("GET", url, headers={"Range": PROBE_RANGE}) as resp:
+        if resp.status_code not in (200, 206):
+            raise RuntimeError(f"Probe {host_of(url)} failed: HTTP {resp.status_code}")
+        # 以收到第一段数据的时间为准，只返回响应头的慢节点不会胜出
+        async for _ in resp.aiter_raw():
+            break
+    record_latency(url, time.perf_counter() - start)
+    return url
+
+
+async def race(client, urls):
+    """
+    并发探测所有候选地址，返回最先成功响应的地址；全部失败时返回 None。
+    其余未完成的探测会被取消，并等待它们结束后才返回。
+    """
+    if len(urls) <= 1:
+        return urls[0] if urls else None
+
+    tasks = {asyncio.create_task(_probe(client, url)): url for url in urls}
+    winner = None
+    try:
+        pending = set(tasks)
+        deadline = time.monotonic() + RACE_TIMEOUT
+        while pending and winner is None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task.result()
+                    break
+                record_failure(tasks[task])
+    finally:
+        for task in tasks:
+            task.cancel()
+        # 等被取消的探测真正结束，连接归还给连接池，异常也不会成为无人读取的任务异常
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return winner
+
+
+def stats():
+    return {host: s.to_dict() for host, s in _hosts.items()}
@@ -0,0 +1,210 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+
+from . import net
+from . import ratelimit
+
+# 封面/头像的本地缓存。
+# 每张图片以 key（源 URL 的哈希，或迁移时图片内容的哈希）为名存储一次，
+# 前端和播放列表里只保存 /covers/{key} 这样的短地址。
+COVER_DIR = os.path.join("data", "covers")
+COVER_ROUTE = "/covers"
+
+# 同时下载封面的最大数量
+FETCH_CONCURRENCY = int(os.environ.get("BILIMUSIC_COVER_CONCURRENCY", 6))
+
+_KEY_RE = re.compile(r"^[0-9a-f]{40}$")
+
+# key -> 源 URL，供 /covers/{key} 在图片尚未下载时按需获取；
+# 这里只是最近登记的一部分，完整记录在每张封面的元数据文件里
+_sources = OrderedDict()
+_MAX_SOURCES = 4096
+# key -> 正在进行的下载任务
+_inflight = {}
+_semaphore = None
+
+
+def normalize_url(url):
+    if url and url.startswith("//"):
+        return "https:" + url
+    return url
+
+
+def cover_key(source):
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    return hashlib.sha1(source).hexdigest()
+
+
+def is_valid_key(key):
+    return bool(_KEY_RE.match(key))
+
+
+def cover_url(key):
+    return f"{COVER_ROUTE}/{key}"
+
+
+def key_of(ref):
+    """/covers/{key} -> key"""
+    return ref.rsplit("/", 1)[-1]
+
+
+def _paths(key):
+    directory = os.path.join(COVER_DIR, key[:2])
+    return os.path.join(directory, key), os.path.join(directory, key + ".json")
+
+
+def has(key):
+    return os.path.exists(_paths(key)[0])
+
+
+def load(key):
+    """返回 (图片文件路径, Content-Type)，未缓存时返回 None"""
+    image_path, meta_path = _paths(key)
+    if not os.path.exists(image_path):
+        return None
+    content_type = "image/jpeg"
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            content_type = json.load(f).get("content_type") or content_type
+    except Exception:
+        pass
+    return image_path, content_type
+
+
+def source(key):
+    """key 对应的源 URL；既没有登记也没有记录在缓存元数据里时返回 None"""
+    url = _sources.get(key)
+    if url is not None:
+        return url
+    try:
+        with open(_paths(key)[1], "r", encoding="utf-8") as f:
+            return json.load(f).get("source")
+    except Exception:
+        return None
+
+
+def save(key, content, content_type, source=None):
+    image_path, meta_path = _paths(key)
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    # 先写临时文件再 rename，避免并发读到半个文件
+    tmp_path = image_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, image_path)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"content_type": content_type, "source": source}, f)
+    return cover_url(key)
+
+
+def _persist_source(key, url):
+    """图片还没有下载时先把源地址写进元数据，重启后 /covers/{key} 仍能按需下载"""
+    meta_path = _paths(key)[1]
+    if os.path.exists(meta_path):
+        return
+    try:
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"content_type": None, "source": url}, f)
+    except OSError as e:
+        print(f"Save cover source error: {e}")
+
+
+def register(url):
+    """
+    记录源地址并立即返回 /covers/{key} 短地址，不等待下载。
+    图片在后台下载，或者在浏览器第一次请求该地址时下载。
+    """
+    url = normalize_url(url)
+    if not url:
+        return None
+    key = cover_key(url)
+    if key not in _sources:
+        _persist_source(key, url)
+    _sources[key] = url
+    _sources.move_to_end(key)
+    while len(_sources) > _MAX_SOURCES:
+        _sources.popitem(last=False)
+    return cover_url(key)
+
+
+async def _download(key, url, client):
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    try:
+        async with _semaphore:
+            if has(key):
+                return True
+            async with ratelimit.limit("image"):
+                resp = await net.get(url, client)
+                resp.raise_for_status()
+            content_type = resp.headers.get("Content-Type", "image/jpeg")
+            save(key, resp.content, content_type, source=url)
+            return True
+    except Exception as e:
+        print(f"Fetch image error: {e}")
+        return False
+
+
+def _start(key, client=None):
+    """启动（或复用）key 的下载任务；源地址未知时返回 None"""
+    task = _inflight.get(key)
+    if task is None:
+        url = source(key)
+        if url is None:
+            return None
+        task = asyncio.create_task(_download(key, url, client))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return task
+
+
+async def ensure(key, client=None):
+    """确保 key 对应的图片已下载；同一张图片的并发请求共享一次下载"""
+    if has(key):
+        return True
+    task = _start(key, client)
+    if task is None:
+        return False
+    return await asyncio.shield(task)
+
+
+def prefetch(refs):
+    """在后台下载一组已 register 的封面"""
+    for ref in refs:
+        if ref and not has(key_of(ref)):
+            _start(key_of(ref))
+
+
+async def fetch_cover(url, client=None):
+    """
+    下载图片并写入缓存，返回 /covers/{key} 短地址；失败时返回 None。
+    同一个源 URL 只会下载一次。
+    """
+    ref = register(url)
+    if ref is None:
+        return None
+    ok = await ensure(key_of(ref), client)
+    return ref if ok else None
+
+
+def import_data_uri(data_uri):
+    """把旧版本内嵌的 base64 data URI 写入缓存，key 为图片内容的哈希"""
+    try:
+        header, b64 = data_uri.split(",", 1)
+        content_type = header[len("data:"):].split(";", 1)[0] or "image/jpeg"
+        content = base64.b64decode(b64)
+    except (ValueError, binascii.Error) as e:
+        print(f"Import data uri error: {e}")
+        return None
+    key = cover_key(content)
+    if has(key):
+        return cover_url(key)
+    return save(key, content, content_type)
@@ -0,0 +1,45 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+
+def connect(path):
+    """
+    打开一个 SQLite 数据库连接（WAL 模式）。
+    连接在多个线程间共享，调用方需要自行加锁串行化访问。
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # isolation_level=None: 由 transaction() 显式控制事务边界
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+@contextmanager
+def transaction(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+def migrate(conn, migrations):
+    """
+    依次执行尚未应用的迁移函数，版本号记录在 PRAGMA user_version 中。
+    返回迁移前的版本号（0 表示这是一个新建的数据库）。
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in enumerate(migrations[version:], start=version + 1):
+        with transaction(conn):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+    return version
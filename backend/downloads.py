@@ -0,0 +1,406 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import httpx
+
+from . import api as bili_api
+from . import cdn
+from . import db
+from . import events
+from . import net
+from . import ratelimit
+from .audio_cache import cache as audio_cache, make_key as make_cache_key
+
+# 离线下载。
+# 任务保存在 SQLite 中（重启后继续），由固定数量的 worker 按优先级依次执行。
+# 下载中的数据写入 .part 文件，中断后用 Range 请求从已下载的位置继续；
+# 所有 worker 共用一个全局限速器。下载完成的歌曲由 /stream 直接从磁盘返回。
+
+DB_FILE = os.path.join("data", "downloads.db")
+DOWNLOAD_DIR = os.path.join("data", "downloads")
+WORKERS = int(os.environ.get("BILIMUSIC_DOWNLOAD_WORKERS", 2))
+# 全局限速（KB/s），0 表示不限速
+BANDWIDTH_KBPS = int(os.environ.get("BILIMUSIC_DOWNLOAD_KBPS", 0))
+CHUNK_SIZE = 64 * 1024
+# 连接中断时在同一个任务内从断点重新请求的次数
+MAX_RESUMES = 3
+PROGRESS_INTERVAL = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _migrate_v1(conn):
+    conn.execute("""
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bvid TEXT NOT NULL,
+            cid INTEGER NOT NULL,
+            title TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            quality TEXT,
+            bytes_done INTEGER NOT NULL DEFAULT 0,
+            bytes_total INTEGER,
+            path TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            UNIQUE (bvid, cid)
+        )
+    """)
+    conn.execute("CREATE INDEX idx_jobs_queue ON jobs(status, priority DESC, id)")
+
+
+_MIGRATIONS = [_migrate_v1]
+
+
+class Bandwidth:
+    """
+    全局限速器：每次读取数据前按字节数预约发送时间，预约超出当前时间太多就等待。
+    rate 为 0 时不限速。
+    """
+
+    BURST = 0.5  # 允许的突发量（秒）
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._next = 0.0
+
+    async def consume(self, nbytes):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self._next = max(self._next, now - self.BURST) + nbytes / self.rate
+        delay = self._next - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def _run_to_completion(func, *args):
+    """
+    在线程中执行 func。被取消时仍等线程执行完再抛出 CancelledError，
+    保证调用方看到任务结束时文件已经不再被写入。
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.gather(future, return_exceptions=True)
+        raise
+
+
+class DownloadManager:
+    def __init__(self, workers=WORKERS, rate=BANDWIDTH_KBPS * 1024):
+        self.workers = workers
+        self.bandwidth = Bandwidth(rate)
+        self._conn = None
+        self._lock = threading.RLock()
+        self._wake = None
+        self._worker_tasks = []
+        # job id -> 正在执行的下载任务 / 实时进度
+        self._running = {}
+        self._progress = {}
+        # 被用户删除、需要中止的任务
+        self._removed = set()
+
+    def _get_conn(self):
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    conn = db.connect(DB_FILE)
+                    db.migrate(conn, _MIGRATIONS)
+                    self._conn = conn
+        return self._conn
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = datetime.now().isoformat()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        conn = self._get_conn()
+        with self._lock:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        events.bus.publish("download", {"id": job_id, **{k: v for k, v in fields.items() if k != "path"}})
+
+    async def start(self):
+        conn = self._get_conn()
+        with self._lock:
+            # 上次退出时未完成的任务重新排队，已下载的部分保留在 .part 文件中
+            conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+        self._wake = asyncio.Event()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def enqueue(self, songs, priority=0):
+        """
+        songs: [{"bvid", "cid", "title"}]。已有的任务只会提高优先级，失败的任务重新排队。
+        返回新加入或重新排队的任务数。
+        """
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        with self._lock, db.transaction(conn):
+            before = conn.total_changes
+            for song in songs:
+                conn.execute(
+                    """
+                    INSERT INTO jobs (bvid, cid, title, priority, status, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (bvid, cid) DO UPDATE SET
+                        priority = MAX(priority, excluded.priority),
+                        status = CASE WHEN status = 'failed' THEN 'queued' ELSE status END,
+                        updated_at = excluded.updated_at
+                    WHERE priority < excluded.priority OR status = 'failed'
+                    """,
+                    (song["bvid"], song["cid"], song.get("title"), priority, QUEUED, now, now),
+                )
+            queued = conn.total_changes - before
+        self._notify()
+        if queued:
+            events.bus.publish("download", {"queued": queued})
+        return queued
+
+    def retry(self, job_id):
+        conn = self._get_conn()
+        with self._lock:
+            ok = conn.execute(
+                "UPDATE jobs SET status = ?, error = NULL WHERE id = ? AND status = ?", (QUEUED, job_id, FAILED)
+            ).rowcount > 0
+        self._notify()
+        if ok:
+            events.bus.publish("download", {"id": job_id, "status": QUEUED})
+        return ok
+
+    async def remove(self, job_id, delete_file=True):
+        """取消并删除任务；delete_file=True 时同时删除已下载的文件"""
+        conn = self._get_conn()
+        with self._lock:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        events.bus.publish("download", {"id": job_id, "status": "removed"})
+        task = self._running.get(job_id)
+        if task is not None:
+            self._removed.add(job_id)
+            task.cancel()
+            # 等任务真正结束、关闭 .part 文件后再删除（Windows 下无法删除打开中的文件）
+            await asyncio.gather(task, return_exceptions=True)
+        if delete_file:
+            for path in (row["path"], self._part_path(row["bvid"], row["cid"], row["quality"])):
+                if path and os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        print(f"Remove download error: {e}")
+        return True
+
+    def list_jobs(self):
+        conn = self._get_conn()
+        with self._lock:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY status = 'done', priority DESC, id").fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["bytes_done"] = self._progress.get(job["id"], job["bytes_done"])
+            jobs.append(job)
+        return jobs
+
+    def local_file(self, bvid, cid):
+        """已下载完成的文件路径，没有时返回 None"""
+        conn = self._get_conn()
+        with self._lock:
+            row = conn.execute(
+                "SELECT path FROM jobs WHERE bvid = ? AND cid = ? AND status = ?", (bvid, cid, DONE)
+            ).fetchone()
+        if row is None or not row["path"] or not os.path.exists(row["path"]):
+            return None
+        return row["path"]
+
+    def local_quality(self, bvid, cid):
+        """已下载完成的文件的音质；没有下载或文件已被删除时返回 None"""
+        conn = self._get_conn()
+        with self._lock:
+            row = conn.execute(
+                "SELECT path, quality FROM jobs WHERE bvid = ? AND cid = ? AND status = ?", (bvid, cid, DONE)
+            ).fetchone()
+        if row is None or not row["path"] or not os.path.exists(row["path"]):
+            return None
+        return row["quality"]
+
+    def set_bandwidth(self, kbps):
+        self.bandwidth.rate = max(0, kbps) * 1024
+
+    def stats(self):
+        conn = self._get_conn()
+        with self._lock:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "bandwidth_kbps": self.bandwidth.rate // 1024,
+            "jobs": counts,
+        }
+
+    def _claim(self):
+        conn = self._get_conn()
+        with self._lock, db.transaction(conn):
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, id LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (RUNNING, row["id"]))
+        events.bus.publish("download", {"id": row["id"], "status": RUNNING})
+        return dict(row)
+
+    async def _worker(self):
+        ratelimit.set_priority(ratelimit.BACKGROUND)
+        while True:
+            self._wake.clear()
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                await self._wake.wait()
+                continue
+            task = asyncio.create_task(self._download(job))
+            self._running[job["id"]] = task
+            try:
+                path = await task
+            except asyncio.CancelledError:
+                if job["id"] in self._removed:
+                    self._removed.discard(job["id"])
+                    continue
+                # worker 自身被取消（应用退出），任务留到下次启动继续
+                await asyncio.to_thread(
+                    self._update, job["id"], status=QUEUED, bytes_done=self._progress.get(job["id"], 0)
+                )
+                raise
+            except Exception as e:
+                print(f"Download {job['bvid']}/{job['cid']} error: {e}")
+                await asyncio.to_thread(
+                    self._update, job["id"], status=FAILED, error=str(e), bytes_done=self._progress.get(job["id"], 0)
+                )
+            else:
+                await asyncio.to_thread(
+                    self._update, job["id"], status=DONE, path=path, error=None, bytes_done=os.path.getsize(path)
+                )
+            finally:
+                self._running.pop(job["id"], None)
+                self._progress.pop(job["id"], None)
+
+    @staticmethod
+    def _file_path(bvid, cid, quality):
+        return os.path.join(DOWNLOAD_DIR, make_cache_key(bvid, cid, quality) + ".m4a")
+
+    def _part_path(self, bvid, cid, quality):
+        return self._file_path(bvid, cid, quality) + ".part" if quality else None
+
+    async def _download(self, job):
+        bvid, cid = job["bvid"], job["cid"]
+        audio = await bili_api.get_audio_stream_url(bvid, cid)
+        if audio.get("error") or not audio.get("url"):
+            raise RuntimeError(audio.get("error") or "No audio stream")
+        quality = str(audio["quality"])
+        path = self._file_path(bvid, cid, quality)
+        part = self._part_path(bvid, cid, quality)
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        if job["quality"] and job["quality"] != quality:
+            # 音质变了，旧的 .part 不能续传
+            old_part = self._part_path(bvid, cid, job["quality"])
+            if os.path.exists(old_part):
+                os.remove(old_part)
+        await asyncio.to_thread(self._update, job["id"], quality=quality)
+
+        # 已完整缓存在播放缓存里的歌曲直接复制
+        entry = audio_cache.get(make_cache_key(bvid, cid, quality))
+        if entry is not None and entry.complete:
+            await _run_to_completion(shutil.copyfile, entry.data_path, part)
+            os.replace(part, path)
+            return path
+
+        urls = [audio["url"], *audio["backup_urls"]]
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        total = job["bytes_total"]
+        resumes = 0
+        while total is None or offset < total:
+            try:
+                offset, total = await self._fetch(job["id"], urls, part, offset, total)
+            except (httpx.HTTPError, RuntimeError):
+                resumes += 1
+                if resumes > MAX_RESUMES:
+                    raise
+                print(f"Download {bvid}/{cid} interrupted at {offset}, resuming")
+                offset = os.path.getsize(part)
+        os.replace(part, path)
+        return path
+
+    async def _open(self, urls, offset):
+        client = net.get_client("media")
+        for url in urls:
+            try:
+                resp = await net.send(
+                    client.build_request("GET", url, headers={"Range": f"bytes={offset}-"}), client, stream=True
+                )
+            except httpx.HTTPError:
+                cdn.record_failure(url)
+                continue
+            if resp.status_code in (200, 206):
+                return resp
+            await resp.aclose()
+            cdn.record_failure(url)
+        raise RuntimeError("All CDN candidates failed")
+
+    @staticmethod
+    def _open_part(part, offset):
+        """打开 .part 文件并截断到 offset，之后从 offset 继续写入"""
+        f = open(part, "r+b" if offset and os.path.exists(part) else "wb")
+        f.seek(offset)
+        f.truncate()
+        return f
+
+    async def _fetch(self, job_id, urls, part, offset, total):
+        """从 offset 开始下载到文件末尾，返回 (新的 offset, 文件总大小)"""
+        resp = await self._open(urls, offset)
+        try:
+            if resp.status_code == 200:
+                # 上游忽略了 Range，从头开始
+                offset = 0
+                total = int(resp.headers["Content-Length"]) if "Content-Length" in resp.headers else None
+            else:
+                content_range = resp.headers.get("Content-Range", "")
+                total = int(content_range.rsplit("/", 1)[-1]) if "/" in content_range else total
+            if total is not None:
+                await asyncio.to_thread(self._update, job_id, bytes_total=total)
+
+            # 文件和数据库的读写都放到线程里，不阻塞事件循环
+            last_saved = time.monotonic()
+            with await asyncio.to_thread(self._open_part, part, offset) as f:
+                async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                    await self.bandwidth.consume(len(chunk))
+                    await asyncio.to_thread(f.write, chunk)
+                    offset += len(chunk)
+                    self._progress[job_id] = offset
+                    if time.monotonic() - last_saved >= PROGRESS_INTERVAL:
+                        await asyncio.to_thread(self._update, job_id, bytes_done=offset)
+                        last_saved = time.monotonic()
+            if total is None:
+                total = offset
+        finally:
+            await resp.aclose()
+        return offset, total
+
+
+manager = DownloadManager()
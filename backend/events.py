@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+# 服务端事件推送（/api/events，SSE）。
+# 登录状态、曲库版本号、下载和导入进度都通过这里广播给所有打开的页面，
+# 前端不再各自轮询。publish 可以在任意线程中调用，事件在事件循环里分发。
+
+# 每个订阅者最多积压的事件数，超出时丢弃最早的事件
+QUEUE_SIZE = 256
+# 没有事件时发送心跳的间隔（秒），避免连接被代理或浏览器判定为空闲断开
+HEARTBEAT = 15
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers = set()
+        self._loop = None
+        self.published = 0
+        self.dropped = 0
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    def stop(self):
+        self._loop = None
+        # 唤醒所有订阅者，让 SSE 响应结束
+        for queue in self._subscribers:
+            self._put(queue, None)
+
+    def publish(self, event, data):
+        """广播一个事件；事件循环未启动（如命令行脚本）时什么也不做"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(event, data)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, event, data)
+
+    def _put(self, queue, message):
+        if queue.full():
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(message)
+
+    def _dispatch(self, event, data):
+        self.published += 1
+        for queue in self._subscribers:
+            self._put(queue, (event, data))
+
+    async def subscribe(self, heartbeat=HEARTBEAT):
+        """逐个产出 (event, data)；heartbeat 秒内没有事件时产出 None"""
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self._subscribers.discard(queue)
+
+    def stats(self):
+        return {"subscribers": len(self._subscribers), "published": self.published, "dropped": self.dropped}
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+bus = EventBus()
@@ -0,0 +1,18 @@
+import io
+
+from PIL import Image
+
+# 在进程池里执行的图片缩放。
+# 只依赖 Pillow，子进程导入它时不需要加载后端的其他模块。
+
+
+def resize(src_path, size, quality):
+    """把图片等比缩小到不超过 size x size，返回 WebP 编码后的内容"""
+    with Image.open(src_path) as im:
+        # JPEG 可以直接按 1/2、1/4、1/8 的比例解码，省掉大部分解码和缩放开销
+        im.draft("RGB", (size, size))
+        im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P", "PA") else "RGB")
+    im.thumbnail((size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    im.save(out, "WEBP", quality=quality, method=4)
+    return out.getvalue()
@@ -0,0 +1,239 @@
+import asyncio
+import itertools
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from . import api as bili_api
+from . import covers
+from . import events
+from . import ratelimit
+from . import store
+
+# 批量导入收藏夹 / UP 主投稿。
+# 每个导入任务是一条流水线：
+#   分页读取上游列表 -> 多个 worker 并发解析 cid 和分 P（命中视频缓存时不请求上游）
+#   -> 按原顺序攒批写入歌单
+# 流水线中同时存在的条目数不超过 WINDOW，导入几千条也只占用固定的内存。
+# 上游请求以后台优先级经过 ratelimit 限速，不会挤占播放和搜索。
+
+# 解析视频信息的并发数
+CONCURRENCY = int(os.environ.get("BILIMUSIC_IMPORT_CONCURRENCY", 4))
+WINDOW = 200
+WRITE_BATCH = 100
+# 攒批未满时最多等待多久就写入一次，让进度尽早出现在歌单里
+FLUSH_INTERVAL = 1.0
+# 保留多少个已结束的任务供查询
+KEEP_FINISHED = 20
+
+SOURCES = ("favorites", "uploads")
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+@dataclass
+class ImportJob:
+    id: int
+    source: str
+    source_id: int
+    playlist_id: Optional[str] = None
+    name: Optional[str] = None
+    all_pages: bool = False
+    status: str = RUNNING
+    total: Optional[int] = None
+    listed: int = 0
+    resolved: int = 0
+    added: int = 0
+    skipped: int = 0
+    failed: int = 0
+    error: Optional[str] = None
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    task: Optional[asyncio.Task] = None
+
+    def to_dict(self):
+        return {k: v for k, v in self.__dict__.items() if k != "task"}
+
+
+class Importer:
+    def __init__(self, concurrency=CONCURRENCY):
+        self.concurrency = concurrency
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def start(self, source, source_id, playlist_id=None, name=None, all_pages=False):
+        """创建并启动导入任务；playlist_id 为空时按收藏夹名/UP 主名新建歌单"""
+        if source not in SOURCES:
+            raise ValueError(f"Unknown source: {source}")
+        job = ImportJob(next(self._ids), source, source_id, playlist_id, name, all_pages)
+        job.task = asyncio.create_task(self._run(job))
+        self._jobs[job.id] = job
+        self._prune()
+        return job.to_dict()
+
+    def _prune(self):
+        finished = [j.id for j in self._jobs.values() if j.status != RUNNING]
+        for job_id in finished[:-KEEP_FINISHED]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def list_jobs(self):
+        return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        if job.status == RUNNING:
+            job.task.cancel()
+        return True
+
+    async def stop(self):
+        tasks = [job.task for job in self._jobs.values() if job.status == RUNNING]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job):
+        ratelimit.set_priority(ratelimit.BACKGROUND)
+        items = asyncio.Queue()
+        songs = asyncio.Queue()
+        window = asyncio.Semaphore(WINDOW)
+
+        async def resolve_all():
+            await asyncio.gather(*[self._resolve(job, items, songs) for _ in range(self.concurrency)])
+            await songs.put(None)
+
+        tasks = [
+            asyncio.create_task(self._list(job, items, window)),
+            asyncio.create_task(resolve_all()),
+            asyncio.create_task(self._write(job, songs, window)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+            job.status = FAILED if job.error else DONE
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+            # 继续向外抛出，stop() 和外层的取消才能看到任务是被取消的
+            raise
+        except Exception as e:
+            print(f"Import error: {e}")
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            job.finished_at = time.time()
+            events.bus.publish("import", job.to_dict())
+
+    def _pages(self, job):
+        if job.source == "favorites":
+            return bili_api.favorite_folder_pages(job.source_id)
+        return bili_api.user_upload_pages(job.source_id)
+
+    async def _list(self, job, items, window):
+        """分页读取上游列表；列表读取失败时已读到的条目照常导入，任务最终标记为失败"""
+        seq = 0
+        try:
+            async for page in self._pages(job):
+                if job.total is None:
+                    job.total = page["total"]
+                if job.playlist_id is None:
+                    name = job.name or page["title"] or f"Import {job.source_id}"
+                    playlist = await asyncio.to_thread(store.create_playlist, name)
+                    job.playlist_id = playlist["id"]
+                for item in page["items"]:
+                    await window.acquire()
+                    await items.put((seq, item))
+                    seq += 1
+                    job.listed += 1
+        except Exception as e:
+            print(f"Import list error: {e}")
+            job.error = str(e)
+        finally:
+            for _ in range(self.concurrency):
+                items.put_nowait(None)
+
+    async def _resolve(self, job, items, songs):
+        while True:
+            entry = await items.get()
+            if entry is None:
+                return
+            seq, item = entry
+            try:
+                resolved = await self._songs_of(job, item)
+                job.resolved += 1
+            except Exception as e:
+                print(f"Import resolve error: {e}")
+                resolved = None
+                job.failed += 1
+            await songs.put((seq, resolved))
+
+    async def _songs_of(self, job, item):
+        """把列表条目转换为歌曲；收藏夹里的单 P 视频自带 cid 和时长，不需要再查询"""
+        if item["cid"] and item["pages"] == 1:
+            return [{
+                "bvid": item["bvid"],
+                "cid": item["cid"],
+                "title": item["title"],
+                "artist": item["artist"],
+                "duration": store.format_duration(item["duration"]),
+                "cover": covers.register(item["pic_source"]),
+            }]
+        info = await bili_api.get_video_info(item["bvid"])
+        if job.all_pages:
+            return bili_api.songs_from_video(info)
+        # 只导入第一个分 P 时沿用视频标题
+        songs = bili_api.songs_from_video(info, end=1)
+        for song in songs:
+            song["title"] = info["title"]
+        return songs
+
+    async def _write(self, job, songs, window):
+        """按列表顺序攒批写入；解析完成的条目先在 pending 里等待排在前面的条目"""
+        pending = {}
+        next_seq = 0
+        batch = []
+        done = False
+        while not done:
+            try:
+                entry = await asyncio.wait_for(songs.get(), FLUSH_INTERVAL if batch else None)
+            except asyncio.TimeoutError:
+                entry = False
+            if entry is None:
+                done = True
+            elif entry:
+                seq, resolved = entry
+                pending[seq] = resolved
+                while next_seq in pending:
+                    batch.extend(pending.pop(next_seq) or [])
+                    window.release()
+                    next_seq += 1
+            if batch and (done or entry is False or len(batch) >= WRITE_BATCH):
+                await self._flush(job, batch)
+                batch = []
+
+    async def _flush(self, job, batch):
+        operations = [{"op": "add", "playlist_id": job.playlist_id, "song": song} for song in batch]
+        result = await asyncio.to_thread(store.apply_batch, operations, True, False)
+        for r in result["results"]:
+            if not r["ok"]:
+                job.failed += 1
+            elif r.get("skipped"):
+                job.skipped += 1
+            else:
+                job.added += 1
+        # 封面地址只在内存中登记，趁还记得源地址时在后台下载
+        covers.prefetch(song["cover"] for song in batch)
+        events.bus.publish("import", job.to_dict())
+
+
+importer = Importer()
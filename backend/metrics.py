@@ -0,0 +1,259 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from . import boot
+
+# 进程内指标。
+# 只有计数器、仪表和固定桶直方图，记录一次只是加锁后几次列表/字典操作，可以常开。
+# /metrics 输出 Prometheus 文本格式，/api/metrics 输出便于直接查看的 JSON 摘要。
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=""):
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [各桶计数（最后一个是 +Inf）, 总和, 次数, 最小值, 最大值]
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0, value, value]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+            if value < entry[3]:
+                entry[3] = value
+            elif value > entry[4]:
+                entry[4] = value
+
+    def _render_value(self, key, value):
+        counts, total, count = value[:3]
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _format_labels(self.labels, key, 'le="%s"' % le)
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def _quantile(self, counts, count, low, high, q):
+        """按桶线性插值估算分位数，结果限制在实际观测到的最小值和最大值之间"""
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        estimate = high
+        for bound, n in zip(self.buckets, counts):
+            if n and cumulative + n >= rank:
+                estimate = lower + (bound - lower) * (rank - cumulative) / n
+                break
+            cumulative += n
+            lower = bound
+        return min(max(estimate, low), high)
+
+    def summary(self):
+        """{labels: {count, avg_ms, p50_ms, p99_ms, max_ms}}"""
+        with self._lock:
+            items = [(key, [list(v[0])] + v[1:]) for key, v in self._values.items()]
+        result = {}
+        for key, (counts, total, count, low, high) in sorted(items):
+            result[" ".join(str(k) for k in key)] = {
+                "count": count,
+                "avg_ms": round(total / count * 1000, 2),
+                "p50_ms": round(self._quantile(counts, count, low, high, 0.5) * 1000, 2),
+                "p99_ms": round(self._quantile(counts, count, low, high, 0.99) * 1000, 2),
+                "max_ms": round(high * 1000, 2),
+            }
+        return result
+
+
+http_requests = Counter("bilimusic_http_requests_total", "HTTP requests", ("method", "route", "status"))
+http_latency = Histogram("bilimusic_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+upstream_latency = Histogram(
+    "bilimusic_upstream_duration_seconds", "Bilibili upstream call latency", ("call",)
+)
+upstream_errors = Counter("bilimusic_upstream_errors_total", "Failed Bilibili upstream calls", ("call",))
+ratelimit_wait = Histogram(
+    "bilimusic_ratelimit_wait_seconds", "Time spent waiting for a rate limit token", ("bucket",)
+)
+stream_active = Gauge("bilimusic_stream_active", "Audio streams being served")
+stream_bytes = Counter("bilimusic_stream_bytes_total", "Audio bytes sent to clients")
+stream_seconds = Counter("bilimusic_stream_seconds_total", "Total time spent serving audio streams")
+stream_ttfb = Histogram("bilimusic_stream_ttfb_seconds", "Time to first audio byte")
+store_latency = Histogram("bilimusic_store_duration_seconds", "Library store operation latency", ("op",))
+
+
+@contextmanager
+def upstream(call):
+    """计时一次上游调用；抛出异常时同时计入错误数"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        upstream_errors.inc(call=call)
+        raise
+    finally:
+        upstream_latency.observe(time.perf_counter() - start, call=call)
+
+
+def timed_store(fn):
+    """记录曲库读写函数的耗时，op 为函数名"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            store_latency.observe(time.perf_counter() - start, op=fn.__name__)
+    return wrapper
+
+
+STREAM_PATH = "/stream"
+
+
+class MetricsMiddleware:
+    """
+    ASGI 中间件：按路由模板（而不是实际路径）统计请求数和耗时；
+    /stream 额外统计首字节时间、发送字节数和同时进行的流数量。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        is_stream = scope["path"] == STREAM_PATH
+        state = {"status": 500, "first_byte": None, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                if state["first_byte"] is None:
+                    state["first_byte"] = time.perf_counter()
+                state["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        if is_stream:
+            stream_active.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            # 未匹配的路径统一归为 unmatched，避免随意的 URL 让标签无限增长
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method=method, route=path, status=state["status"])
+            http_latency.observe(elapsed, method=method, route=path)
+            if is_stream:
+                stream_active.dec()
+                stream_bytes.inc(state["bytes"])
+                stream_seconds.inc(elapsed)
+                if state["first_byte"] is not None:
+                    stream_ttfb.observe(state["first_byte"] - start)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    errors = {}
+    for (method, route, status), n in http_requests.values().items():
+        name = f"{method} {route}"
+        if int(status) >= 500:
+            errors[name] = errors.get(name, 0) + n
+    routes = http_latency.summary()
+    for name, entry in routes.items():
+        entry["errors"] = errors.get(name, 0)
+    sent = sum(stream_bytes.values().values())
+    streaming_time = sum(stream_seconds.values().values())
+    return {
+        "routes": routes,
+        "upstream": upstream_latency.summary(),
+        "upstream_errors": {k[0]: v for k, v in upstream_errors.values().items()},
+        "ratelimit_wait": ratelimit_wait.summary(),
+        "store": store_latency.summary(),
+        "stream": {
+            "active": sum(stream_active.values().values()),
+            "bytes": sent,
+            "avg_kbps": round(sent / streaming_time / 1024, 1) if streaming_time else 0,
+            "ttfb": stream_ttfb.summary().get("", {}),
+        },
+        "startup": boot.report(),
+    }
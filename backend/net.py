@@ -0,0 +1,225 @@
+import asyncio
+import importlib
+import os
+import random
+import time
+
+import httpx
+
+from . import boot
+
+# 出站 HTTP 连接池。
+# 应用内所有访问 B 站的请求（bilibili_api 的接口调用、封面下载、/stream 音频代理、
+# CDN 探测）共用这里的客户端，TLS 会话和连接在请求之间复用。
+# 客户端在 FastAPI 的 lifespan 中创建和关闭；在 lifespan 之外使用时按需创建。
+#
+#   api   - 接口与图片，校验证书
+#   media - 音频 CDN，长读超时，不校验证书
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Referer": "https://www.bilibili.com/",
+}
+
+CONNECT_TIMEOUT = float(os.environ.get("BILIMUSIC_HTTP_CONNECT_TIMEOUT", 5))
+API_TIMEOUT = float(os.environ.get("BILIMUSIC_HTTP_TIMEOUT", 10))
+API_MAX_CONNECTIONS = int(os.environ.get("BILIMUSIC_HTTP_MAX_CONNECTIONS", 20))
+MEDIA_READ_TIMEOUT = float(os.environ.get("BILIMUSIC_STREAM_READ_TIMEOUT", 30))
+MEDIA_MAX_CONNECTIONS = int(os.environ.get("BILIMUSIC_STREAM_MAX_CONNECTIONS", 20))
+KEEPALIVE_EXPIRY = float(os.environ.get("BILIMUSIC_HTTP_KEEPALIVE", 60))
+# auto：安装了 h2 时启用 HTTP/2；0/1 强制关闭/开启
+HTTP2 = os.environ.get("BILIMUSIC_HTTP2", "auto")
+
+# 连接失败、429 和 5xx 时的重试次数与指数退避（秒）
+RETRIES = int(os.environ.get("BILIMUSIC_HTTP_RETRIES", 2))
+BACKOFF = float(os.environ.get("BILIMUSIC_HTTP_BACKOFF", 0.3))
+MAX_BACKOFF = 5.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# 把所有出站请求改发到这个地址（如 http://127.0.0.1:9000），Host 头保持原样。
+# 供 bench/ 里的本地 B 站替身使用，正常运行时不要设置
+UPSTREAM = os.environ.get("BILIMUSIC_UPSTREAM", "")
+
+_clients = {}
+# (事件循环, 导入并配置 bilibili_api 的任务)
+_bilibili_api_load = None
+
+
+class _RedirectTransport(httpx.AsyncHTTPTransport):
+    """把请求的协议、主机和端口替换成 UPSTREAM，路径、参数和请求头不变"""
+
+    def __init__(self, upstream, **kwargs):
+        super().__init__(**kwargs)
+        target = httpx.URL(upstream)
+        self._target = {"scheme": target.scheme, "host": target.host, "port": target.port}
+
+    async def handle_async_request(self, request):
+        request.url = request.url.copy_with(**self._target)
+        return await super().handle_async_request(request)
+
+
+def _http2_enabled():
+    if HTTP2 != "auto":
+        return HTTP2 == "1"
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _limits(max_connections):
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _client(verify=True, **kwargs):
+    transport_options = {
+        "http2": _http2_enabled(),
+        "verify": verify,
+        "limits": kwargs.pop("limits"),
+    }
+    if UPSTREAM:
+        # 自定义 transport 时连接池参数要交给 transport，AsyncClient 上的同名参数不再生效
+        return httpx.AsyncClient(transport=_RedirectTransport(UPSTREAM, **transport_options), **kwargs)
+    return httpx.AsyncClient(**transport_options, **kwargs)
+
+
+def _build(name):
+    if name == "api":
+        return _client(
+            headers=HEADERS,
+            follow_redirects=True,
+            timeout=httpx.Timeout(API_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=_limits(API_MAX_CONNECTIONS),
+        )
+    if name == "media":
+        return _client(
+            # 注意：verify=False 可能有安全风险，但在代理流媒体时有时是必要的
+            verify=False,
+            headers=HEADERS,
+            follow_redirects=True,
+            timeout=httpx.Timeout(API_TIMEOUT, connect=CONNECT_TIMEOUT, read=MEDIA_READ_TIMEOUT),
+            limits=_limits(MEDIA_MAX_CONNECTIONS),
+        )
+    raise ValueError(f"Unknown client: {name}")
+
+
+def get_client(name="api"):
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _build(name)
+    return client
+
+
+async def _configure_bilibili_api(client):
+    """让 bilibili_api 在当前事件循环中使用共享的 api 客户端"""
+    from bilibili_api import get_session, request_settings, select_client, set_session
+
+    select_client("httpx")
+    # 这些设置必须在 set_session 之前修改，之后修改会让 bilibili_api 重建自己的会话
+    request_settings.set_timeout(API_TIMEOUT)
+    request_settings.set("http2", _http2_enabled())
+    # set_session 要求当前事件循环已有会话，先让 bilibili_api 创建一个再替换掉
+    own = get_session()
+    if own is not client:
+        await own.aclose()
+        set_session(client)
+
+
+def _import_modules():
+    # httpx 创建第一个客户端时才导入 httpcore（约 150ms），
+    # bilibili_api 连同登录、极验等子模块约 300ms
+    importlib.import_module("httpcore")
+    return importlib.import_module("bilibili_api")
+
+
+async def _load_bilibili_api():
+    global _bilibili_api_load
+    start = time.perf_counter()
+    try:
+        # 放到线程里导入，不阻塞事件循环
+        module = await asyncio.to_thread(_import_modules)
+        get_client("media")
+        await _configure_bilibili_api(get_client("api"))
+    except BaseException:
+        _bilibili_api_load = None
+        raise
+    # 不在冷启动的关键路径上，单独记录
+    boot.record("bilibili_api_background", time.perf_counter() - start)
+    return module
+
+
+def _bilibili_api_task():
+    global _bilibili_api_load
+    loop = asyncio.get_running_loop()
+    if _bilibili_api_load is None or _bilibili_api_load[0] is not loop:
+        task = loop.create_task(_load_bilibili_api())
+        # 预加载失败时异常留给之后的调用者处理，这里只是避免 "never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        _bilibili_api_load = (loop, task)
+    return _bilibili_api_load[1]
+
+
+async def bilibili_api():
+    """
+    返回已在当前事件循环中配置好的 bilibili_api 模块。
+    第一次调用时才导入；并发的调用共用同一次加载，调用方被取消不影响加载本身。
+    """
+    return await asyncio.shield(_bilibili_api_task())
+
+
+async def startup():
+    # 客户端和 bilibili_api 在服务开始接受请求后于后台准备，通常在第一次搜索或登录之前就已完成
+    _bilibili_api_task()
+
+
+async def shutdown():
+    global _bilibili_api_load
+    if _bilibili_api_load is not None:
+        task = _bilibili_api_load[1]
+        _bilibili_api_load = None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _retry_delay(attempt, resp=None):
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+    delay = min(BACKOFF * (2 ** attempt), MAX_BACKOFF)
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def send(request, client=None, retries=RETRIES, stream=False):
+    """
+    发送请求；连接失败、429 或 5xx 时按指数退避重试。
+    重试耗尽后返回最后一次的响应，或抛出最后一次的连接错误。
+    """
+    client = client or get_client()
+    for attempt in range(retries + 1):
+        last = attempt == retries
+        try:
+            resp = await client.send(request, stream=stream)
+        except httpx.TransportError:
+            if last:
+                raise
+            await asyncio.sleep(_retry_delay(attempt))
+            continue
+        if resp.status_code not in RETRY_STATUS or last:
+            return resp
+        await resp.aclose()
+        await asyncio.sleep(_retry_delay(attempt, resp))
+
+
+async def get(url, client=None, retries=RETRIES, **kwargs):
+    client = client or get_client()
+    return await send(client.build_request("GET", url, **kwargs), client, retries)
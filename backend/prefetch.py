@@ -0,0 +1,37 @@
+import asyncio
+import os
+
+from . import api as bili_api
+from . import stream
+from .audio_cache import make_key as make_cache_key
+
+# 下一首预加载：在当前歌曲结束前由前端调用，
+# 提前解析下一首的音频地址并把开头一段数据放进本地缓存。
+
+PREFETCH_BYTES = int(os.environ.get("BILIMUSIC_PREFETCH_KB", 512)) * 1024
+
+# 保存后台预热任务的引用，避免任务在完成前被回收
+_tasks = set()
+
+
+async def _warm(url, key):
+    try:
+        await stream.warm(url, key, PREFETCH_BYTES)
+    except Exception as e:
+        print(f"Prefetch warm error: {e}")
+
+
+async def prefetch(bvid, cid=None):
+    """
+    解析即将播放的歌曲（由前端按播放模式选出）的音频地址，并在后台预热本地缓存。
+    返回 {"audio": get_audio_stream_url 的结果}
+    """
+    # 地址解析按交互优先级进行：stream_url_cache 对同一首歌只解析一次，
+    # 用户此时点播这首歌会加入同一次解析，不能让他排在后台限流后面
+    audio = await bili_api.get_audio_stream_url(bvid, cid)
+    if not audio.get("error") and audio.get("url") and audio.get("quality"):
+        key = make_cache_key(bvid, audio["cid"], audio["quality"])
+        task = asyncio.create_task(_warm(audio["url"], key))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+    return {"audio": audio}
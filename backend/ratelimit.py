@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from . import metrics
+
+# 访问 B 站的集中限速。
+# 每类接口一个令牌桶。遇到风控（HTTP 412，接口返回 -352/-412）时速率减半并暂停一段时间，
+# 之后每次成功调用逐步恢复到基准速率（AIMD）。
+# 排队等待的请求按优先级放行：交互请求（搜索、播放解析）先于后台任务（预加载、下载、导入）。
+# 优先级保存在 contextvar 中，后台任务在开始时调用 set_priority(BACKGROUND)，
+# 它创建的子任务会继承这个设置。
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# 类别 -> (每秒请求数, 突发量)
+LIMITS = {
+    "search": (2, 4),
+    "video": (5, 10),
+    "playurl": (5, 10),
+    "user": (2, 4),
+    "login": (2, 4),
+    "image": (20, 20),
+}
+# 所有速率乘以该系数；0 表示不限速
+SCALE = float(os.environ.get("BILIMUSIC_RATE_SCALE", 1))
+
+RISK_CODES = {-352, -412}
+RISK_STATUS = {412}
+# 风控后的暂停时间：从 COOLDOWN 开始，连续触发时翻倍
+COOLDOWN = 2.0
+MAX_COOLDOWN = 60.0
+# 速率最低降到基准速率的多少；每次成功恢复基准速率的多少
+MIN_RATE_FRACTION = 0.1
+RECOVERY = 0.05
+
+_priority = contextvars.ContextVar("ratelimit_priority", default=INTERACTIVE)
+
+
+def set_priority(priority):
+    """设置当前任务（及其之后创建的子任务）的优先级"""
+    _priority.set(priority)
+
+
+def is_risk_control(exc):
+    if getattr(exc, "code", None) in RISK_CODES:
+        return True
+    if getattr(exc, "status", None) in RISK_STATUS:
+        return True
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code in RISK_STATUS
+
+
+class Limiter:
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._cooldown = 0.0
+        # (priority, seq, future)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.requests = 0
+        self.throttled = 0
+        self.risk_events = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def _take(self):
+        now = self._refill()
+        if now < self._blocked_until:
+            return False
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _schedule(self):
+        if self._timer is not None or not self._waiters:
+            return
+        now = self._refill()
+        delay = max(self._blocked_until - now, (1 - self._tokens) / self.rate, 0)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._release)
+
+    def _release(self):
+        self._timer = None
+        while self._waiters:
+            _, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._take():
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+        self._schedule()
+
+    async def acquire(self, priority=INTERACTIVE):
+        self.requests += 1
+        if not self.rate:
+            return
+        # 有人排队时新请求也要排队，不能插到同优先级的前面
+        if not self._waiters and self._take():
+            return
+        self.throttled += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._schedule()
+        await future
+
+    def penalize(self):
+        self.risk_events += 1
+        self.rate = max(self.base_rate * MIN_RATE_FRACTION, self.rate / 2)
+        self._cooldown = min(MAX_COOLDOWN, self._cooldown * 2 or COOLDOWN)
+        self._blocked_until = time.monotonic() + self._cooldown
+        self._tokens = 0
+        print(f"Rate limit {self.name}: risk control, {self.rate:.2f}/s, pause {self._cooldown:.0f}s")
+
+    def reward(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVERY)
+        elif self._cooldown:
+            self._cooldown = 0.0
+
+    def stats(self):
+        return {
+            "rate": round(self.rate, 2),
+            "base_rate": self.base_rate,
+            "waiting": sum(1 for _, _, f in self._waiters if not f.done()),
+            "paused_for": round(max(0.0, self._blocked_until - time.monotonic()), 1),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "risk_events": self.risk_events,
+        }
+
+
+limiters = {name: Limiter(name, rate * SCALE, burst) for name, (rate, burst) in LIMITS.items()}
+
+
+@asynccontextmanager
+async def limit(name):
+    """
+    async with limit("video"): await v.get_info()
+    按当前优先级排队取得令牌；块内抛出风控异常时降低该类别的速率。
+    排队时间和块内的上游调用耗时分别计入指标。
+    """
+    limiter = limiters[name]
+    start = time.perf_counter()
+    await limiter.acquire(_priority.get())
+    metrics.ratelimit_wait.observe(time.perf_counter() - start, bucket=name)
+    try:
+        with metrics.upstream(name):
+            yield
+    except Exception as e:
+        if is_risk_control(e):
+            limiter.penalize()
+        raise
+    else:
+        limiter.reward()
+
+
+def stats():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -1,28 +1,68 @@
-import urllib3
-import requests
+import asyncio
 import base64
 import os
-import uuid
 import sys
+import threading
+import time
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import TYPE_CHECKING, List, Optional
 
 from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, Response
 from pydantic import BaseModel
 
-from bilibili_api import login_v2
-from bilibili_api.utils.geetest import Geetest, GeetestType
-
 from . import api as bili_api
+from . import assets
+from .audio_cache import cache as audio_cache, make_key as make_cache_key
+from . import boot
+from . import covers
+from . import downloads
+from . import events
+from . import importer
+from . import metrics
+from . import net
+from . import prefetch
+from . import ratelimit
+from . import sessions
 from . import store
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-app = FastAPI()
+from . import stream
+from . import thumbnails
+
+
+# lifespan 启动完成后置位，桌面入口（main.py）等它再打开窗口
+ready = threading.Event()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    assets.store.load(web_path)
+    events.bus.start()
+    await net.startup()
+    await downloads.manager.start()
+    qr_sessions.start()
+    sms_sessions.start()
+    boot.record("lifespan", time.perf_counter() - start)
+    ready.set()
+    # brotli 压缩较慢，服务就绪后在后台生成
+    asyncio.get_running_loop().run_in_executor(None, assets.store.compress_brotli)
+    yield
+    ready.clear()
+    await sms_sessions.stop()
+    await qr_sessions.stop()
+    await importer.importer.stop()
+    await downloads.manager.stop()
+    # 等待缩略图子进程退出可能需要一些时间，不阻塞事件循环
+    await asyncio.to_thread(thumbnails.shutdown)
+    await net.shutdown()
+    events.bus.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # --- 核心修复：资源路径处理逻辑 ---
 def get_resource_path(relative_path):
@@ -61,25 +101,179 @@ class SongInfo(BaseModel):
     title: str
     artist: str
     duration: str
-    cover: str
+    cover: Optional[str] = None
 
 
 class ReorderSongsRequest(BaseModel):
     song_uuids: List[str]
 
 
+class BatchOperation(BaseModel):
+    op: str  # add, remove, move, copy
+    playlist_id: str
+    song: Optional[SongInfo] = None
+    uuid: Optional[str] = None
+    to_playlist_id: Optional[str] = None
+    index: Optional[int] = None
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+    dedupe: bool = False
+    atomic: bool = True
+
+
+BATCH_MAX_OPERATIONS = 1000
+
+
+class AddVideoRequest(BaseModel):
+    bvid: str
+    pages: Optional[List[int]] = None  # 分 P 序号，从 1 开始
+    start: Optional[int] = None  # 分 P 范围（闭区间）
+    end: Optional[int] = None
+    dedupe: bool = False
+
+
+class PrefetchRequest(BaseModel):
+    bvid: str
+    cid: Optional[int] = None
+
+
+class DownloadSong(BaseModel):
+    bvid: str
+    cid: int
+    title: Optional[str] = None
+
+
+class DownloadRequest(BaseModel):
+    songs: List[DownloadSong] = []
+    playlist_id: Optional[str] = None
+    priority: int = 0
+
+
+class BandwidthRequest(BaseModel):
+    kbps: int  # 0 表示不限速
+
+
+class ImportRequest(BaseModel):
+    source: str  # favorites（收藏夹 media_id）或 uploads（UP 主 mid）
+    id: int
+    playlist_id: Optional[str] = None  # 为空时新建歌单
+    name: Optional[str] = None
+    all_pages: bool = False
+
+
+class VideoBatchRequest(BaseModel):
+    bvids: List[str]
+    refresh: bool = False
+
+
+if TYPE_CHECKING:
+    from bilibili_api import login_v2
+    from bilibili_api.utils.geetest import Geetest
+
+
+async def _login_api():
+    """登录相关模块随 bilibili_api 延迟加载，返回 (login_v2, geetest) 模块"""
+    await net.bilibili_api()
+    from bilibili_api import login_v2
+    from bilibili_api.utils import geetest
+    return login_v2, geetest
+
+
+@dataclass
+class QrLoginSession:
+    qr: "login_v2.QrCodeLogin"
+    status: str = "waiting"
+    closed: bool = False
+
+
 @dataclass
 class SmsLoginSession:
-    geetest: Geetest
-    phone: Optional[login_v2.PhoneNumber] = None
+    geetest: "Geetest"
+    phone: Optional["login_v2.PhoneNumber"] = None
     captcha_id: Optional[str] = None
-    login_check: Optional[login_v2.LoginCheck] = None
-    verify_geetest: Optional[Geetest] = None
-    done: bool = False
+    login_check: Optional["login_v2.LoginCheck"] = None
+    verify_geetest: Optional["Geetest"] = None
+    closed: bool = False
+
+
+# 扫码状态的上游查询间隔；本地极验页面完成状态的检查间隔
+QR_POLL_INTERVAL = 1.5
+GEETEST_POLL_INTERVAL = 0.5
+
+
+def _close_qr_session(session: QrLoginSession):
+    # 在线程池中调用，只设置标记，由轮询任务自己退出
+    session.closed = True
+
+
+def _close_geetest(gee: Optional["Geetest"]):
+    """关闭本地极验服务；会等待服务线程退出（最长约 1 秒）"""
+    if gee is not None and gee.thread is not None:
+        gee.close_geetest_server()
+
+
+def _close_sms_session(session: SmsLoginSession):
+    session.closed = True
+    _close_geetest(session.geetest)
+    _close_geetest(session.verify_geetest)
 
 
-qr_sessions: Dict[str, login_v2.QrCodeLogin] = {}
-sms_sessions: Dict[str, SmsLoginSession] = {}
+def _publish_login(flow: str, session_id: str, status: str):
+    events.bus.publish("login", {"flow": flow, "session_id": session_id, "status": status})
+
+
+async def _check_qr_state(session: QrLoginSession):
+    if session.qr.has_done():
+        return "done"
+    login_v2, _ = await _login_api()
+    async with ratelimit.limit("login"):
+        event = await session.qr.check_state()
+    if event == login_v2.QrCodeLoginEvents.SCAN:
+        return "scan"
+    if event == login_v2.QrCodeLoginEvents.CONF:
+        return "confirm"
+    if event == login_v2.QrCodeLoginEvents.TIMEOUT:
+        return "timeout"
+    if event == login_v2.QrCodeLoginEvents.DONE:
+        return "done"
+    return session.status
+
+
+async def _poll_qr_login(session_id: str, session: QrLoginSession):
+    """
+    每个扫码会话只有这一个任务查询上游，状态变化通过 login 事件推送，
+    /api/login/qrcode/status 也只读取这里记录的状态。
+    """
+    while not session.closed:
+        await asyncio.sleep(QR_POLL_INTERVAL)
+        try:
+            status = await _check_qr_state(session)
+        except Exception as e:
+            print(f"QR login poll error: {e}")
+            continue
+        if status == "done":
+            bili_api.save_credential_to_file(session.qr.get_credential())
+        if status != session.status:
+            session.status = status
+            _publish_login("qr", session_id, status)
+        if status in ("done", "timeout"):
+            qr_sessions.pop(session_id, "completed" if status == "done" else "expired")
+            return
+
+
+async def _watch_geetest(session_id: str, session: SmsLoginSession, gee: "Geetest", status: str):
+    """本地极验页面完成后推送 login 事件，前端据此自动进入下一步"""
+    while not session.closed and gee.thread is not None:
+        if gee.has_done():
+            _publish_login("sms", session_id, status)
+            return
+        await asyncio.sleep(GEETEST_POLL_INTERVAL)
+
+
+qr_sessions = sessions.SessionRegistry("qr", close=_close_qr_session)
+sms_sessions = sessions.SessionRegistry("sms", close=_close_sms_session)
 
 
 class SmsSendCodeRequest(BaseModel):
@@ -97,9 +291,82 @@ class SmsCheckCompleteRequest(BaseModel):
     code: str
 
 
+def _etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _conditional(request: Request, etag: str, build):
+    """
+    带 ETag 的 JSON 响应；客户端的 If-None-Match 命中时返回 304，不再生成响应体。
+    etag 必须在 build() 之前读取，保证它不会比响应内容更新。
+    build() 也可以直接返回一个 Response（例如已经序列化好的 JSON）。
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    body = build()
+    if isinstance(body, Response):
+        body.headers.update(headers)
+        return body
+    return JSONResponse(body, headers=headers)
+
+
+def _playlist_etag(playlist_id: str):
+    revision = store.get_playlist_revision(playlist_id)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return f'"pl-{revision}"'
+
+
 @app.get("/api/playlists")
-def get_all_playlists():
-    return store.get_all_playlists()
+def get_all_playlists(request: Request):
+    etag = f'"lib-{store.get_library_revision()}"'
+    return _conditional(request, etag, store.get_all_playlists)
+
+
+@app.get("/api/playlists/summary")
+def get_playlist_summaries(request: Request):
+    etag = f'"lib-{store.get_library_revision()}"'
+    return _conditional(request, etag, store.get_playlist_summaries)
+
+
+@app.get("/api/playlists/changes")
+def get_playlist_changes(since: int = Query(..., ge=0)):
+    return store.get_changes(since)
+
+
+@app.get("/api/playlists/{playlist_id}/songs")
+def get_playlist_songs(
+    request: Request,
+    playlist_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(store.SONGS_PAGE_SIZE, ge=1, le=store.SONGS_PAGE_MAX),
+):
+    def build():
+        try:
+            page = store.get_songs_page(playlist_id, cursor, limit)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if page is None:
+            raise HTTPException(status_code=404, detail="Playlist not found")
+        return page
+
+    return _conditional(request, _playlist_etag(playlist_id), build)
+
+
+@app.get("/api/playlists/{playlist_id}/keys")
+def get_playlist_keys(request: Request, playlist_id: str):
+    def build():
+        keys = store.get_song_keys(playlist_id)
+        if keys is None:
+            raise HTTPException(status_code=404, detail="Playlist not found")
+        return Response('{"keys":' + keys + "}", media_type="application/json")
+
+    return _conditional(request, _playlist_etag(playlist_id), build)
 
 
 @app.post("/api/playlists")
@@ -119,6 +386,17 @@ def rename_playlist(playlist_id: str, payload: PlaylistRename):
     return {"success": True}
 
 
+@app.post("/api/playlists/batch")
+def batch_update(body: BatchRequest):
+    if len(body.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_OPERATIONS} operations per request")
+    return store.apply_batch(
+        [op.dict() for op in body.operations],
+        dedupe=body.dedupe,
+        atomic=body.atomic,
+    )
+
+
 @app.post("/api/playlists/{playlist_id}/songs")
 def add_song(playlist_id: str, song: SongInfo):
     ok = store.add_song(playlist_id, song.dict())
@@ -127,6 +405,38 @@ def add_song(playlist_id: str, song: SongInfo):
     return {"success": True}
 
 
+@app.post("/api/playlists/{playlist_id}/videos")
+async def add_video(playlist_id: str, body: AddVideoRequest):
+    """把一个视频的全部或部分分 P 一次性加入歌单，只查询一次视频信息"""
+    if store.get_playlist_revision(playlist_id) is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    try:
+        info = await bili_api.get_video_info(body.bvid)
+    except Exception as e:
+        print(f"Get info error: {e}")
+        return {"error": str(e)}
+    songs = bili_api.songs_from_video(info, body.pages, body.start, body.end)
+    if not songs:
+        raise HTTPException(status_code=400, detail="No matching pages")
+    # 写事务可能要等锁，放到线程里执行，不阻塞事件循环
+    result = await asyncio.to_thread(
+        store.apply_batch,
+        [{"op": "add", "playlist_id": playlist_id, "song": song} for song in songs],
+        dedupe=body.dedupe,
+    )
+    if not result["applied"]:
+        failed = next(r for r in result["results"] if not r["ok"])
+        raise HTTPException(status_code=404, detail=failed["error"])
+    covers.prefetch([songs[0]["cover"]])
+    skipped = sum(1 for r in result["results"] if r.get("skipped"))
+    return {
+        "success": True,
+        "added": len(songs) - skipped,
+        "skipped": skipped,
+        "uuids": [r["uuid"] for r in result["results"]],
+    }
+
+
 @app.delete("/api/playlists/{playlist_id}/songs/{song_uuid}")
 def remove_song(playlist_id: str, song_uuid: str):
     ok = store.remove_song(playlist_id, song_uuid)
@@ -144,57 +454,236 @@ def reorder_songs(playlist_id: str, body: ReorderSongsRequest):
 
 
 @app.get("/api/search")
-async def search_videos(keyword: str = Query(...), page: int = Query(1, ge=1)):
-    return await bili_api.search_videos(keyword, page)
+async def search_videos(keyword: str = Query(...), page: int = Query(1, ge=1), lazy_covers: bool = False):
+    return await bili_api.search_videos(keyword, page, lazy_covers=lazy_covers)
+
+
+@app.get("/api/library/search")
+def search_library(q: str = Query(...), limit: int = Query(store.SEARCH_LIMIT, ge=1, le=store.SEARCH_MAX)):
+    return {"items": store.search_songs(q, limit)}
+
+
+@app.post("/api/videos/batch")
+async def get_videos_batch(body: VideoBatchRequest):
+    if len(body.bvids) > bili_api.VIDEO_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {bili_api.VIDEO_BATCH_MAX} bvids per request")
+    return await bili_api.get_videos_batch(body.bvids, refresh=body.refresh)
 
 
 @app.get("/api/videos/{bvid}")
-async def get_video_details(bvid: str):
-    return await bili_api.get_video_details(bvid)
+async def get_video_details(bvid: str, refresh: bool = False):
+    return await bili_api.get_video_details(bvid, refresh=refresh)
+
+
+@app.delete("/api/videos/{bvid}/cache")
+def invalidate_video(bvid: str):
+    bili_api.invalidate_video(bvid)
+    return {"success": True}
 
 
 @app.get("/api/audio_url")
-async def get_audio_url(bvid: str, cid: Optional[int] = None):
-    return await bili_api.get_audio_stream_url(bvid, cid)
+async def get_audio_url(bvid: str, cid: Optional[int] = None, race: bool = bili_api.CDN_RACE):
+    if cid:
+        # 已下载或已完整缓存到本地的音频不需要再解析地址
+        quality = downloads.manager.local_quality(bvid, cid)
+        if quality is not None:
+            return {"url": None, "cid": cid, "quality": quality, "cached": True, "offline": True}
+        entry = audio_cache.find_complete(bvid, cid)
+        if entry is not None:
+            quality = entry.key[len(make_cache_key(bvid, cid, "")):]
+            return {"url": None, "cid": cid, "quality": quality, "cached": True}
+    return await bili_api.get_audio_stream_url(bvid, cid, race=race)
 
 
-@app.get("/stream")
-def stream_audio(request: Request, url: str = Query(...)):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Referer": "https://www.bilibili.com/",
-    }
+@app.post("/api/prefetch")
+async def prefetch_next(body: PrefetchRequest):
+    return await prefetch.prefetch(body.bvid, body.cid)
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    stats = bili_api.get_cache_stats()
+    stats["audio"] = audio_cache.stats()
+    stats["downloads"] = downloads.manager.stats()
+    stats["login_sessions"] = {"qr": qr_sessions.stats(), "sms": sms_sessions.stats()}
+    stats["events"] = events.bus.stats()
+    stats["rate_limits"] = ratelimit.stats()
+    return stats
 
-    range_header = request.headers.get("range") or request.headers.get("Range")
-    if range_header:
-        headers["Range"] = range_header
 
-    # 注意：verify=False 可能有安全风险，但在代理流媒体时有时是必要的
-    resp = requests.get(url, headers=headers, stream=True, verify=False)
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus 文本格式的指标"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-    def iter_stream():
-        for chunk in resp.iter_content(chunk_size=1024 * 1024):
-            if chunk:
-                yield chunk
 
-    response_headers = {}
-    content_type = resp.headers.get("Content-Type", "audio/mp4")
-    response_headers["Content-Type"] = content_type
+@app.get("/api/metrics")
+def metrics_summary():
+    """各路由、上游调用、曲库读写的次数和 p50/p99 耗时，以及音频流的吞吐和首字节时间"""
+    return metrics.summary()
 
-    for h in ["Content-Length", "Content-Range", "Accept-Ranges"]:
-        if h in resp.headers:
-            response_headers[h] = resp.headers[h]
 
-    if "Accept-Ranges" not in response_headers:
-        response_headers["Accept-Ranges"] = "bytes"
+@app.get("/api/events")
+async def event_stream(request: Request):
+    """
+    SSE 事件流：
+        library  {revision}                      曲库有变更，前端用 /api/playlists/changes 增量同步
+        login    {flow, session_id, status}      扫码/短信登录状态变化；{status: "logout"} 为退出登录
+        download {id, status?, bytes_done?, ...} 下载任务状态和进度
+        import   导入任务的完整状态
+    连接建立时先发送一次当前的曲库版本号。
+    """
+    async def generate():
+        yield "retry: 3000\n\n"
+        yield events.format_sse("library", {"revision": store.get_library_revision()})
+        async for message in events.bus.subscribe():
+            if await request.is_disconnected():
+                return
+            if message is None:
+                yield ": ping\n\n"
+            else:
+                yield events.format_sse(*message)
 
     return StreamingResponse(
-        iter_stream(),
-        status_code=resp.status_code,
-        headers=response_headers,
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
+@app.get("/api/downloads")
+def list_downloads():
+    return {"jobs": downloads.manager.list_jobs(), "stats": downloads.manager.stats()}
+
+
+# 这几个接口会唤醒/取消事件循环中的下载任务，必须在事件循环线程里执行
+@app.post("/api/downloads")
+async def enqueue_downloads(body: DownloadRequest):
+    songs = [song.dict() for song in body.songs]
+    if body.playlist_id:
+        playlist_songs = store.get_songs(body.playlist_id)
+        if playlist_songs is None:
+            raise HTTPException(status_code=404, detail="Playlist not found")
+        songs += [{"bvid": s["bvid"], "cid": s["cid"], "title": s["title"]} for s in playlist_songs]
+    queued = downloads.manager.enqueue(songs, priority=body.priority)
+    return {"success": True, "queued": queued}
+
+
+@app.post("/api/downloads/{job_id}/retry")
+async def retry_download(job_id: int):
+    if not downloads.manager.retry(job_id):
+        raise HTTPException(status_code=404, detail="Failed job not found")
+    return {"success": True}
+
+
+@app.delete("/api/downloads/{job_id}")
+async def remove_download(job_id: int, delete_file: bool = True):
+    if not await downloads.manager.remove(job_id, delete_file=delete_file):
+        raise HTTPException(status_code=404, detail="Download not found")
+    return {"success": True}
+
+
+@app.put("/api/downloads/bandwidth")
+def set_download_bandwidth(body: BandwidthRequest):
+    downloads.manager.set_bandwidth(body.kbps)
+    return {"success": True}
+
+
+@app.get("/api/imports/favorites")
+async def list_favorite_folders():
+    if not bili_api.get_login_status()["logged_in"]:
+        raise HTTPException(status_code=400, detail="Login required")
+    try:
+        return {"folders": await bili_api.get_favorite_folders()}
+    except Exception as e:
+        print(f"Get favorites error: {e}")
+        return {"error": str(e)}
+
+
+@app.get("/api/imports")
+def list_imports():
+    return {"jobs": importer.importer.list_jobs()}
+
+
+@app.get("/api/imports/{job_id}")
+def get_import(job_id: int):
+    job = importer.importer.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return job
+
+
+# 导入任务运行在事件循环中，创建和取消都要在事件循环线程里执行
+@app.post("/api/imports")
+async def start_import(body: ImportRequest):
+    if body.source not in importer.SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {body.source}")
+    if body.playlist_id and store.get_playlist_revision(body.playlist_id) is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    job = importer.importer.start(body.source, body.id, body.playlist_id, body.name, body.all_pages)
+    return {"success": True, "job": job}
+
+
+@app.delete("/api/imports/{job_id}")
+async def cancel_import(job_id: int):
+    if not importer.importer.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Import not found")
+    return {"success": True}
+
+
+@app.get("/stream")
+async def stream_audio(
+    request: Request,
+    url: Optional[str] = None,
+    bvid: Optional[str] = None,
+    cid: Optional[int] = None,
+    quality: Optional[str] = None,
+):
+    if bvid and cid:
+        # 离线下载的歌曲直接从磁盘返回，FileResponse 自带 Range 支持
+        path = downloads.manager.local_file(bvid, cid)
+        if path is not None:
+            return FileResponse(path, media_type="audio/mp4")
+    if bvid and cid and quality:
+        return await stream.proxy_cached(request, url, make_cache_key(bvid, cid, quality))
+    if not url:
+        raise HTTPException(status_code=400, detail="url is required")
+    return await stream.proxy(request, url)
+
+
+@app.get("/covers/{key}")
+async def get_cover(request: Request, key: str, size: Optional[int] = Query(None, ge=1)):
+    """size 为显示需要的像素尺寸，返回不小于它的最小缩略图；不传或超过最大缩略图时返回原图"""
+    if not covers.is_valid_key(key):
+        raise HTTPException(status_code=404, detail="Cover not found")
+
+    variant = thumbnails.pick_size(size) if size else None
+    # key 由源地址/内容哈希得到，同一个 key（和尺寸）的内容永远不变，可以长期缓存
+    etag = f'"{key}"' if variant is None else f'"{key}-{variant}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    # 只对已缓存或知道源地址、能按需下载的封面返回 304，不让客户端缓存一个本该 404 的地址
+    if request.headers.get("if-none-match") == etag and (covers.has(key) or covers.source(key)):
+        return Response(status_code=304, headers=headers)
+
+    entry = None
+    if variant is not None and await thumbnails.ensure(key, variant):
+        entry = covers.load(thumbnails.variant_key(key, variant))
+    if entry is None:
+        if variant is not None:
+            # 缩略图生成失败时退回原图，不缓存，之后还能再试
+            headers = {"ETag": f'"{key}"', "Cache-Control": "no-cache"}
+        # 延迟加载的封面可能还没有下载，这里按需补齐
+        await covers.ensure(key)
+        entry = covers.load(key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Cover not found")
+    path, content_type = entry
+    return FileResponse(path, media_type=content_type, headers=headers)
+
+
 @app.get("/api/login/status")
 def login_status():
     return bili_api.get_login_status()
@@ -208,57 +697,47 @@ async def login_info():
 @app.post("/api/logout")
 def logout():
     bili_api.logout()
+    events.bus.publish("login", {"status": "logout"})
     return {"success": True}
 
 
 @app.post("/api/login/qrcode/start")
 async def login_qrcode_start():
+    login_v2, _ = await _login_api()
     qr = login_v2.QrCodeLogin(platform=login_v2.QrCodeLoginChannel.WEB)
-    await qr.generate_qrcode()
+    async with ratelimit.limit("login"):
+        await qr.generate_qrcode()
     picture = qr.get_qrcode_picture()
     img_b64 = base64.b64encode(picture.content).decode("ascii")
-    session_id = uuid.uuid4().hex
-    qr_sessions[session_id] = qr
+    session = QrLoginSession(qr=qr)
+    session_id = qr_sessions.add(session)
+    qr_sessions.spawn(_poll_qr_login(session_id, session))
     return {"session_id": session_id, "qrcode_image": f"data:image/png;base64,{img_b64}"}
 
 
 @app.get("/api/login/qrcode/status")
-async def login_qrcode_status(session_id: str = Query(...)):
-    qr = qr_sessions.get(session_id)
-    if not qr:
+def login_qrcode_status(session_id: str = Query(...)):
+    # 上游状态由 _poll_qr_login 统一查询，这里只返回最近一次的结果
+    session = qr_sessions.get(session_id)
+    if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-
-    if qr.has_done():
-        cred = qr.get_credential()
-        bili_api.save_credential_to_file(cred)
-        qr_sessions.pop(session_id, None)
-        return {"status": "done"}
-
-    event = await qr.check_state()
-    if event == login_v2.QrCodeLoginEvents.SCAN:
-        status = "scan"
-    elif event == login_v2.QrCodeLoginEvents.CONF:
-        status = "confirm"
-    elif event == login_v2.QrCodeLoginEvents.TIMEOUT:
-        status = "timeout"
-        qr_sessions.pop(session_id, None)
-    else:
-        status = "unknown"
-    return {"status": status}
+    return {"status": session.status}
 
 
 @app.post("/api/login/sms/geetest/start")
 async def sms_geetest_start():
-    gee = Geetest()
-    await gee.generate_test(GeetestType.LOGIN)
+    _, geetest = await _login_api()
+    gee = geetest.Geetest()
+    await gee.generate_test(geetest.GeetestType.LOGIN)
     gee.start_geetest_server()
-    session_id = uuid.uuid4().hex
-    sms_sessions[session_id] = SmsLoginSession(geetest=gee)
+    session = SmsLoginSession(geetest=gee)
+    session_id = sms_sessions.add(session)
+    sms_sessions.spawn(_watch_geetest(session_id, session, gee, "geetest_done"))
     return {"session_id": session_id, "geetest_url": gee.get_geetest_server_url()}
 
 
 @app.get("/api/login/sms/geetest/status")
-def sms_geetest_status(session_id: str = Query(...)):
+async def sms_geetest_status(session_id: str = Query(...)):
     session = sms_sessions.get(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -273,12 +752,11 @@ async def sms_send_code(body: SmsSendCodeRequest):
     if not session.geetest.has_done():
         raise HTTPException(status_code=400, detail="Geetest not completed")
 
+    login_v2, _ = await _login_api()
     phone = login_v2.PhoneNumber(body.phone, "+86")
-    captcha_id = await login_v2.send_sms(phonenumber=phone, geetest=session.geetest)
-    try:
-        session.geetest.close_geetest_server()
-    except Exception:
-        pass
+    async with ratelimit.limit("login"):
+        captcha_id = await login_v2.send_sms(phonenumber=phone, geetest=session.geetest)
+    await asyncio.to_thread(_close_geetest, session.geetest)
     session.phone = phone
     session.captcha_id = captcha_id
     return {"status": "sms_sent"}
@@ -292,23 +770,27 @@ async def sms_verify(body: SmsVerifyCodeRequest):
     if not session.phone or not session.captcha_id:
         raise HTTPException(status_code=400, detail="SMS not sent")
 
-    cred_or_check = await login_v2.login_with_sms(
-        phonenumber=session.phone,
-        code=body.code,
-        captcha_id=session.captcha_id,
-    )
+    login_v2, geetest = await _login_api()
+    async with ratelimit.limit("login"):
+        cred_or_check = await login_v2.login_with_sms(
+            phonenumber=session.phone,
+            code=body.code,
+            captcha_id=session.captcha_id,
+        )
 
     if isinstance(cred_or_check, login_v2.LoginCheck):
-        gee = Geetest()
-        await gee.generate_test(type_=GeetestType.VERIFY)
+        gee = geetest.Geetest()
+        await gee.generate_test(type_=geetest.GeetestType.VERIFY)
         gee.start_geetest_server()
         session.login_check = cred_or_check
         session.verify_geetest = gee
+        sms_sessions.spawn(_watch_geetest(body.session_id, session, gee, "verify_geetest_done"))
         return {"status": "need_verify", "geetest_url": gee.get_geetest_server_url()}
 
     cred = cred_or_check
     bili_api.save_credential_to_file(cred)
-    session.done = True
+    sms_sessions.pop(body.session_id)
+    _publish_login("sms", body.session_id, "done")
     return {"status": "done"}
 
 
@@ -320,24 +802,41 @@ async def sms_verify_complete(body: SmsCheckCompleteRequest):
     if not session.verify_geetest.has_done():
         raise HTTPException(status_code=400, detail="Geetest not completed")
 
-    await session.login_check.send_sms(session.verify_geetest)
-    try:
-        session.verify_geetest.close_geetest_server()
-    except Exception:
-        pass
-    cred = await session.login_check.complete_check(body.code)
+    async with ratelimit.limit("login"):
+        await session.login_check.send_sms(session.verify_geetest)
+    await asyncio.to_thread(_close_geetest, session.verify_geetest)
+    async with ratelimit.limit("login"):
+        cred = await session.login_check.complete_check(body.code)
     bili_api.save_credential_to_file(cred)
-    session.done = True
+    sms_sessions.pop(body.session_id)
+    _publish_login("sms", body.session_id, "done")
     return {"status": "done"}
 
 
-@app.get("/", response_class=HTMLResponse)
-def index():
-    # --- 修复：使用动态计算的 web_path ---
-    index_file = os.path.join(web_path, "index.html")
-    with open(index_file, "r", encoding="utf-8") as f:
-        return f.read()
+def _asset_response(request: Request, path: str):
+    asset, hashed = assets.store.get(path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    encoding, body = assets.store.select(asset, request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": asset.etag(encoding),
+        # 带哈希的地址内容永不变化；其余地址（包括 index.html）每次用 ETag 协商
+        "Cache-Control": assets.IMMUTABLE if hashed else assets.REVALIDATE,
+    }
+    if asset.compressible:
+        headers["Vary"] = "Accept-Encoding"
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    if assets.etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=asset.media_type, headers=headers)
+
+
+@app.api_route("/", methods=["GET", "HEAD"])
+def index(request: Request):
+    return _asset_response(request, "index.html")
 
 
-# --- 修复：使用动态计算的 web_path ---
-app.mount("/static", StaticFiles(directory=web_path), name="static")
\ No newline at end of file
+@app.api_route(assets.STATIC_ROUTE + "/{path:path}", methods=["GET", "HEAD"])
+def static_file(request: Request, path: str):
+    return _asset_response(request, path)
\ No newline at end of file
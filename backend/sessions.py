@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+# 登录流程（扫码 / 短信）的会话表。
+# 用户关掉登录窗口后前端不会再来请求，会话只能靠过期清理；
+# 短信会话还持有本地极验服务（监听端口的线程），必须显式关闭。
+
+TTL = float(os.environ.get("BILIMUSIC_LOGIN_SESSION_TTL", 300))
+MAX_SESSIONS = int(os.environ.get("BILIMUSIC_LOGIN_SESSION_MAX", 16))
+SWEEP_INTERVAL = 30
+
+
+class SessionRegistry:
+    """
+    会话在 ttl 秒内没有被访问就过期；数量达到 max_size 时淘汰最久未访问的会话。
+    close(value) 负责释放会话占用的资源，可能阻塞，有事件循环时在线程池中执行。
+    """
+
+    def __init__(self, name, ttl=TTL, max_size=MAX_SESSIONS, close=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._close_fn = close
+        # session_id -> (value, 最后访问时间)，按访问顺序排列
+        self._sessions = OrderedDict()
+        self._sweeper = None
+        # 会话的后台任务（轮询登录状态等）；保留引用避免任务在完成前被回收
+        self._tasks = set()
+        self.counters = {"created": 0, "completed": 0, "expired": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _close(self, value):
+        if self._close_fn is None:
+            return
+        try:
+            self._close_fn(value)
+        except Exception as e:
+            print(f"Close {self.name} session error: {e}")
+
+    def _release(self, value):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._close(value)
+            return
+        loop.run_in_executor(None, self._close, value)
+
+    def add(self, value):
+        while len(self._sessions) >= self.max_size:
+            _, (oldest, _) = self._sessions.popitem(last=False)
+            self.counters["evicted"] += 1
+            self._release(oldest)
+        session_id = uuid.uuid4().hex
+        self._sessions[session_id] = (value, time.monotonic())
+        self.counters["created"] += 1
+        return session_id
+
+    def get(self, session_id):
+        """返回会话并刷新访问时间；不存在或已过期时返回 None"""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        value, last_access = entry
+        now = time.monotonic()
+        if now - last_access > self.ttl:
+            self.pop(session_id, "expired")
+            return None
+        self._sessions[session_id] = (value, now)
+        self._sessions.move_to_end(session_id)
+        return value
+
+    def pop(self, session_id, reason="completed"):
+        """移除会话并释放资源；reason 计入对应的计数"""
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return
+        self.counters[reason] += 1
+        self._release(entry[0])
+
+    def sweep(self):
+        deadline = time.monotonic() - self.ttl
+        expired = [sid for sid, (_, last_access) in self._sessions.items() if last_access < deadline]
+        for session_id in expired:
+            self.pop(session_id, "expired")
+        return len(expired)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.sweep()
+
+    def spawn(self, coro):
+        """启动一个属于会话的后台任务，stop() 时一并取消"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def start(self):
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        if self._sweeper is not None:
+            tasks.append(self._sweeper)
+            self._sweeper = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        values = [value for value, _ in self._sessions.values()]
+        self._sessions.clear()
+        await asyncio.gather(*[asyncio.to_thread(self._close, value) for value in values])
+
+    def stats(self):
+        return {"active": len(self._sessions), "ttl": self.ttl, "max_size": self.max_size, **self.counters}
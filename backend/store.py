@@ -1,82 +1,634 @@
 import json
 import os
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
 
+from . import covers, db, events, metrics, textindex
+
+DB_FILE = os.path.join("data", "library.db")
+# 旧版本使用的整文件 JSON 存储，首次启动时自动迁移到 DB_FILE
 DATA_FILE = os.path.join("data", "playlists.json")
 FAVORITE_ID = "favorite"
 FAVORITE_NAME = "My Favorite"
 
-def _load_data():
-    if not os.path.exists(DATA_FILE):
-        data = []
-    else:
+SONG_FIELDS = ("bvid", "cid", "title", "artist", "duration", "cover")
+
+_conn = None
+_lock = threading.RLock()
+
+
+def _migrate_v1(conn):
+    conn.execute("""
+        CREATE TABLE playlists (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            position INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE songs (
+            uuid TEXT PRIMARY KEY,
+            playlist_id TEXT NOT NULL REFERENCES playlists(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            bvid TEXT,
+            cid INTEGER,
+            title TEXT,
+            artist TEXT,
+            duration TEXT,
+            cover TEXT,
+            added_at TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX idx_songs_playlist ON songs(playlist_id, position)")
+    _import_legacy_json(conn)
+
+
+def _migrate_v2(conn):
+    # 旧数据把封面以 base64 data URI 内嵌在每首歌里，这里一次性转存到封面缓存
+    converted = {}
+    rows = conn.execute("SELECT uuid, cover FROM songs WHERE cover LIKE 'data:%'").fetchall()
+    for row in rows:
+        data_uri = row["cover"]
+        if data_uri not in converted:
+            converted[data_uri] = covers.import_data_uri(data_uri)
+        conn.execute("UPDATE songs SET cover = ? WHERE uuid = ?", (converted[data_uri], row["uuid"]))
+
+
+def _migrate_v3(conn):
+    # 歌曲时长以 "m:ss" 文本保存，增加秒数列以便在 SQL 中直接求和
+    conn.execute("ALTER TABLE songs ADD COLUMN duration_sec INTEGER")
+    rows = conn.execute("SELECT uuid, duration FROM songs").fetchall()
+    conn.executemany(
+        "UPDATE songs SET duration_sec = ? WHERE uuid = ?",
+        [(parse_duration(row["duration"]), row["uuid"]) for row in rows],
+    )
+
+
+def _migrate_v4(conn):
+    # 每次修改记录一条变更，rev 即整个曲库的版本号；播放列表的 revision 为最后一次修改它的 rev
+    conn.execute("ALTER TABLE playlists ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        CREATE TABLE changes (
+            rev INTEGER PRIMARY KEY AUTOINCREMENT,
+            playlist_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            data TEXT,
+            created_at TEXT NOT NULL
+        )
+    """)
+
+
+def _migrate_v5(conn):
+    # 曲库全文索引，rowid 与 songs 的 rowid 对应，由触发器随 songs/playlists 的修改同步更新。
+    # 分词在 Python 中完成（textindex.index_tokens，以 SQL 函数的形式注册到连接上）。
+    conn.execute("""
+        CREATE VIRTUAL TABLE song_fts USING fts5(
+            title, artist, playlist, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    # executescript 会先提交当前事务，所以逐条执行
+    triggers = [
+        """
+        CREATE TRIGGER songs_fts_insert AFTER INSERT ON songs BEGIN
+            INSERT INTO song_fts (rowid, title, artist, playlist) VALUES (
+                new.rowid, index_tokens(new.title), index_tokens(new.artist),
+                index_tokens((SELECT name FROM playlists WHERE id = new.playlist_id))
+            );
+        END
+        """,
+        """
+        CREATE TRIGGER songs_fts_delete AFTER DELETE ON songs BEGIN
+            DELETE FROM song_fts WHERE rowid = old.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER songs_fts_update AFTER UPDATE OF title, artist, playlist_id ON songs BEGIN
+            UPDATE song_fts SET
+                title = index_tokens(new.title),
+                artist = index_tokens(new.artist),
+                playlist = index_tokens((SELECT name FROM playlists WHERE id = new.playlist_id))
+            WHERE rowid = new.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER playlists_fts_rename AFTER UPDATE OF name ON playlists BEGIN
+            UPDATE song_fts SET playlist = index_tokens(new.name)
+            WHERE rowid IN (SELECT rowid FROM songs WHERE playlist_id = new.id);
+        END
+        """,
+    ]
+    for trigger in triggers:
+        conn.execute(trigger)
+    rebuild_search_index(conn)
+
+
+def _migrate_v6(conn):
+    # 歌曲位置之间留出空位，移动一首歌时只需要改它自己的 position
+    conn.execute("UPDATE songs SET position = (position + 1) * ?", (POSITION_GAP,))
+
+
+def _migrate_v7(conn):
+    # 播放列表名从歌曲索引中拆出来单独索引：改名时只需更新一行，不必重写列表里每首歌的索引
+    for trigger in ("songs_fts_insert", "songs_fts_update", "playlists_fts_rename"):
+        conn.execute(f"DROP TRIGGER {trigger}")
+    conn.execute("DROP TABLE song_fts")
+    conn.execute("""
+        CREATE VIRTUAL TABLE song_fts USING fts5(
+            title, artist, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE playlist_fts USING fts5(
+            name, id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    triggers = [
+        """
+        CREATE TRIGGER songs_fts_insert AFTER INSERT ON songs BEGIN
+            INSERT INTO song_fts (rowid, title, artist)
+            VALUES (new.rowid, index_tokens(new.title), index_tokens(new.artist));
+        END
+        """,
+        """
+        CREATE TRIGGER songs_fts_update AFTER UPDATE OF title, artist ON songs BEGIN
+            UPDATE song_fts SET title = index_tokens(new.title), artist = index_tokens(new.artist)
+            WHERE rowid = new.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER playlists_fts_insert AFTER INSERT ON playlists BEGIN
+            INSERT INTO playlist_fts (name, id) VALUES (index_tokens(new.name), new.id);
+        END
+        """,
+        """
+        CREATE TRIGGER playlists_fts_delete AFTER DELETE ON playlists BEGIN
+            DELETE FROM playlist_fts WHERE id = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER playlists_fts_rename AFTER UPDATE OF name ON playlists BEGIN
+            UPDATE playlist_fts SET name = index_tokens(new.name) WHERE id = new.id;
+        END
+        """,
+    ]
+    for trigger in triggers:
+        conn.execute(trigger)
+    rebuild_search_index(conn)
+
+
+_MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6, _migrate_v7]
+
+# 分页接口每页的默认/最大歌曲数
+SONGS_PAGE_SIZE = 100
+SONGS_PAGE_MAX = 500
+# 曲库搜索默认/最多返回的条数
+SEARCH_LIMIT = 50
+SEARCH_MAX = 200
+# 命中数超过该值时不再逐条计算 bm25，改为按加入时间倒序返回，保证宽泛的查询也足够快
+SEARCH_RANK_MAX = 2000
+# 相邻歌曲 position 的间隔；移动歌曲时取前后两首的中间值，没有空位时整个列表重新编号
+POSITION_GAP = 1024
+# 保留的变更记录条数；客户端落后更多时需要全量刷新
+CHANGES_KEEP = 2000
+# 单次 changes 请求最多返回的变更数，超过时同样要求全量刷新
+CHANGES_MAX = 500
+
+
+def parse_duration(text):
+    """ "m:ss" / "h:mm:ss" -> 秒数，无法解析时返回 None"""
+    if isinstance(text, (int, float)):
+        return int(text)
+    try:
+        seconds = 0
+        for part in str(text).split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def format_duration(seconds):
+    """秒数 -> "m:ss"，与前端 formatTime 一致"""
+    if not seconds:
+        return "0:00"
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def _import_legacy_json(conn):
+    """把旧的 playlists.json 导入数据库（只在新建数据库时执行一次）"""
+    data = []
+    if os.path.exists(DATA_FILE):
         try:
             with open(DATA_FILE, "r", encoding="utf-8") as f:
                 data = json.load(f)
-        except:
+        except Exception as e:
+            print(f"Load legacy playlists error: {e}")
             data = []
 
+    has_favorite = False
+    for position, p in enumerate(data):
+        playlist_id = p.get("id") or str(uuid.uuid4())
+        name = p.get("name") or ""
+        if not has_favorite and (playlist_id == FAVORITE_ID or name == FAVORITE_NAME):
+            playlist_id, name = FAVORITE_ID, FAVORITE_NAME
+            has_favorite = True
+        conn.execute(
+            "INSERT OR IGNORE INTO playlists (id, name, created_at, position) VALUES (?, ?, ?, ?)",
+            (playlist_id, name, p.get("created_at") or datetime.now().isoformat(), position),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO songs (uuid, playlist_id, position, bvid, cid, title, artist, duration, cover, added_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    s.get("uuid") or str(uuid.uuid4()),
+                    playlist_id,
+                    i,
+                    *(s.get(k) for k in SONG_FIELDS),
+                    s.get("added_at"),
+                )
+                for i, s in enumerate(p.get("songs") or [])
+            ],
+        )
+
     # Ensure fixed "My Favorite" playlist exists and has stable id/name
-    favorite = None
-    for p in data:
-        if p.get("id") == FAVORITE_ID or p.get("name") == FAVORITE_NAME:
-            favorite = p
-            break
+    if not has_favorite:
+        conn.execute(
+            "INSERT INTO playlists (id, name, created_at, position) VALUES (?, ?, ?, ?)",
+            (FAVORITE_ID, FAVORITE_NAME, datetime.now().isoformat(), len(data)),
+        )
 
-    if favorite is None:
-        favorite = {
-            "id": FAVORITE_ID,
-            "name": FAVORITE_NAME,
-            "created_at": datetime.now().isoformat(),
-            "songs": []
-        }
-        data.append(favorite)
-    else:
-        favorite["id"] = FAVORITE_ID
-        favorite["name"] = FAVORITE_NAME
 
-    _save_data(data)
-    return data
+def rebuild_search_index(conn):
+    """从 songs 表重建全文索引（songs 的 rowid 发生变化后，例如 VACUUM，需要调用）"""
+    conn.execute("DELETE FROM song_fts")
+    conn.execute("""
+        INSERT INTO song_fts (rowid, title, artist)
+        SELECT rowid, index_tokens(title), index_tokens(artist) FROM songs
+    """)
+    # _migrate_v5 执行时还没有 playlist_fts（由 _migrate_v7 创建并重建）
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'playlist_fts'").fetchone():
+        conn.execute("DELETE FROM playlist_fts")
+        conn.execute("INSERT INTO playlist_fts (name, id) SELECT index_tokens(name), id FROM playlists")
+
 
-def _save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def _get_conn():
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                conn = db.connect(DB_FILE)
+                conn.create_function("index_tokens", 1, textindex.index_tokens, deterministic=True)
+                old_version = db.migrate(conn, _MIGRATIONS)
+                if old_version == 0 and os.path.exists(DATA_FILE):
+                    # 迁移成功后保留一份旧文件备份，避免之后被误读
+                    os.replace(DATA_FILE, DATA_FILE + ".migrated")
+                _conn = conn
+    return _conn
 
+
+def _song_from_row(row):
+    song = {k: row[k] for k in SONG_FIELDS}
+    song["duration_sec"] = row["duration_sec"]
+    song["added_at"] = row["added_at"]
+    song["uuid"] = row["uuid"]
+    return song
+
+
+def _playlist_from_row(row):
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "created_at": row["created_at"],
+        "songs": [],
+    }
+
+
+def _playlist_exists(conn, playlist_id):
+    return conn.execute("SELECT 1 FROM playlists WHERE id = ?", (playlist_id,)).fetchone() is not None
+
+
+def _record(conn, playlist_id, op, data=None):
+    """记录一条变更并更新播放列表的 revision，返回新的曲库版本号"""
+    rev = conn.execute(
+        "INSERT INTO changes (playlist_id, op, data, created_at) VALUES (?, ?, ?, ?)",
+        (playlist_id, op, json.dumps(data, ensure_ascii=False), datetime.now().isoformat()),
+    ).lastrowid
+    conn.execute("UPDATE playlists SET revision = ? WHERE id = ?", (rev, playlist_id))
+    if rev % 100 == 0:
+        conn.execute("DELETE FROM changes WHERE rev <= ?", (rev - CHANGES_KEEP,))
+    return rev
+
+
+def _library_revision(conn):
+    # AUTOINCREMENT 的序号不会因为清理旧记录而回退
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return row[0] if row else 0
+
+
+@contextmanager
+def _mutation(conn):
+    """写事务；提交后曲库版本号有变化时推送 library 事件"""
+    with _lock:
+        before = _library_revision(conn)
+        with db.transaction(conn):
+            yield conn
+        revision = _library_revision(conn)
+    if revision != before:
+        events.bus.publish("library", {"revision": revision})
+
+
+def _summaries(conn, ids=None):
+    sql = """
+        SELECT p.id, p.name, p.created_at, p.revision,
+               COUNT(s.uuid) AS song_count,
+               COALESCE(SUM(s.duration_sec), 0) AS total_duration,
+               (SELECT cover FROM songs WHERE playlist_id = p.id ORDER BY position DESC LIMIT 1) AS cover
+        FROM playlists p LEFT JOIN songs s ON s.playlist_id = p.id
+    """
+    params = ()
+    if ids is not None:
+        sql += f" WHERE p.id IN ({','.join('?' * len(ids))})"
+        params = tuple(ids)
+    sql += " GROUP BY p.id ORDER BY p.position"
+    return [dict(row) for row in conn.execute(sql, params)]
+
+
+def _next_position(conn, playlist_id):
+    # (playlist_id, position) 上有索引，取最大值是一次索引查找
+    return conn.execute(
+        "SELECT COALESCE(MAX(position), 0) + ? FROM songs WHERE playlist_id = ?",
+        (POSITION_GAP, playlist_id),
+    ).fetchone()[0]
+
+
+def _insert_song(conn, playlist_id, song_info):
+    position = _next_position(conn, playlist_id)
+    song_entry = {k: song_info.get(k) for k in SONG_FIELDS}
+    song_entry["duration_sec"] = parse_duration(song_entry["duration"])
+    song_entry["added_at"] = datetime.now().isoformat()
+    song_entry["uuid"] = str(uuid.uuid4())  # Unique ID for this instance in playlist
+    conn.execute(
+        "INSERT INTO songs (uuid, playlist_id, position, bvid, cid, title, artist, duration, cover, added_at, duration_sec)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            song_entry["uuid"],
+            playlist_id,
+            position,
+            *(song_entry[k] for k in SONG_FIELDS),
+            song_entry["added_at"],
+            song_entry["duration_sec"],
+        ),
+    )
+    _record(conn, playlist_id, "add", song_entry)
+    return song_entry
+
+
+@metrics.timed_store
 def get_all_playlists():
-    return _load_data()
+    conn = _get_conn()
+    with _lock:
+        playlists = [_playlist_from_row(r) for r in conn.execute("SELECT * FROM playlists ORDER BY position")]
+        by_id = {p["id"]: p for p in playlists}
+        for row in conn.execute("SELECT * FROM songs ORDER BY playlist_id, position"):
+            p = by_id.get(row["playlist_id"])
+            if p is not None:
+                p["songs"].append(_song_from_row(row))
+    return playlists
+
+
+@metrics.timed_store
+def get_library_revision():
+    conn = _get_conn()
+    with _lock:
+        return _library_revision(conn)
+
+
+@metrics.timed_store
+def get_playlist_revision(playlist_id):
+    """播放列表不存在时返回 None"""
+    conn = _get_conn()
+    with _lock:
+        row = conn.execute("SELECT revision FROM playlists WHERE id = ?", (playlist_id,)).fetchone()
+    return row[0] if row else None
+
+
+@metrics.timed_store
+def get_playlist_summaries():
+    """每个播放列表的歌曲数、总时长（秒）和封面（最后一首歌的封面），不包含歌曲列表"""
+    conn = _get_conn()
+    with _lock:
+        return {"revision": _library_revision(conn), "playlists": _summaries(conn)}
+
+
+@metrics.timed_store
+def get_changes(since, limit=CHANGES_MAX):
+    """
+    返回版本号 since 之后的变更，以及被这些变更影响、目前仍存在的播放列表摘要。
+    变更记录已被清理、数量超过 limit 或 since 比当前版本还新时返回 reset=True，
+    客户端应当全量刷新。
+    """
+    conn = _get_conn()
+    with _lock:
+        revision = _library_revision(conn)
+        oldest = conn.execute("SELECT MIN(rev) FROM changes").fetchone()[0]
+        if since > revision or revision - since > limit or (oldest is not None and since < oldest - 1):
+            return {"revision": revision, "reset": True, "changes": [], "playlists": []}
+        rows = conn.execute("SELECT * FROM changes WHERE rev > ? ORDER BY rev", (since,)).fetchall()
+        changes = [
+            {"rev": r["rev"], "playlist_id": r["playlist_id"], "op": r["op"], "data": json.loads(r["data"])}
+            for r in rows
+        ]
+        touched = list(dict.fromkeys(c["playlist_id"] for c in changes))
+        playlists = _summaries(conn, touched) if touched else []
+    return {"revision": revision, "reset": False, "changes": changes, "playlists": playlists}
+
+
+@metrics.timed_store
+def get_songs_page(playlist_id, cursor=None, limit=SONGS_PAGE_SIZE):
+    """
+    按顺序分页读取播放列表中的歌曲。cursor 为上一页返回的 next_cursor，
+    没有更多歌曲时 next_cursor 为 None。播放列表不存在时返回 None。
+    """
+    limit = max(1, min(limit, SONGS_PAGE_MAX))
+    after = int(cursor) if cursor else -1
+    conn = _get_conn()
+    with _lock:
+        if not _playlist_exists(conn, playlist_id):
+            return None
+        rows = conn.execute(
+            "SELECT * FROM songs WHERE playlist_id = ? AND position > ? ORDER BY position LIMIT ?",
+            (playlist_id, after, limit + 1),
+        ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [_song_from_row(r) for r in rows],
+        "next_cursor": str(rows[-1]["position"]) if has_more else None,
+    }
+
+
+@metrics.timed_store
+def get_songs(playlist_id):
+    """播放列表中的全部歌曲，播放列表不存在时返回 None"""
+    conn = _get_conn()
+    with _lock:
+        if not _playlist_exists(conn, playlist_id):
+            return None
+        return [_song_from_row(r) for r in conn.execute(
+            "SELECT * FROM songs WHERE playlist_id = ? ORDER BY position", (playlist_id,)
+        )]
+
+
+@metrics.timed_store
+def get_song_keys(playlist_id):
+    """
+    只返回 [uuid, bvid, cid] 列表（已序列化的 JSON 文本），供前端判断某首歌是否在列表中。
+    JSON 直接由 SQLite 生成，大列表不必先构造成 Python 对象。
+    """
+    conn = _get_conn()
+    with _lock:
+        if not _playlist_exists(conn, playlist_id):
+            return None
+        return conn.execute(
+            "SELECT json_group_array(json_array(uuid, bvid, cid)) FROM"
+            " (SELECT uuid, bvid, cid FROM songs WHERE playlist_id = ? ORDER BY position)",
+            (playlist_id,),
+        ).fetchone()[0]
+
+
+_SEARCH_SELECT = "SELECT s.rowid AS song_rowid, s.*, p.name AS playlist_name FROM {source} JOIN playlists p ON p.id = s.playlist_id"
+
 
+def _search_recent(conn, conditions, params, limit):
+    """满足 conditions 的最近加入的歌曲。NOT INDEXED 让 SQLite 按 rowid 倒序扫描、取够 limit 条就停，
+    而不是先取出所有符合条件的歌曲再排序"""
+    sql = _SEARCH_SELECT.format(source="songs s NOT INDEXED")
+    sql += " WHERE " + " AND ".join(conditions) + " ORDER BY s.rowid DESC LIMIT ?"
+    return conn.execute(sql, (*params, limit)).fetchall()
+
+
+def _search_hits(conn, expression, limit, conditions=(), params=()):
+    """song_fts 命中 expression 且满足 conditions 的歌曲，按 bm25 排序（命中过多时按加入时间倒序）"""
+    matched = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT 1 FROM song_fts WHERE song_fts MATCH ? LIMIT ?)",
+        (expression, SEARCH_RANK_MAX + 1),
+    ).fetchone()[0]
+    if matched > SEARCH_RANK_MAX:
+        if conditions:
+            return _search_recent(
+                conn, ["s.rowid IN (SELECT rowid FROM song_fts WHERE song_fts MATCH ?)", *conditions],
+                (expression, *params), limit,
+            )
+        hits = "SELECT rowid, -rowid AS rank FROM song_fts WHERE song_fts MATCH ? ORDER BY rowid DESC"
+    else:
+        hits = "SELECT rowid, bm25(song_fts, 10.0, 5.0) AS rank FROM song_fts WHERE song_fts MATCH ? ORDER BY rank"
+    inner = ()
+    if not conditions:
+        # 没有额外条件时直接在索引查询里取前 limit 条
+        hits += " LIMIT ?"
+        inner = (limit,)
+    sql = _SEARCH_SELECT.format(source=f"({hits}) AS hits JOIN songs s ON s.rowid = hits.rowid")
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY hits.rank LIMIT ?"
+    return conn.execute(sql, (expression, *inner, *params, limit)).fetchall()
+
+
+@metrics.timed_store
+def search_songs(query, limit=SEARCH_LIMIT):
+    """
+    在所有播放列表中按标题、UP 主和播放列表名搜索歌曲，每个词都要在这三者之一中出现。
+    按 bm25 相关度排序（命中过多时按加入时间倒序）；只靠播放列表名命中的歌曲排在后面，按加入时间倒序。
+    返回的每首歌带有 playlist_id 和 playlist_name。
+    """
+    terms = textindex.match_terms(query)
+    if not terms:
+        return []
+    limit = max(1, min(limit, SEARCH_MAX))
+    conn = _get_conn()
+    with _lock:
+        # 每个词命中的播放列表；播放列表的数量很少，逐词查询很快
+        named = [
+            [r[0] for r in conn.execute("SELECT id FROM playlist_fts WHERE playlist_fts MATCH ?", (term,))]
+            for term in terms
+        ]
+        # 不在任何播放列表名里的词必须命中歌曲本身；其余的词命中歌曲或所在播放列表的名字都可以
+        song_terms = [term for term, ids in zip(terms, named) if not ids]
+        conditions, params = [], []
+        for term, ids in zip(terms, named):
+            if ids:
+                conditions.append(
+                    "(s.rowid IN (SELECT rowid FROM song_fts WHERE song_fts MATCH ?)"
+                    f" OR s.playlist_id IN ({','.join('?' * len(ids))}))"
+                )
+                params += [term, *ids]
+
+        if song_terms:
+            rows = _search_hits(conn, " ".join(song_terms), limit, conditions, params)
+        else:
+            # 所有词都出现在某个播放列表名里：先返回歌曲本身就命中全部词的，再按加入时间倒序补上其余的
+            rows = _search_hits(conn, " ".join(terms), limit)
+            if len(rows) < limit:
+                exclude = [row["song_rowid"] for row in rows]
+                conditions.append(f"s.rowid NOT IN ({','.join('?' * len(exclude))})")
+                rows += _search_recent(conn, conditions, (*params, *exclude), limit - len(rows))
+    results = []
+    for row in rows:
+        song = _song_from_row(row)
+        song["playlist_id"] = row["playlist_id"]
+        song["playlist_name"] = row["playlist_name"]
+        results.append(song)
+    return results
+
+
+@metrics.timed_store
 def create_playlist(name):
-    data = _load_data()
+    conn = _get_conn()
     new_playlist = {
         "id": str(uuid.uuid4()),
         "name": name,
         "created_at": datetime.now().isoformat(),
         "songs": []
     }
-    data.append(new_playlist)
-    _save_data(data)
+    with _mutation(conn):
+        position = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM playlists").fetchone()[0]
+        conn.execute(
+            "INSERT INTO playlists (id, name, created_at, position) VALUES (?, ?, ?, ?)",
+            (new_playlist["id"], name, new_playlist["created_at"], position),
+        )
+        _record(conn, new_playlist["id"], "create", {"name": name})
     return new_playlist
 
+
+@metrics.timed_store
 def delete_playlist(playlist_id):
     if playlist_id == FAVORITE_ID:
         return True
-    data = _load_data()
-    data = [p for p in data if p["id"] != playlist_id]
-    _save_data(data)
+    conn = _get_conn()
+    with _mutation(conn):
+        # songs 通过外键 ON DELETE CASCADE 一并删除
+        if conn.execute("DELETE FROM playlists WHERE id = ?", (playlist_id,)).rowcount:
+            _record(conn, playlist_id, "delete")
     return True
 
+
+@metrics.timed_store
 def rename_playlist(playlist_id, new_name):
     if playlist_id == FAVORITE_ID:
         return True
-    data = _load_data()
-    for p in data:
-        if p["id"] == playlist_id:
-            p["name"] = new_name
-            break
-    _save_data(data)
+    conn = _get_conn()
+    with _mutation(conn):
+        if conn.execute("UPDATE playlists SET name = ? WHERE id = ?", (new_name, playlist_id)).rowcount:
+            _record(conn, playlist_id, "rename", {"name": new_name})
     return True
 
+
+@metrics.timed_store
 def add_song(playlist_id, song_info):
     """
     song_info: {
@@ -88,44 +640,202 @@ def add_song(playlist_id, song_info):
         "cover": str
     }
     """
-    data = _load_data()
-    for p in data:
-        if p["id"] == playlist_id:
-            # Check for duplicates? Maybe not strictly required, but good practice.
-            # For now, allow duplicates or just append.
-            song_entry = song_info.copy()
-            song_entry["added_at"] = datetime.now().isoformat()
-            song_entry["uuid"] = str(uuid.uuid4()) # Unique ID for this instance in playlist
-            p["songs"].append(song_entry)
-            _save_data(data)
-            return True
-    return False
+    conn = _get_conn()
+    with _mutation(conn):
+        if not _playlist_exists(conn, playlist_id):
+            return False
+        # Duplicates are allowed, each entry gets its own uuid.
+        _insert_song(conn, playlist_id, song_info)
+    return True
 
+
+@metrics.timed_store
 def remove_song(playlist_id, song_uuid):
-    data = _load_data()
-    for p in data:
-        if p["id"] == playlist_id:
-            p["songs"] = [s for s in p["songs"] if s.get("uuid") != song_uuid]
-            _save_data(data)
-            return True
-    return False
+    conn = _get_conn()
+    with _mutation(conn):
+        if not _playlist_exists(conn, playlist_id):
+            return False
+        if conn.execute("DELETE FROM songs WHERE uuid = ? AND playlist_id = ?", (song_uuid, playlist_id)).rowcount:
+            _record(conn, playlist_id, "remove", {"uuid": song_uuid})
+    return True
 
+
+@metrics.timed_store
 def reorder_songs(playlist_id, song_uuids):
-    data = _load_data()
-    for p in data:
-        if p["id"] == playlist_id:
-            # Create a map for O(1) lookup
-            song_map = {s["uuid"]: s for s in p["songs"]}
-            new_list = []
-            for uid in song_uuids:
-                if uid in song_map:
-                    new_list.append(song_map[uid])
-            # Append any that might be missing from the input list (safety)
-            existing_ids = set(song_uuids)
-            for s in p["songs"]:
-                if s["uuid"] not in existing_ids:
-                    new_list.append(s)
-            p["songs"] = new_list
-            _save_data(data)
-            return True
-    return False
+    conn = _get_conn()
+    with _mutation(conn):
+        if not _playlist_exists(conn, playlist_id):
+            return False
+        current = [r["uuid"] for r in conn.execute(
+            "SELECT uuid FROM songs WHERE playlist_id = ? ORDER BY position", (playlist_id,)
+        )]
+        existing = set(current)
+        new_list = []
+        seen = set()
+        for uid in song_uuids:
+            if uid in existing and uid not in seen:
+                new_list.append(uid)
+                seen.add(uid)
+        # Append any that might be missing from the input list (safety)
+        new_list.extend(uid for uid in current if uid not in seen)
+        conn.executemany(
+            "UPDATE songs SET position = ? WHERE uuid = ?",
+            [((i + 1) * POSITION_GAP, uid) for i, uid in enumerate(new_list)],
+        )
+        if new_list != current:
+            # 只记录发生了重排，客户端收到后重新加载该列表；不保存整个顺序，避免变更记录随列表长度膨胀
+            _record(conn, playlist_id, "reorder")
+    return True
+
+
+class _OperationError(Exception):
+    pass
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _find_song(conn, playlist_id, song_uuid):
+    row = conn.execute(
+        "SELECT * FROM songs WHERE uuid = ? AND playlist_id = ?", (song_uuid, playlist_id)
+    ).fetchone()
+    if row is None:
+        raise _OperationError("Song not found")
+    return row
+
+
+def _require_playlist(conn, playlist_id):
+    if not _playlist_exists(conn, playlist_id):
+        raise _OperationError("Playlist not found")
+
+
+def _find_duplicate(conn, playlist_id, bvid, cid):
+    row = conn.execute(
+        "SELECT uuid FROM songs WHERE playlist_id = ? AND bvid = ? AND cid = ? LIMIT 1",
+        (playlist_id, bvid, cid),
+    ).fetchone()
+    return row["uuid"] if row else None
+
+
+def _respace(conn, playlist_id):
+    """按当前顺序重新编号，恢复相邻歌曲之间的空位"""
+    uuids = [r["uuid"] for r in conn.execute(
+        "SELECT uuid FROM songs WHERE playlist_id = ? ORDER BY position", (playlist_id,)
+    )]
+    conn.executemany(
+        "UPDATE songs SET position = ? WHERE uuid = ?",
+        [((i + 1) * POSITION_GAP, uid) for i, uid in enumerate(uuids)],
+    )
+
+
+def _reposition(conn, playlist_id, song_uuid, index):
+    """把歌曲移动到列表的第 index 位，只修改这首歌的 position（同一列表内的 position 互不相同）"""
+    position = conn.execute("SELECT position FROM songs WHERE uuid = ?", (song_uuid,)).fetchone()[0]
+    count = conn.execute("SELECT COUNT(*) FROM songs WHERE playlist_id = ?", (playlist_id,)).fetchone()[0]
+    index = max(0, min(index, count - 1))
+    current = conn.execute(
+        "SELECT COUNT(*) FROM songs WHERE playlist_id = ? AND position < ?", (playlist_id, position)
+    ).fetchone()[0]
+    if index == current:
+        return
+    for _ in range(2):
+        # 去掉这首歌之后，新位置前后的两首歌
+        neighbours = [r[0] for r in conn.execute(
+            "SELECT position FROM songs WHERE playlist_id = ? AND position != ? ORDER BY position LIMIT 2 OFFSET ?",
+            (playlist_id, position, max(index - 1, 0)),
+        )]
+        if index == 0:
+            before, after = 0, neighbours[0]
+        else:
+            before = neighbours[0]
+            after = neighbours[1] if len(neighbours) > 1 else before + 2 * POSITION_GAP
+        if after - before >= 2:
+            break
+        _respace(conn, playlist_id)
+        position = conn.execute("SELECT position FROM songs WHERE uuid = ?", (song_uuid,)).fetchone()[0]
+    conn.execute("UPDATE songs SET position = ? WHERE uuid = ?", ((before + after) // 2, song_uuid))
+    _record(conn, playlist_id, "move", {"uuid": song_uuid, "index": index})
+
+
+def _apply_operation(conn, operation, dedupe):
+    op = operation.get("op")
+    playlist_id = operation.get("playlist_id")
+    _require_playlist(conn, playlist_id)
+
+    if op == "add":
+        song = operation.get("song") or {}
+        if dedupe:
+            existing = _find_duplicate(conn, playlist_id, song.get("bvid"), song.get("cid"))
+            if existing:
+                return {"ok": True, "skipped": "duplicate", "uuid": existing}
+        return {"ok": True, "uuid": _insert_song(conn, playlist_id, song)["uuid"]}
+
+    if op == "remove":
+        song_uuid = _find_song(conn, playlist_id, operation.get("uuid"))["uuid"]
+        conn.execute("DELETE FROM songs WHERE uuid = ?", (song_uuid,))
+        _record(conn, playlist_id, "remove", {"uuid": song_uuid})
+        return {"ok": True, "uuid": song_uuid}
+
+    if op in ("move", "copy"):
+        row = _find_song(conn, playlist_id, operation.get("uuid"))
+        target_id = operation.get("to_playlist_id") or playlist_id
+        index = operation.get("index")
+        _require_playlist(conn, target_id)
+        if op == "copy" or target_id != playlist_id:
+            if dedupe:
+                existing = _find_duplicate(conn, target_id, row["bvid"], row["cid"])
+                if existing:
+                    return {"ok": True, "skipped": "duplicate", "uuid": existing}
+
+        if op == "copy":
+            song_uuid = _insert_song(conn, target_id, {k: row[k] for k in SONG_FIELDS})["uuid"]
+        else:
+            song_uuid = row["uuid"]
+            if target_id != playlist_id:
+                position = _next_position(conn, target_id)
+                conn.execute(
+                    "UPDATE songs SET playlist_id = ?, position = ? WHERE uuid = ?",
+                    (target_id, position, song_uuid),
+                )
+                _record(conn, playlist_id, "remove", {"uuid": song_uuid})
+                _record(conn, target_id, "add", _song_from_row(_find_song(conn, target_id, song_uuid)))
+            elif index is None:
+                raise _OperationError("Moving within a playlist requires an index")
+        if index is not None:
+            _reposition(conn, target_id, song_uuid, index)
+        return {"ok": True, "uuid": song_uuid}
+
+    raise _OperationError(f"Unknown operation: {op}")
+
+
+@metrics.timed_store
+def apply_batch(operations, dedupe=False, atomic=True):
+    """
+    在一个事务里依次执行一组歌曲操作，只产生一次提交：
+        add    {playlist_id, song}
+        remove {playlist_id, uuid}
+        move   {playlist_id, uuid, to_playlist_id?, index?}
+        copy   {playlist_id, uuid, to_playlist_id?, index?}
+    dedupe=True 时，目标列表里已有相同 (bvid, cid) 的 add/copy/跨列表 move 会被跳过。
+    atomic=True 时任意一个操作失败则整批回滚（applied=False）；
+    否则只撤销失败的那个操作，其余照常提交。
+    返回 {"applied": bool, "results": [每个操作的结果]}。
+    """
+    conn = _get_conn()
+    results = []
+    try:
+        with _mutation(conn):
+            for operation in operations:
+                conn.execute("SAVEPOINT batch_op")
+                try:
+                    results.append(_apply_operation(conn, operation, dedupe))
+                except _OperationError as e:
+                    conn.execute("ROLLBACK TO batch_op")
+                    results.append({"ok": False, "error": str(e)})
+                conn.execute("RELEASE batch_op")
+            if atomic and not all(r["ok"] for r in results):
+                raise _Rollback()
+    except _Rollback:
+        return {"applied": False, "results": results}
+    return {"applied": True, "results": results}
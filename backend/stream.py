@@ -0,0 +1,399 @@
+import asyncio
+import os
+import re
+import time
+
+import httpx
+from fastapi.responses import Response, StreamingResponse
+
+from . import cdn
+from . import metrics
+from . import net
+from .audio_cache import cache as audio_cache
+
+# /stream 音频代理。
+# 所有请求共用 net 模块里长连接的 media 客户端：CDN 的 TLS 会话和连接在多次
+# seek（新的 Range 请求）之间复用，代理本身也不再占用线程池里的工作线程。
+
+# 每次转发给浏览器的最大块大小，可以通过环境变量调整
+CHUNK_SIZE = int(os.environ.get("BILIMUSIC_STREAM_CHUNK_SIZE", 256 * 1024))
+# 有备用节点时，上游吞吐低于该下限（KB/s）或超过 STALL_TIMEOUT 秒没有数据就切换节点
+MIN_THROUGHPUT = int(os.environ.get("BILIMUSIC_STREAM_MIN_KBPS", 48)) * 1024
+THROUGHPUT_WINDOW = 2.0
+STALL_TIMEOUT = float(os.environ.get("BILIMUSIC_STREAM_STALL_TIMEOUT", 8))
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+PASSTHROUGH_HEADERS = ["Content-Length", "Content-Range", "Accept-Ranges", "Content-Encoding"]
+
+
+class UpstreamError(Exception):
+    pass
+
+
+async def _open_upstream(url, range_header=None, retries=0):
+    client = net.get_client("media")
+    headers = {"Range": range_header} if range_header else {}
+    # 计时到收到响应头为止，即 CDN 的首字节时间
+    with metrics.upstream("cdn"):
+        return await net.send(client.build_request("GET", url, headers=headers), client, retries, stream=True)
+
+
+async def _open_first(urls, range_header=None):
+    """
+    依次尝试候选地址，返回 (响应, 从该响应地址开始的剩余候选地址)。
+    连接失败或返回错误状态码的节点会被记录并跳过；最后一个候选的错误响应原样返回。
+    """
+    last_error = None
+    for i, url in enumerate(urls):
+        start = time.perf_counter()
+        try:
+            # 还有备用节点时直接切换，只在最后一个候选上退避重试
+            retries = net.RETRIES if i == len(urls) - 1 else 0
+            resp = await _open_upstream(url, range_header, retries)
+        except httpx.HTTPError as e:
+            cdn.record_failure(url)
+            last_error = e
+            continue
+        if resp.status_code >= 400 and resp.status_code != 416 and i < len(urls) - 1:
+            await resp.aclose()
+            cdn.record_failure(url)
+            continue
+        cdn.record_latency(url, time.perf_counter() - start)
+        return resp, urls[i:]
+    raise last_error
+
+
+def _upstream_span(resp):
+    """从上游响应中取出 (本次数据起始偏移, 结束偏移, 文件总大小)"""
+    if resp.status_code == 206:
+        m = _CONTENT_RANGE_RE.match(resp.headers.get("Content-Range", ""))
+        if m:
+            return int(m.group(1)), int(m.group(2)), int(m.group(3))
+    elif resp.status_code == 200 and "Content-Length" in resp.headers:
+        total = int(resp.headers["Content-Length"])
+        return 0, total - 1, total
+    return None, None, None
+
+
+async def _guarded_chunks(resp, url, can_fail_over):
+    """
+    读取上游数据。可以切换节点时，统计等待上游的时间（不含浏览器消费的时间），
+    吞吐低于下限或长时间没有数据就抛出 UpstreamError。
+    """
+    chunks = resp.aiter_raw(CHUNK_SIZE).__aiter__()
+    total_bytes = total_wait = 0
+    window_bytes = window_wait = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            if can_fail_over:
+                chunk = await asyncio.wait_for(chunks.__anext__(), STALL_TIMEOUT)
+            else:
+                chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            break
+        except asyncio.TimeoutError:
+            raise UpstreamError(f"no data for {STALL_TIMEOUT}s")
+        waited = time.perf_counter() - start
+        total_bytes += len(chunk)
+        total_wait += waited
+        window_bytes += len(chunk)
+        window_wait += waited
+        if window_wait >= THROUGHPUT_WINDOW:
+            rate = window_bytes / window_wait
+            if can_fail_over and rate < MIN_THROUGHPUT:
+                raise UpstreamError(f"throughput {rate / 1024:.1f} KB/s below floor")
+            window_bytes = window_wait = 0
+        if chunk:
+            yield chunk
+    if total_wait > 0 and total_bytes >= CHUNK_SIZE:
+        cdn.record_throughput(url, total_bytes / total_wait)
+
+
+async def _iter_upstream(resp, urls, start, end):
+    """
+    产出 resp（数据从 start 开始，对应 urls[0]）中到 end 为止的数据。
+    上游出错、停顿或过慢时，用下一个候选地址从断点处续传；end 为 None 表示读到文件末尾。
+    """
+    url, candidates = urls[0], list(urls[1:])
+    offset = start
+    while True:
+        try:
+            async for chunk in _guarded_chunks(resp, url, bool(candidates)):
+                offset += len(chunk)
+                yield chunk
+            return
+        except (httpx.HTTPError, UpstreamError) as e:
+            cdn.record_failure(url)
+            if not candidates:
+                raise
+            print(f"Stream failover from {cdn.host_of(url)} at {offset}: {e}")
+        finally:
+            await resp.aclose()
+
+        if end is not None and offset > end:
+            return
+        range_header = f"bytes={offset}-{'' if end is None else end}"
+        resp = None
+        while candidates and resp is None:
+            url = candidates.pop(0)
+            try:
+                resp = await _open_upstream(url, range_header)
+            except httpx.HTTPError:
+                cdn.record_failure(url)
+                continue
+            if resp.status_code != 206 or _upstream_span(resp)[0] != offset:
+                await resp.aclose()
+                cdn.record_failure(url)
+                resp = None
+        if resp is None:
+            raise UpstreamError("all CDN candidates failed")
+
+
+def _passthrough_response(resp, urls):
+    start, end, _ = _upstream_span(resp)
+
+    async def iter_stream():
+        # 浏览器断开时生成器会被取消/关闭，finally 中立即释放上游连接
+        try:
+            if start is None:
+                # 错误响应等，原样透传
+                async for chunk in resp.aiter_raw(CHUNK_SIZE):
+                    if chunk:
+                        yield chunk
+            else:
+                chunks = _iter_upstream(resp, urls, start, end)
+                try:
+                    async for chunk in chunks:
+                        yield chunk
+                finally:
+                    await chunks.aclose()
+        finally:
+            await resp.aclose()
+
+    response_headers = {}
+    content_type = resp.headers.get("Content-Type", "audio/mp4")
+    response_headers["Content-Type"] = content_type
+
+    for h in PASSTHROUGH_HEADERS:
+        if h in resp.headers:
+            response_headers[h] = resp.headers[h]
+
+    if "Accept-Ranges" not in response_headers:
+        response_headers["Accept-Ranges"] = "bytes"
+
+    return StreamingResponse(
+        iter_stream(),
+        status_code=resp.status_code,
+        headers=response_headers,
+    )
+
+
+async def proxy(request, url):
+    resp, urls = await _open_first(cdn.alternatives(url), request.headers.get("range"))
+    return _passthrough_response(resp, urls)
+
+
+def _parse_range(value):
+    """解析单个 Range 头，返回 (start, end)；end 为 None 表示到文件末尾，start 为 None 表示后缀区间"""
+    m = _RANGE_RE.match(value.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    start = int(m.group(1)) if m.group(1) else None
+    end = int(m.group(2)) if m.group(2) else None
+    return start, end
+
+
+def _resolve_range(rng, size):
+    start, end = rng
+    if start is None:
+        # bytes=-N：最后 N 个字节
+        start, end = max(0, size - end), size - 1
+    if end is None or end >= size:
+        end = size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+async def _fill(entry, resp, urls, first_block, last_block, start, end):
+    """
+    消费上游响应（从 first_block 起始处开始），把完整的块写入缓存，
+    同时产出落在客户端请求区间 [start, end] 内的数据。
+    """
+    chunks = None
+    try:
+        offset, _, total = _upstream_span(resp)
+        if total is None:
+            # 错误状态（例如地址过期返回 403）与缓存内容无关，保留条目
+            raise UpstreamError(f"Upstream error for {entry.key}: status {resp.status_code}")
+        if total != entry.size:
+            # 上游文件和缓存不一致，丢弃缓存条目
+            audio_cache.remove(entry.key)
+            raise UpstreamError(f"Upstream size mismatch for {entry.key}: {total} != {entry.size}")
+        if offset != entry.block_range(first_block)[0]:
+            raise UpstreamError(f"Upstream range mismatch for {entry.key}: status {resp.status_code}")
+
+        index = first_block
+        buf = bytearray()
+        last_byte = entry.block_range(last_block)[1]
+        chunks = _iter_upstream(resp, urls, offset, last_byte)
+        async for chunk in chunks:
+            lo = max(start, offset)
+            hi = min(end + 1, offset + len(chunk))
+            if lo < hi:
+                yield chunk[lo - offset:hi - offset]
+            offset += len(chunk)
+            audio_cache.miss_bytes += len(chunk)
+
+            buf += chunk
+            while index <= last_block:
+                block_start, block_end = entry.block_range(index)
+                length = block_end - block_start + 1
+                if len(buf) < length:
+                    break
+                await asyncio.to_thread(entry.write_block, index, bytes(buf[:length]))
+                del buf[:length]
+                index += 1
+            if index > last_block:
+                break
+    finally:
+        if chunks is not None:
+            await chunks.aclose()
+        await resp.aclose()
+
+
+async def proxy_cached(request, url, key):
+    """
+    带本地缓存的 /stream：已缓存的块直接从磁盘读取，只向上游请求缺失的区间。
+    key 由 (bvid, cid, quality) 生成；url 为 None 时只能服务完整缓存的文件。
+    """
+    range_header = request.headers.get("range")
+    rng = (0, None)
+    if range_header:
+        rng = _parse_range(range_header)
+        if rng is None:
+            # 多区间等不常见的 Range 格式直接透传
+            if url is None:
+                return Response(status_code=416)
+            return await proxy(request, url)
+
+    urls = cdn.alternatives(url) if url else []
+    entry = audio_cache.get(key)
+    pending = None
+    if entry is None:
+        if url is None:
+            return Response(status_code=404)
+        # 第一次播放：从对齐到块边界的起点开始请求，顺便从响应头得知文件总大小
+        aligned = (rng[0] // audio_cache.block_size) * audio_cache.block_size if rng[0] else 0
+        resp, urls = await _open_first(urls, f"bytes={aligned}-")
+        offset, _, total = _upstream_span(resp)
+        if total is None:
+            # 上游没有给出文件大小（例如地址过期返回 403），不缓存，按原样透传
+            await resp.aclose()
+            return await proxy(request, url)
+        entry = audio_cache.create(key, total, resp.headers.get("Content-Type", "audio/mp4"))
+        pending = (offset, resp)
+
+    resolved = _resolve_range(rng, entry.size)
+    if resolved is None:
+        if pending:
+            await pending[1].aclose()
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{entry.size}"})
+    start, end = resolved
+    first_block = start // entry.block_size
+    last_block = end // entry.block_size
+    runs = entry.runs(first_block, last_block)
+    if url is None and any(not present for present, _, _ in runs):
+        return Response(status_code=404)
+
+    async def iter_stream():
+        nonlocal pending
+        entry.active += 1
+        try:
+            for present, a, b in runs:
+                run_start = entry.block_range(a)[0]
+                run_end = entry.block_range(b)[1]
+                if present:
+                    pos = max(start, run_start)
+                    stop = min(end, run_end)
+                    while pos <= stop:
+                        data = await asyncio.to_thread(entry.read, pos, min(CHUNK_SIZE, stop - pos + 1))
+                        if not data:
+                            raise RuntimeError(f"Audio cache file truncated: {entry.key}")
+                        audio_cache.hit_bytes += len(data)
+                        pos += len(data)
+                        yield data
+                else:
+                    if pending and pending[0] == run_start:
+                        resp, run_urls = pending[1], urls
+                        pending = None
+                    else:
+                        resp, run_urls = await _open_first(urls, f"bytes={run_start}-{run_end}")
+                    async for piece in _fill(entry, resp, run_urls, a, b, start, end):
+                        yield piece
+        finally:
+            entry.active -= 1
+            if not entry.active:
+                entry.close()
+            if pending:
+                await pending[1].aclose()
+            audio_cache.save(entry)
+            audio_cache.evict()
+
+    headers = {
+        "Content-Type": entry.content_type,
+        "Content-Length": str(end - start + 1),
+        "Accept-Ranges": "bytes",
+    }
+    status_code = 200
+    if range_header:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{entry.size}"
+    return StreamingResponse(iter_stream(), status_code=status_code, headers=headers)
+
+
+async def warm(url, key, nbytes):
+    """
+    预先把音频开头的 nbytes 字节下载到本地缓存（预加载下一首时使用），
+    之后对应的 /stream 请求可以直接从磁盘开始返回数据。
+    """
+    urls = cdn.alternatives(url)
+    blocks = max(1, (nbytes + audio_cache.block_size - 1) // audio_cache.block_size)
+    entry = audio_cache.get(key)
+    pending = None
+    if entry is None:
+        resp, urls = await _open_first(urls, f"bytes=0-{blocks * audio_cache.block_size - 1}")
+        offset, _, total = _upstream_span(resp)
+        if total is None or offset != 0:
+            await resp.aclose()
+            return False
+        entry = audio_cache.create(key, total, resp.headers.get("Content-Type", "audio/mp4"))
+        pending = resp
+
+    last_block = min(entry.block_count, blocks) - 1
+    entry.active += 1
+    try:
+        for present, a, b in entry.runs(0, last_block):
+            if present:
+                continue
+            if pending is not None and a == 0:
+                resp, run_urls, pending = pending, urls, None
+            else:
+                resp, run_urls = await _open_first(
+                    urls, f"bytes={entry.block_range(a)[0]}-{entry.block_range(b)[1]}"
+                )
+            # 区间 [0, -1] 为空：只写缓存，不产出数据
+            async for _ in _fill(entry, resp, run_urls, a, b, 0, -1):
+                pass
+    finally:
+        entry.active -= 1
+        if not entry.active:
+            entry.close()
+        if pending is not None:
+            await pending.aclose()
+        audio_cache.save(entry)
+        audio_cache.evict()
+    return True
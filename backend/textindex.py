@@ -0,0 +1,46 @@
+import re
+
+# 曲库全文检索的分词。
+# SQLite FTS5 自带的 unicode61 分词器会把连续的中日韩文字当成一个词，
+# 这里在写入索引前先把 CJK 文字切成重叠的二元组（"周杰伦" -> "周杰 杰伦 伦"），
+# 拉丁字母和数字按单词小写化，结果以空格分隔交给 unicode61。
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"([{_CJK}]+)|([^\W_{_CJK}]+)")
+
+
+def _cjk_tokens(run):
+    if len(run) == 1:
+        return [run]
+    # 二元组之外再加上最后一个字，这样单字查询用前缀匹配就能命中任意位置
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def index_tokens(text):
+    """把一段文本转换为写入 FTS 表的词序列"""
+    if not text:
+        return ""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(str(text)):
+        tokens.extend(_cjk_tokens(cjk) if cjk else [word.lower()])
+    return " ".join(tokens)
+
+
+def match_terms(text):
+    """
+    把用户输入转换为一组 FTS5 MATCH 表达式，每个词一项，无可搜索内容时返回空列表。
+    多个词之间是 AND 关系；CJK 片段按二元组做短语匹配，单字和最后一个英文词做前缀匹配。
+    """
+    parts = []
+    matches = _TOKEN_RE.findall(text or "")
+    for i, (cjk, word) in enumerate(matches):
+        if cjk:
+            if len(cjk) == 1:
+                parts.append(f'"{cjk}"*')
+            else:
+                parts.append('"' + " ".join(cjk[j:j + 2] for j in range(len(cjk) - 1)) + '"')
+        elif i == len(matches) - 1:
+            parts.append(f'"{word.lower()}"*')
+        else:
+            parts.append(f'"{word.lower()}"')
+    return parts
@@ -0,0 +1,119 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from . import covers
+from . import net
+from . import ratelimit
+
+# 封面缩略图。
+# 每张封面按需生成几种固定尺寸（等比缩小到不超过 size x size）的 WebP，
+# 和原图一样存放在封面缓存里，key 为 "{key}_{size}"。
+# 原图还没有下载且来自 B 站图床时，直接请求图床按 @{w}w_{h}h 缩放好的版本，省去下载原图；
+# 否则用 Pillow 在进程池里从本地原图缩放。
+
+SIZES = (64, 160, 480)
+QUALITY = int(os.environ.get("BILIMUSIC_THUMB_QUALITY", 80))
+# 0 表示在线程里缩放，不启动子进程
+WORKERS = int(os.environ.get("BILIMUSIC_THUMB_WORKERS", min(2, os.cpu_count() or 1)))
+
+CONTENT_TYPE = "image/webp"
+_CDN_SUFFIX = ".hdslb.com"
+
+# (key, size) -> 正在进行的生成任务
+_inflight = {}
+_pool = None
+
+
+def pick_size(requested):
+    """不小于 requested 的最小尺寸；比最大尺寸还大时返回 None，表示使用原图"""
+    for size in SIZES:
+        if size >= requested:
+            return size
+    return None
+
+
+def variant_key(key, size):
+    return f"{key}_{size}"
+
+
+def _cdn_url(url, size):
+    """B 站图床的缩放地址；不是图床地址或已经带有处理参数时返回 None"""
+    parts = urlsplit(url)
+    if not (parts.hostname or "").endswith(_CDN_SUFFIX) or "@" in parts.path:
+        return None
+    return f"{url}@{size}w_{size}h.webp"
+
+
+async def _from_cdn(key, size, url):
+    try:
+        async with ratelimit.limit("image"):
+            resp = await net.get(url)
+            resp.raise_for_status()
+    except Exception as e:
+        print(f"Fetch thumbnail error: {e}")
+        return False
+    content_type = resp.headers.get("Content-Type", "")
+    if not content_type.startswith("image/"):
+        return False
+    covers.save(variant_key(key, size), resp.content, content_type, source=url)
+    return True
+
+
+def _executor():
+    """第一次需要缩放时才创建进程池，子进程的启动不和首屏加载争抢 CPU"""
+    global _pool
+    if _pool is None and WORKERS > 0:
+        # 统一用 spawn：fork 一个带有事件循环和多个线程的进程并不安全
+        _pool = ProcessPoolExecutor(WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def _from_original(key, size):
+    if not await covers.ensure(key):
+        return False
+    entry = covers.load(key)
+    if entry is None:
+        return False
+    # Pillow 只在第一次缩放时导入，不拖慢启动
+    from . import imaging
+
+    loop = asyncio.get_running_loop()
+    try:
+        content = await loop.run_in_executor(_executor(), imaging.resize, entry[0], size, QUALITY)
+    except Exception as e:
+        print(f"Resize cover error: {e}")
+        return False
+    covers.save(variant_key(key, size), content, CONTENT_TYPE)
+    return True
+
+
+async def _build(key, size):
+    if not covers.has(key):
+        source = covers.source(key)
+        url = source and _cdn_url(source, size)
+        if url and await _from_cdn(key, size, url):
+            return True
+    return await _from_original(key, size)
+
+
+async def ensure(key, size):
+    """确保 key 的 size 尺寸缩略图已生成；同一缩略图的并发请求共享一次生成"""
+    if covers.has(variant_key(key, size)):
+        return True
+    task = _inflight.get((key, size))
+    if task is None:
+        task = asyncio.create_task(_build(key, size))
+        _inflight[(key, size)] = task
+        task.add_done_callback(lambda _: _inflight.pop((key, size), None))
+    return await asyncio.shield(task)
+
+
+def shutdown():
+    """取消排队中的任务并等待子进程退出，不留下孤儿进程和信号量"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
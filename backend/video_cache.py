@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import time
+
+from . import db
+
+# 视频元数据（标题、UP 主、分 P 的 cid 和时长、封面地址）的持久化缓存。
+# 这些数据很少变化，重启后仍然有效；过期或被显式失效后重新向上游查询。
+
+DB_FILE = os.path.join("data", "cache.db")
+TTL = float(os.environ.get("BILIMUSIC_VIDEO_CACHE_TTL", 7 * 24 * 3600))
+
+_conn = None
+_lock = threading.RLock()
+hits = 0
+misses = 0
+
+
+def _migrate_v1(conn):
+    conn.execute("""
+        CREATE TABLE videos (
+            bvid TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+
+_MIGRATIONS = [_migrate_v1]
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                conn = db.connect(DB_FILE)
+                db.migrate(conn, _MIGRATIONS)
+                conn.execute("DELETE FROM videos WHERE expires_at <= ?", (time.time(),))
+                _conn = conn
+    return _conn
+
+
+def get(bvid):
+    """返回未过期的缓存数据，没有或已过期时返回 None"""
+    global hits, misses
+    conn = _get_conn()
+    with _lock:
+        row = conn.execute("SELECT data, expires_at FROM videos WHERE bvid = ?", (bvid,)).fetchone()
+        if row is None or row["expires_at"] <= time.time():
+            misses += 1
+            return None
+        hits += 1
+    return json.loads(row["data"])
+
+
+def put(bvid, data, ttl=None):
+    conn = _get_conn()
+    now = time.time()
+    with _lock:
+        conn.execute(
+            "INSERT OR REPLACE INTO videos (bvid, data, fetched_at, expires_at) VALUES (?, ?, ?, ?)",
+            (bvid, json.dumps(data, ensure_ascii=False), now, now + (TTL if ttl is None else ttl)),
+        )
+
+
+def invalidate(bvid):
+    conn = _get_conn()
+    with _lock:
+        conn.execute("DELETE FROM videos WHERE bvid = ?", (bvid,))
+
+
+def clear():
+    conn = _get_conn()
+    with _lock:
+        conn.execute("DELETE FROM videos")
+
+
+def stats():
+    conn = _get_conn()
+    with _lock:
+        size = conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+    return {"size": size, "ttl": TTL, "hits": hits, "misses": misses}
@@ -0,0 +1,12 @@
+"""
+bench 脚本共用的小工具。脚本以 python bench/xxx.py 运行，bench/ 在 sys.path[0]，直接 from common import ... 即可。
+"""
+
+
+def percentile(values, p):
+    """最近秩百分位数，values 为空时返回 None"""
+    values = sorted(values)
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, round(p / 100 * (len(values) - 1))))
+    return values[k]
@@ -0,0 +1,277 @@
+"""
+本地的 B 站替身，供基准测试使用：模拟搜索、视频信息、播放地址接口，以及支持 Range 的音频 CDN 和封面图床。
+
+所有内容都由 bvid/关键字确定性地生成，同样的参数每次得到同样的数据。
+后端设置 BILIMUSIC_UPSTREAM=http://127.0.0.1:<port> 后，所有出站请求都会发到这里，
+请求头里的 Host 保持原样（api.bilibili.com、*.bilivideo.com、i0.hdslb.com）。
+
+用法：
+
+    python bench/fake_bilibili.py --port 9000 --api-latency 40 --cdn-latency 30 --bandwidth 2048
+
+GET /_fake/stats 返回各接口被请求的次数。
+"""
+import argparse
+import asyncio
+import hashlib
+import struct
+import time
+import zlib
+from collections import Counter
+
+import uvicorn
+from bilibili_api import aid2bvid, bvid2aid
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+SEARCH_PAGES = 50
+PAGE_SIZE = 20
+AUDIO_QUALITY = 30280
+CDN_HOSTS = ["upos-sz-mirrorcos.bilivideo.com", "upos-sz-mirrorali.bilivideo.com", "cn-gdfs-ct-01-01.bilivideo.com"]
+CHUNK = 64 * 1024
+
+config = argparse.Namespace(api_latency=0.0, cdn_latency=0.0, bandwidth=0, audio_size=4 * 1024 * 1024)
+calls = Counter()
+
+
+def _hash(*parts):
+    return int(hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest()[:12], 16)
+
+
+def _aid(keyword, page, index):
+    return 10_000_000 + _hash(keyword, page, index) % 900_000_000
+
+
+def _duration(aid):
+    return 120 + aid % 300
+
+
+def _cover_url(aid):
+    return f"//i0.hdslb.com/bfs/archive/{aid:x}.jpg"
+
+
+def _png():
+    """1x1 的 PNG，当作封面"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\xfb\x72\x99")) + chunk(b"IEND", b"")
+
+
+COVER = _png()
+# 音频内容按偏移循环取自这个块，任意 Range 都能直接切出来
+AUDIO_BLOCK = bytes(range(256)) * (CHUNK // 256)
+
+
+def _ok(data):
+    return JSONResponse({"code": 0, "message": "0", "ttl": 1, "data": data})
+
+
+async def _api_delay():
+    if config.api_latency:
+        await asyncio.sleep(config.api_latency)
+
+
+async def nav(request):
+    calls["nav"] += 1
+    return _ok({
+        "isLogin": False,
+        "wbi_img": {
+            "img_url": "https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png",
+            "sub_url": "https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png",
+        },
+    })
+
+
+async def spi(request):
+    calls["spi"] += 1
+    return _ok({"b_3": "00000000-0000-0000-0000-000000000000infoc", "b_4": "00000000-0000-0000-0000-000000000000"})
+
+
+async def activate_buvid(request):
+    calls["activate"] += 1
+    return JSONResponse({"code": 0, "msg": "", "data": {}})
+
+
+async def search(request):
+    calls["search"] += 1
+    await _api_delay()
+    keyword = request.query_params.get("keyword", "")
+    page = int(request.query_params.get("page", 1))
+    result = []
+    for i in range(PAGE_SIZE):
+        aid = _aid(keyword, page, i)
+        seconds = _duration(aid)
+        result.append({
+            "type": "video",
+            "aid": aid,
+            "bvid": aid2bvid(aid),
+            "title": f'<em class="keyword">{keyword}</em> 第 {page} 页 #{i}',
+            "author": f"up{aid % 1000}",
+            "pic": _cover_url(aid),
+            "duration": f"{seconds // 60}:{seconds % 60:02d}",
+            "play": aid % 100000,
+        })
+    return _ok({"page": page, "pagesize": PAGE_SIZE, "numResults": SEARCH_PAGES * PAGE_SIZE,
+                "numPages": SEARCH_PAGES, "result": result})
+
+
+async def view(request):
+    calls["view"] += 1
+    await _api_delay()
+    bvid = request.query_params.get("bvid")
+    aid = bvid2aid(bvid) if bvid else int(request.query_params["aid"])
+    seconds = _duration(aid)
+    return _ok({
+        "bvid": aid2bvid(aid),
+        "aid": aid,
+        "cid": aid + 1,
+        "title": f"视频 {aid}",
+        "pic": "http:" + _cover_url(aid),
+        "desc": "",
+        "duration": seconds,
+        "owner": {"mid": aid % 100000, "name": f"up{aid % 1000}"},
+        "pages": [{"cid": aid + 1, "page": 1, "part": f"视频 {aid}", "duration": seconds}],
+    })
+
+
+def _stream_urls(aid, cid, quality):
+    deadline = int(time.time()) + 7200
+    path = f"/upgcxcode/{aid % 100:02d}/{aid}/{cid}/{cid}-1-{quality}.m4s?deadline={deadline}&os=bench"
+    return [f"https://{host}{path}" for host in CDN_HOSTS]
+
+
+def _dash_stream(quality, urls, mime_type, codecs, bandwidth, **extra):
+    # 接口同时返回驼峰和下划线两种写法的字段
+    return {
+        "id": quality, "bandwidth": bandwidth, "codecs": codecs,
+        "mimeType": mime_type, "mime_type": mime_type,
+        "baseUrl": urls[0], "base_url": urls[0],
+        "backupUrl": urls[1:], "backup_url": urls[1:],
+        "segment_base": {"initialization": "0-1000", "index_range": "1001-2000"},
+        "segmentBase": {"Initialization": "0-1000", "indexRange": "1001-2000"},
+        **extra,
+    }
+
+
+async def playurl(request):
+    calls["playurl"] += 1
+    await _api_delay()
+    bvid = request.query_params.get("bvid")
+    aid = bvid2aid(bvid) if bvid else int(request.query_params["avid"])
+    cid = int(request.query_params["cid"])
+    audio_urls = _stream_urls(aid, cid, AUDIO_QUALITY)
+    video_urls = _stream_urls(aid, cid, 80)
+    return _ok({
+        "quality": 80,
+        "format": "flv",
+        "timelength": _duration(aid) * 1000,
+        "accept_quality": [80],
+        "dash": {
+            "duration": _duration(aid),
+            "video": [_dash_stream(80, video_urls, "video/mp4", "avc1.640032", 1_000_000,
+                                   codecid=7, width=1920, height=1080, frame_rate="30", sar="1:1")],
+            "audio": [_dash_stream(AUDIO_QUALITY, audio_urls, "audio/mp4", "mp4a.40.2", 192_000, codecid=0)],
+            "dolby": None,
+            "flac": None,
+        },
+    })
+
+
+def _parse_range(header, size):
+    if not header or not header.startswith("bytes="):
+        return None
+    start, _, end = header[6:].partition("-")
+    if not start:
+        return max(0, size - int(end)), size - 1
+    return int(start), min(int(end), size - 1) if end else size - 1
+
+
+async def audio(request):
+    calls["cdn"] += 1
+    if config.cdn_latency:
+        await asyncio.sleep(config.cdn_latency)
+    size = config.audio_size
+    span = _parse_range(request.headers.get("range"), size)
+    headers = {"Accept-Ranges": "bytes"}
+    if span is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        start, end = span
+        if start >= size or start > end:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    async def body():
+        offset = start
+        while offset <= end:
+            n = min(CHUNK - offset % CHUNK, end - offset + 1)
+            yield AUDIO_BLOCK[offset % CHUNK:offset % CHUNK + n]
+            offset += n
+            if config.bandwidth:
+                await asyncio.sleep(n / config.bandwidth)
+
+    return StreamingResponse(body(), status_code=status, headers=headers, media_type="video/mp4")
+
+
+async def cover(request):
+    calls["cover"] += 1
+    if config.cdn_latency:
+        await asyncio.sleep(config.cdn_latency)
+    return Response(COVER, media_type="image/png")
+
+
+async def unknown(request):
+    calls["unknown"] += 1
+    print(f"fake_bilibili: unhandled {request.method} {request.headers.get('host')}{request.url.path}")
+    return JSONResponse({"code": -404, "message": "啥都木有"}, status_code=404)
+
+
+async def stats(request):
+    return JSONResponse(dict(calls))
+
+
+async def reset(request):
+    calls.clear()
+    return JSONResponse({"success": True})
+
+
+app = Starlette(routes=[
+    Route("/x/web-interface/nav", nav),
+    Route("/x/frontend/finger/spi", spi),
+    Route("/x/internal/gaia-gateway/ExClimbWuzhi", activate_buvid, methods=["POST"]),
+    Route("/x/web-interface/wbi/search/type", search),
+    Route("/x/web-interface/search/type", search),
+    Route("/x/web-interface/view", view),
+    Route("/x/web-interface/wbi/view", view),
+    Route("/x/player/wbi/playurl", playurl),
+    Route("/x/player/playurl", playurl),
+    Route("/upgcxcode/{path:path}", audio),
+    Route("/bfs/{path:path}", cover),
+    Route("/_fake/stats", stats),
+    Route("/_fake/reset", reset, methods=["POST"]),
+    Route("/{path:path}", unknown, methods=["GET", "POST"]),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--api-latency", type=float, default=0, help="API response delay (ms)")
+    parser.add_argument("--cdn-latency", type=float, default=0, help="CDN time to first byte (ms)")
+    parser.add_argument("--bandwidth", type=int, default=0, help="per-connection CDN bandwidth (KB/s), 0 = unlimited")
+    parser.add_argument("--audio-size", type=int, default=4096, help="size of every audio file (KB)")
+    args = parser.parse_args()
+    config.api_latency = args.api_latency / 1000
+    config.cdn_latency = args.cdn_latency / 1000
+    config.bandwidth = args.bandwidth * 1024
+    config.audio_size = args.audio_size * 1024
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+/api/search 的延迟基准：分别测量冷缓存（第一次请求）和热缓存（重复请求）下的 p50/p95。
+
+用法（先启动 main.py 或 uvicorn backend.server:app --port 8001）：
+
+    python bench/search_bench.py --keywords 周杰伦 Aimer 初音未来 --pages 3
+    python bench/search_bench.py --keywords ... --eager   # 等待封面下载完成后再返回
+
+冷缓存的数据只有在服务刚启动、且这些关键字还没有被搜索过时才有意义。
+"""
+import argparse
+import json
+import time
+
+import httpx
+
+from common import percentile
+
+
+def _summary(latencies):
+    return {
+        "requests": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
+
+
+def run(server, keywords, pages, lazy_covers, warm_rounds):
+    def one_pass(client):
+        latencies = []
+        for keyword in keywords:
+            for page in range(1, pages + 1):
+                start = time.perf_counter()
+                resp = client.get(
+                    f"{server}/api/search",
+                    params={"keyword": keyword, "page": page, "lazy_covers": lazy_covers},
+                )
+                resp.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    with httpx.Client(timeout=60) as client:
+        cold = one_pass(client)
+        warm = []
+        for _ in range(warm_rounds):
+            warm += one_pass(client)
+    return {"lazy_covers": lazy_covers, "cold": _summary(cold), "warm": _summary(warm)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://127.0.0.1:8001")
+    parser.add_argument("--keywords", nargs="+", required=True)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--warm-rounds", type=int, default=3)
+    parser.add_argument("--eager", action="store_true", help="wait for covers before returning")
+    args = parser.parse_args()
+    print(json.dumps(run(args.server, args.keywords, args.pages, not args.eager, args.warm_rounds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
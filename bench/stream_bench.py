@@ -0,0 +1,88 @@
+"""
+/stream 代理的简单基准：测量首字节时间（TTFB）和吞吐量。
+
+用法（先启动 main.py 或 uvicorn backend.server:app --port 8001）：
+
+    python bench/stream_bench.py --url <上游音频地址> [--server http://127.0.0.1:8001]
+    python bench/stream_bench.py --bvid BV1xx411c7XX
+
+--bvid 会先通过 /api/audio_url 解析出音频地址。
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+import httpx
+
+from common import percentile
+
+
+def fetch(client, stream_url, range_header=None, limit=None):
+    headers = {"Range": range_header} if range_header else {}
+    start = time.perf_counter()
+    ttfb = None
+    size = 0
+    with client.stream("GET", stream_url, headers=headers) as resp:
+        for chunk in resp.iter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+            if limit and size >= limit:
+                break
+    return ttfb, size, time.perf_counter() - start
+
+
+def run(server, url, full_runs, seeks, seek_bytes):
+    stream_url = f"{server}/stream"
+    params = httpx.QueryParams({"url": url})
+    with httpx.Client(timeout=60) as client:
+        full = [fetch(client, f"{stream_url}?{params}") for _ in range(full_runs)]
+        total = full[0][1] if full else 0
+
+        seek_results = []
+        for _ in range(seeks):
+            offset = random.randint(0, max(0, total - seek_bytes))
+            seek_results.append(fetch(client, f"{stream_url}?{params}", f"bytes={offset}-", limit=seek_bytes))
+
+    full_ttfb = [r[0] * 1000 for r in full if r[0] is not None]
+    seek_ttfb = [r[0] * 1000 for r in seek_results if r[0] is not None]
+    return {
+        "size_bytes": total,
+        "full_runs": full_runs,
+        "full_ttfb_ms_p50": percentile(full_ttfb, 50),
+        "full_throughput_mb_s": (
+            statistics.mean(r[1] / r[2] for r in full) / 1024 / 1024 if full else None
+        ),
+        "seeks": seeks,
+        "seek_ttfb_ms_p50": percentile(seek_ttfb, 50),
+        "seek_ttfb_ms_p95": percentile(seek_ttfb, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://127.0.0.1:8001")
+    parser.add_argument("--url", help="upstream audio URL")
+    parser.add_argument("--bvid")
+    parser.add_argument("--cid", type=int)
+    parser.add_argument("--full-runs", type=int, default=3)
+    parser.add_argument("--seeks", type=int, default=20)
+    parser.add_argument("--seek-bytes", type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        if not args.bvid:
+            parser.error("--url or --bvid is required")
+        params = {"bvid": args.bvid}
+        if args.cid:
+            params["cid"] = args.cid
+        url = httpx.get(f"{args.server}/api/audio_url", params=params, timeout=30).json()["url"]
+
+    print(json.dumps(run(args.server, url, args.full_runs, args.seeks, args.seek_bytes), indent=2))
+
+
+if __name__ == "__main__":
+    main()
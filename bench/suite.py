@@ -0,0 +1,492 @@
+"""
+可重复的整体基准：在本地启动 B 站替身（bench/fake_bilibili.py）和后端（backend.server:app），
+通过 HTTP 测量搜索、播放地址解析、/stream 音频代理，以及 100 到 100k 首歌曲的曲库读写。
+
+每个场景报告请求数、错误数、吞吐量和 p50/p99 延迟，并记录后端进程的内存（RSS 和峰值）。
+每次运行都使用新建的临时数据目录，结果与本机已有的曲库和缓存无关。
+
+用法：
+
+    python bench/suite.py --output before.json
+    python bench/suite.py --output after.json --compare before.json
+    python bench/suite.py --only library --library-sizes 1000 100000
+    python bench/suite.py --api-latency 80 --cdn-latency 50 --bandwidth 1024
+
+默认关闭后端的限速（BILIMUSIC_RATE_SCALE=0），测量的是应用本身；--rate-scale 1 使用线上的速率。
+内存数据读取 /proc，只在 Linux 上可用，其他平台为 null。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from common import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE = os.path.join(ROOT, "bench", "fake_bilibili.py")
+# 与 backend/server.py 中的 BATCH_MAX_OPERATIONS 一致
+SEED_BATCH = 1000
+# --compare 时比较的指标，以及数值变大是否代表变好
+COMPARED = {"p50_ms": False, "p99_ms": False, "throughput_rps": True, "mb_s": True, "peak_rss_mb": False}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _memory(pid):
+    """进程当前和峰值 RSS（MB）"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f)
+    except OSError:
+        return {"rss_mb": None, "peak_rss_mb": None}
+
+    def mb(name):
+        return round(int(fields[name].split()[0]) / 1024, 1) if name in fields else None
+
+    return {"rss_mb": mb("VmRSS"), "peak_rss_mb": mb("VmHWM")}
+
+
+class Process:
+    """后台子进程，start 后轮询 ready_path 直到返回 200"""
+
+    def __init__(self, name, args, port, ready_path, cwd=None, env=None):
+        self.name = name
+        self.args = args
+        self.port = port
+        self.base = f"http://127.0.0.1:{port}"
+        self.ready_path = ready_path
+        self.cwd = cwd
+        self.env = env
+        self.proc = None
+
+    def start(self, timeout=60):
+        self.proc = subprocess.Popen(self.args, cwd=self.cwd, env=self.env)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with code {self.proc.returncode}")
+            try:
+                if httpx.get(self.base + self.ready_path, timeout=2).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"{self.name} did not start within {timeout}s")
+
+    def stop(self):
+        if self.proc is None:
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def memory(self):
+        return _memory(self.proc.pid)
+
+
+def start_fake(args):
+    port = _free_port()
+    command = [
+        sys.executable, FAKE, "--port", str(port),
+        "--api-latency", str(args.api_latency),
+        "--cdn-latency", str(args.cdn_latency),
+        "--bandwidth", str(args.bandwidth),
+        "--audio-size", str(args.audio_size),
+    ]
+    return Process("fake_bilibili", command, port, "/_fake/stats").start()
+
+
+def start_server(args, fake, data_dir):
+    os.makedirs(data_dir, exist_ok=True)
+    # 后端从工作目录读取 web/ 和 data/
+    web = os.path.join(data_dir, "web")
+    if not os.path.exists(web):
+        try:
+            os.symlink(os.path.join(ROOT, "web"), web, target_is_directory=True)
+        except OSError:
+            shutil.copytree(os.path.join(ROOT, "web"), web)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["BILIMUSIC_UPSTREAM"] = fake.base
+    env["BILIMUSIC_RATE_SCALE"] = str(args.rate_scale)
+    port = _free_port()
+    command = [
+        sys.executable, "-m", "uvicorn", "backend.server:app",
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ]
+    return Process("server", command, port, "/api/playlists/summary", cwd=data_dir, env=env).start()
+
+
+async def measure(requests, concurrency):
+    """
+    并发执行 requests 里的协程工厂，每个工厂返回一个 httpx.Response 或传输的字节数。
+    返回 (统计, 各请求的结果)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    results = [None] * len(requests)
+
+    async def one(i, make):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                results[i] = result = await make()
+                if isinstance(result, httpx.Response) and result.status_code >= 400:
+                    errors += 1
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                errors += 1
+                print(f"  request failed: {e!r}", file=sys.stderr)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i, make) for i, make in enumerate(requests)])
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(requests) / elapsed, 1) if elapsed else None,
+        "p50_ms": _round(percentile(latencies, 50)),
+        "p99_ms": _round(percentile(latencies, 99)),
+    }, results
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+async def _read_stream(client, url, params, headers=None, limit=None):
+    """读取 /stream 响应，返回 (首字节时间秒, 字节数)"""
+    start = time.perf_counter()
+    ttfb = None
+    size = 0
+    async with client.stream("GET", url, params=params, headers=headers or {}) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+            if limit and size >= limit:
+                break
+    return ttfb, size
+
+
+async def bench_stream(client, server, songs, concurrency, seek=None):
+    """
+    按前端的方式（url + bvid/cid/quality）请求 /stream。
+    seek=(次数, 每次读取的字节数) 时对每首歌做随机 Range 请求，否则完整读取。
+    """
+    requests = []
+    for song in songs:
+        params = {"url": song["url"], "bvid": song["bvid"], "cid": song["cid"], "quality": song["quality"]}
+        if seek:
+            for _ in range(seek[0]):
+                offset = random.randrange(0, song["size"] - seek[1])
+                headers = {"Range": f"bytes={offset}-"}
+                requests.append(lambda p=params, h=headers: _read_stream(client, server + "/stream", p, h, seek[1]))
+        else:
+            requests.append(lambda p=params: _read_stream(client, server + "/stream", p))
+    start = time.perf_counter()
+    stats, results = await measure(requests, concurrency)
+    elapsed = time.perf_counter() - start
+    done = [r for r in results if r]
+    total = sum(size for _, size in done)
+    stats["ttfb_p50_ms"] = _round(percentile([t * 1000 for t, _ in done if t is not None], 50))
+    stats["ttfb_p99_ms"] = _round(percentile([t * 1000 for t, _ in done if t is not None], 99))
+    stats["bytes"] = total
+    stats["mb_s"] = round(total / elapsed / 1024 / 1024, 2) if elapsed else None
+    return stats
+
+
+async def bench_api(args, fake):
+    random.seed(args.seed)
+    data_dir = os.path.join(args.work_dir, "api")
+    server = start_server(args, fake, data_dir)
+    base = server.base
+    results = {}
+    try:
+        httpx.post(fake.base + "/_fake/reset")
+        async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=args.concurrency * 2)) as client:
+            # 每个关键字 5 页；冷缓存每页请求一次，热缓存在这些页之间随机重复请求
+            pages = [(f"bench-{i // 5}", i % 5 + 1) for i in range(args.search_pages)]
+
+            def search(keys):
+                return [
+                    lambda k=k, p=p: client.get(base + "/api/search", params={"keyword": k, "page": p, "lazy_covers": True})
+                    for k, p in keys
+                ]
+
+            print("search ...", file=sys.stderr)
+            results["search_cold"], responses = await measure(search(pages), args.concurrency)
+            warm = [random.choice(pages) for _ in range(args.requests)]
+            results["search_warm"], _ = await measure(search(warm), args.concurrency)
+
+            bvids = []
+            for resp in responses:
+                if resp is not None and resp.status_code == 200:
+                    bvids += [item["bvid"] for item in resp.json().get("items", [])]
+            bvids = list(dict.fromkeys(bvids))[:args.requests]
+
+            def resolve():
+                return [lambda b=b: client.get(base + "/api/audio_url", params={"bvid": b}) for b in bvids]
+
+            print("resolve ...", file=sys.stderr)
+            results["resolve_cold"], responses = await measure(resolve(), args.concurrency)
+            results["resolve_warm"], _ = await measure(resolve(), args.concurrency)
+
+            songs = []
+            for bvid, resp in zip(bvids, responses):
+                data = resp.json() if resp is not None and resp.status_code == 200 else {}
+                if data.get("url"):
+                    songs.append({**data, "bvid": bvid, "size": args.audio_size * 1024})
+            streamed = songs[:args.streams]
+            seeked = songs[args.streams:args.streams * 2]
+
+            print("stream ...", file=sys.stderr)
+            results["stream_cold"] = await bench_stream(client, base, streamed, args.concurrency)
+            results["stream_warm"] = await bench_stream(client, base, streamed, args.concurrency)
+            results["stream_seek"] = await bench_stream(
+                client, base, seeked, args.concurrency, seek=(args.seeks, args.seek_bytes)
+            )
+
+            results["server_memory"] = server.memory()
+            results["server_metrics"] = (await client.get(base + "/api/metrics")).json()
+            results["upstream_calls"] = (await client.get(fake.base + "/_fake/stats")).json()
+    finally:
+        server.stop()
+    return results
+
+
+def _song(n):
+    seconds = 120 + n % 300
+    return {
+        "bvid": f"BV1bench{n:06d}",
+        "cid": 100000 + n,
+        "title": f"Bench song {n} {random.choice(['晴天', 'Lemon', '夜に駆ける', 'Shape of You', '稻香'])}",
+        "artist": f"Artist {n % 997}",
+        "duration": f"{seconds // 60}:{seconds % 60:02d}",
+        "cover": None,
+    }
+
+
+async def bench_library(args, fake, size):
+    random.seed(args.seed)
+    data_dir = os.path.join(args.work_dir, f"library-{size}")
+    server = start_server(args, fake, data_dir)
+    base = server.base
+    n = args.requests
+    # 耗时随歌单大小线性增长的操作（整库读取、重排、改名会重建全文索引里的歌单名）只执行少量几次
+    heavy = args.heavy_requests
+    results = {}
+    try:
+        async with httpx.AsyncClient(timeout=300) as client:
+            playlist_id = (await client.post(base + "/api/playlists", json={"name": f"bench {size}"})).json()["id"]
+
+            # 通过批量接口写入，同时测量导入吞吐
+            print(f"library {size}: seeding ...", file=sys.stderr)
+            uuids = []
+            start = time.perf_counter()
+            for offset in range(0, size, SEED_BATCH):
+                ops = [
+                    {"op": "add", "playlist_id": playlist_id, "song": _song(i)}
+                    for i in range(offset, min(size, offset + SEED_BATCH))
+                ]
+                resp = await client.post(base + "/api/playlists/batch", json={"operations": ops})
+                resp.raise_for_status()
+                uuids += [r["uuid"] for r in resp.json()["results"]]
+            elapsed = time.perf_counter() - start
+            results["seed"] = {"songs": size, "seconds": round(elapsed, 3), "songs_per_s": round(size / elapsed)}
+
+            songs_url = f"{base}/api/playlists/{playlist_id}/songs"
+            sequential = 1 if args.sequential_writes else args.concurrency
+
+            print(f"library {size}: reads ...", file=sys.stderr)
+            results["summary"], _ = await measure(
+                [lambda: client.get(base + "/api/playlists/summary") for _ in range(n)], args.concurrency
+            )
+            results["songs_first_page"], _ = await measure(
+                [lambda: client.get(songs_url) for _ in range(n)], args.concurrency
+            )
+            # 随机位置的分页（cursor 是上一页最后一首歌的位置）
+            results["songs_random_page"], _ = await measure(
+                [lambda c=random.randrange(size): client.get(songs_url, params={"cursor": str(c)}) for _ in range(n)],
+                args.concurrency,
+            )
+            results["keys"], _ = await measure(
+                [lambda: client.get(f"{base}/api/playlists/{playlist_id}/keys") for _ in range(max(1, n // 10))],
+                args.concurrency,
+            )
+            results["library_search"], _ = await measure(
+                [
+                    lambda q=random.choice(["晴天", "lemon", "artist 42", "song 1", "夜に"]):
+                        client.get(base + "/api/library/search", params={"q": q})
+                    for _ in range(n)
+                ],
+                args.concurrency,
+            )
+            results["full_library"], _ = await measure(
+                [lambda: client.get(base + "/api/playlists") for _ in range(heavy)], 1
+            )
+
+            print(f"library {size}: writes ...", file=sys.stderr)
+            results["add_song"], _ = await measure(
+                [lambda i=i: client.post(songs_url, json=_song(size + i)) for i in range(n)], sequential
+            )
+            victims = random.sample(uuids, min(n, len(uuids) // 2))
+            results["remove_song"], _ = await measure(
+                [lambda u=u: client.delete(f"{songs_url}/{u}") for u in victims], sequential
+            )
+            removed = set(victims)
+            remaining = [u for u in uuids if u not in removed]
+            results["move_song"], _ = await measure(
+                [
+                    lambda u=random.choice(remaining): client.post(base + "/api/playlists/batch", json={
+                        "operations": [{"op": "move", "playlist_id": playlist_id, "uuid": u, "index": 0}],
+                    })
+                    for _ in range(n)
+                ],
+                sequential,
+            )
+            # 旧的整列表重排接口：把一首歌移到最前面
+            results["reorder_to_top"], _ = await measure(
+                [
+                    lambda u=random.choice(remaining): client.post(f"{songs_url}/reorder", json={"song_uuids": [u]})
+                    for _ in range(heavy)
+                ],
+                1,
+            )
+            results["rename_playlist"], _ = await measure(
+                [
+                    lambda i=i: client.put(f"{base}/api/playlists/{playlist_id}", json={"name": f"bench {size} #{i}"})
+                    for i in range(heavy)
+                ],
+                1,
+            )
+
+            async def create_and_delete(i):
+                created = (await client.post(base + "/api/playlists", json={"name": f"tmp {i}"})).json()
+                return await client.delete(f"{base}/api/playlists/{created['id']}")
+
+            results["create_delete_playlist"], _ = await measure(
+                [lambda i=i: create_and_delete(i) for i in range(n)], sequential
+            )
+            results["server_memory"] = server.memory()
+    finally:
+        server.stop()
+    return results
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        elif key in COMPARED and isinstance(value, (int, float)):
+            yield path, key, value
+
+
+def compare(baseline, current):
+    """打印与上一次结果的对比，变差超过 10% 的行标记为 !"""
+    old = {path: value for path, _, value in _flatten(baseline.get("results", {}))}
+    lines = []
+    for path, key, value in _flatten(current["results"]):
+        if path.startswith("api.server_metrics") or path not in old or not old[path]:
+            continue
+        change = (value - old[path]) / old[path] * 100
+        worse = -change if COMPARED[key] else change
+        flag = "!" if worse > 10 else " "
+        lines.append(f"{flag} {path:<55} {old[path]:>10} -> {value:>10}  ({change:+.1f}%)")
+    return "\n".join(lines)
+
+
+async def run(args):
+    results = {}
+    fake = start_fake(args)
+    try:
+        if "api" in args.only:
+            results["api"] = await bench_api(args, fake)
+        if "library" in args.only:
+            results["library"] = {}
+            for size in args.library_sizes:
+                results["library"][str(size)] = await bench_library(args, fake, size)
+    finally:
+        fake.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=["api", "library"], default=["api", "library"])
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--heavy-requests", type=int, default=5, help="requests for scenarios that scale with playlist size")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sequential-writes", action="store_true", help="run library writes one at a time")
+    parser.add_argument("--search-pages", type=int, default=100, help="distinct search result pages")
+    parser.add_argument("--streams", type=int, default=16, help="songs streamed in full")
+    parser.add_argument("--seeks", type=int, default=4, help="random Range requests per song")
+    parser.add_argument("--seek-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--library-sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--api-latency", type=float, default=30, help="fake API latency (ms)")
+    parser.add_argument("--cdn-latency", type=float, default=20, help="fake CDN time to first byte (ms)")
+    parser.add_argument("--bandwidth", type=int, default=0, help="fake CDN bandwidth per connection (KB/s)")
+    parser.add_argument("--audio-size", type=int, default=4096, help="fake audio file size (KB)")
+    parser.add_argument("--rate-scale", type=float, default=0, help="BILIMUSIC_RATE_SCALE for the server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--work-dir", help="data directory (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="previous JSON report to compare against")
+    args = parser.parse_args()
+
+    temporary = args.work_dir is None
+    if temporary:
+        args.work_dir = tempfile.mkdtemp(prefix="bilimusic-bench-")
+    started = datetime.now(timezone.utc)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if temporary:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "compare", "work_dir")}
+    report = {
+        "started": started.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(json.load(f), report), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
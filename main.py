@@ -1,14 +1,24 @@
+import time
+
+# 尽早取时间，冷启动报告从这里开始计时
+_T0 = time.perf_counter()
+
 import os
 import sys
 import threading
-import time
 import ctypes
-import socket
+import multiprocessing
+
+from backend import boot
 
-import uvicorn
-import webview
+boot.begin(_T0)
 
-from backend.server import app 
+# uvicorn 和 backend.server 在 __main__ 里才导入：
+# 封面缩略图进程池以 spawn 方式启动子进程，子进程会重新执行本文件的顶层代码，
+# 放在顶层会让每个子进程都白白导入一遍整个后端（约 0.8 秒）。
+
+HOST = "127.0.0.1"
+PORT = 8001
 
 def get_resource_path(relative_path):
     """
@@ -25,24 +35,17 @@ def get_resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 def start_server():
-    # 启动 FastAPI 服务
-    # host 设置为 127.0.0.1 仅供本地访问
-    uvicorn.run(app, host="127.0.0.1", port=8001, log_level="error")
-
-def wait_for_server(host: str = "127.0.0.1", port: int = 8001, timeout: float = 15.0, interval: float = 0.2) -> bool:
-    """简单轮询端口，判断后端是否已经启动。
-
-    返回 True 表示在超时时间内端口已经打开，可以访问；
-    返回 False 表示超时仍未连通，会继续创建窗口，但前端可能仍需等待。
     """
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            with socket.create_connection((host, port), timeout=1.0):
-                return True
-        except OSError:
-            time.sleep(interval)
-    return False
+    在后台线程启动 FastAPI 服务，host 设置为 127.0.0.1 仅供本地访问。
+    端口在这里先绑定好，服务真正开始 accept 之前到达的连接会在 backlog 里排队而不是被拒绝；
+    lifespan 启动完成后 server_ready 置位。
+    """
+    config = uvicorn.Config(app, host=HOST, port=PORT, log_level="error")
+    sock = config.bind_socket()
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    return thread
 
 def set_app_user_model_id():
     """
@@ -59,6 +62,17 @@ def set_app_user_model_id():
             pass
 
 if __name__ == "__main__":
+    # PyInstaller 打包后，封面缩略图进程池的子进程也从这里启动
+    multiprocessing.freeze_support()
+
+    import uvicorn
+
+    boot.mark("import_uvicorn")
+
+    from backend.server import app, ready as server_ready
+
+    boot.mark("import_server")
+
     # 1. 设置 AppID (必须在创建窗口之前调用)
     set_app_user_model_id()
 
@@ -73,15 +87,19 @@ if __name__ == "__main__":
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
 
-    # 3. 启动后端服务器线程
-    server_thread = threading.Thread(target=start_server, daemon=True)
-    server_thread.start()
+    # 3. 启动后端服务器线程，服务启动的同时在主线程导入 webview
+    start_server()
+    boot.mark("start_server")
 
-    # 轮询本地 8001 端口，确保 FastAPI 已经启动，避免先出现空白窗口
-    server_ready = wait_for_server()
-    if not server_ready:
+    import webview
+
+    boot.mark("import_webview")
+
+    # 等 lifespan 启动完成再创建窗口，避免先出现空白窗口
+    if not server_ready.wait(timeout=15.0):
         # 如果在超时时间内仍未就绪，继续启动窗口，但前端可能仍然需要等待
-        print("Warning: backend server on 127.0.0.1:8001 not ready within timeout.")
+        print(f"Warning: backend server on {HOST}:{PORT} not ready within timeout.")
+    boot.mark("wait_server")
 
     # 4. 获取图标路径 (用于窗口标题栏)
     # 这里的路径 "img/logo.ico" 对应你打包命令中的 --add-data "img;img"
@@ -91,11 +109,19 @@ if __name__ == "__main__":
     # 注意：create_window 不要传 icon 参数
     window = webview.create_window(
         "BiliMusic", 
-        "http://127.0.0.1:8001/", 
+        f"http://{HOST}:{PORT}/", 
         width=900, 
         height=600
     )
 
+    def on_loaded():
+        # 页面第一次加载完成即冷启动结束，之后的刷新不再计入
+        if "window" not in boot.phases:
+            boot.mark("window")
+            boot.finish()
+
+    window.events.loaded += on_loaded
+
     # 6. 启动应用并传入图标
     # icon 参数必须放在这里，才能同时修复窗口标题栏图标
     webview.start(icon=icon_path)
\ No newline at end of file
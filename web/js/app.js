@@ -14,10 +14,19 @@ const playerState = reactive({
     showPlayer: false // To show/hide player bar if needed, or always show
 });
 
+// Seconds before the end of a track at which the next one is prefetched
+const PREFETCH_LEAD = 15;
+// Songs fetched per page in the playlist view
+const SONGS_PAGE_SIZE = 100;
+
 class MusicPlayer {
     constructor(state) {
         this.state = state;
         this.audio = new Audio();
+        // { fromIndex, mode, index, audio } resolved by /api/prefetch for the upcoming track
+        this.prefetched = null;
+        // "index:mode" of the track the last prefetch was started for, so it runs once per track
+        this.prefetchAttempt = null;
         this.setupEvents();
     }
 
@@ -25,6 +34,9 @@ class MusicPlayer {
         this.audio.addEventListener('timeupdate', () => {
             this.state.currentTime = this.audio.currentTime;
             this.state.duration = this.audio.duration || 0;
+            if (this.state.duration && this.state.duration - this.state.currentTime <= PREFETCH_LEAD) {
+                this.prefetchNext();
+            }
         });
 
         this.audio.addEventListener('ended', () => {
@@ -42,32 +54,63 @@ class MusicPlayer {
 
     loadPlaylist(songs, startIndex = 0) {
         this.state.playlist = songs;
+        this.prefetched = null;
         this.play(startIndex);
     }
 
-    async play(index) {
+    pickNextIndex() {
+        const { mode, currentIndex, playlist } = this.state;
+        if (mode === 'random') return Math.floor(Math.random() * playlist.length);
+        return (currentIndex + 1) % playlist.length;
+    }
+
+    async prefetchNext() {
+        const { mode, currentIndex, playlist } = this.state;
+        if (mode === 'loop' || playlist.length === 0) return;
+        // timeupdate fires several times a second; try once per track even if the request fails
+        const attempt = `${currentIndex}:${mode}`;
+        if (this.prefetchAttempt === attempt) return;
+        this.prefetchAttempt = attempt;
+
+        const index = this.pickNextIndex();
+        const song = playlist[index];
+        try {
+            const resp = await axios.post('/api/prefetch', { bvid: song.bvid, cid: song.cid });
+            if (this.prefetchAttempt === attempt) {
+                this.prefetched = { fromIndex: currentIndex, mode, index, audio: resp.data.audio };
+            }
+        } catch (e) {
+            // Prefetch is best effort, next() falls back to resolving on demand
+        }
+    }
+
+    async play(index, resolved = null) {
         if (index < 0 || index >= this.state.playlist.length) return;
 
         this.state.currentIndex = index;
         const song = this.state.playlist[index];
         this.state.currentSong = song;
+        this.prefetched = null;
+        this.prefetchAttempt = null;
 
         try {
-            // Get audio URL
-            const resp = await axios.get('/api/audio_url', {
-                params: {
-                    bvid: song.bvid,
-                    cid: song.cid,
-                },
-            });
-            const data = resp.data;
+            let data = resolved;
+            if (!data || data.error) {
+                // Get audio URL
+                const resp = await axios.get('/api/audio_url', {
+                    params: {
+                        bvid: song.bvid,
+                        cid: song.cid,
+                    },
+                });
+                data = resp.data;
+            }
             if (data.error) {
                 ElMessage.error("Failed to get audio: " + data.error);
                 return;
             }
 
-            const proxyUrl = `/stream?url=${encodeURIComponent(data.url)}`;
-            this.audio.src = proxyUrl;
+            this.audio.src = this.streamUrl(song, data);
             this.audio.volume = this.state.volume;
             await this.audio.play();
         } catch (e) {
@@ -76,6 +119,18 @@ class MusicPlayer {
         }
     }
 
+    streamUrl(song, data) {
+        // bvid/cid/quality 用于后端的本地音频缓存，已完整缓存时 url 为空
+        const params = new URLSearchParams();
+        if (data.url) params.set('url', data.url);
+        if (data.quality) {
+            params.set('bvid', song.bvid);
+            params.set('cid', data.cid || song.cid);
+            params.set('quality', data.quality);
+        }
+        return `/stream?${params.toString()}`;
+    }
+
     togglePlay() {
         if (this.audio.paused) {
             if (this.audio.src) this.audio.play();
@@ -87,19 +142,21 @@ class MusicPlayer {
 
     next() {
         if (this.state.playlist.length === 0) return;
-        let nextIndex = this.state.currentIndex;
 
         if (this.state.mode === 'loop') {
             this.audio.currentTime = 0;
             this.audio.play();
             return;
-        } else if (this.state.mode === 'random') {
-            nextIndex = Math.floor(Math.random() * this.state.playlist.length);
-        } else {
-            nextIndex = this.state.currentIndex + 1;
-            if (nextIndex >= this.state.playlist.length) nextIndex = 0;
         }
-        this.play(nextIndex);
+
+        const prefetched = this.prefetched;
+        if (prefetched && prefetched.fromIndex === this.state.currentIndex && prefetched.mode === this.state.mode
+            && prefetched.index < this.state.playlist.length) {
+            this.play(prefetched.index, prefetched.audio);
+            return;
+        }
+
+        this.play(this.pickNextIndex());
     }
 
     prev() {
@@ -126,13 +183,12 @@ class MusicPlayer {
 }
 
 const player = new MusicPlayer(playerState);
-let qrTimer = null;
 
 // --- Vue App ---
 const App = {
     setup() {
         // Data
-        const playlists = ref([]);
+        const playlists = ref([]); // Summaries: id, name, song_count, total_duration, cover
         const currentView = ref('search'); // search, playlist
         const activePlaylistId = ref(null);
         const searchKeyword = ref('');
@@ -140,8 +196,17 @@ const App = {
         const searchLoading = ref(false);
         const searchPage = ref(1);
         const searchHasMore = ref(false);
+        const libraryResults = ref([]); // Matches from the local playlists
         const activePlaylist = computed(() => playlists.value.find(p => p.id === activePlaylistId.value));
         const favoritePlaylist = computed(() => playlists.value.find(p => p.id === 'favorite' || p.name === 'My Favorite'));
+        // Songs of the active playlist are loaded page by page
+        const activeSongs = ref([]);
+        const activeSongsCursor = ref(null);
+        const activeSongsLoading = ref(false);
+        // [uuid, bvid, cid] of every song in My Favorite
+        const favoriteKeys = ref([]);
+        // Library revision the local state corresponds to (see /api/playlists/changes)
+        let libraryRevision = null;
 
         const loginInfo = ref({ logged_in: false, dedeuserid: null, user: null });
         const isLoggedIn = computed(() => !!loginInfo.value.logged_in);
@@ -174,11 +239,32 @@ const App = {
         const init = async () => {
             await refreshPlaylists();
             await refreshLoginStatus();
+            connectEvents();
         };
 
-        const refreshPlaylists = async () => {
-            const resp = await axios.get('/api/playlists');
-            let list = resp.data || [];
+        // Server-pushed events replace polling; EventSource reconnects by itself
+        const connectEvents = () => {
+            const source = new EventSource('/api/events');
+            const on = (name, handler) => source.addEventListener(name, e => handler(JSON.parse(e.data)));
+
+            on('library', (data) => {
+                if (data.revision !== libraryRevision) syncPlaylists();
+            });
+            on('login', onLoginEvent);
+            on('import', onImportEvent);
+            // Events sent while disconnected are lost; catch up on the QR state once
+            source.onopen = async () => {
+                if (!qrSessionId.value) return;
+                try {
+                    const r = await axios.get('/api/login/qrcode/status', { params: { session_id: qrSessionId.value } });
+                    applyQrStatus(r.data.status);
+                } catch (e) {
+                    // Session already finished or expired
+                }
+            };
+        };
+
+        const setPlaylists = (list) => {
             const idx = list.findIndex(p => p.id === 'favorite' || p.name === 'My Favorite');
             if (idx > 0) {
                 const fav = list.splice(idx, 1)[0];
@@ -187,15 +273,123 @@ const App = {
             playlists.value = list;
         };
 
+        // Full reload; responses are revalidated with ETags, so unchanged data is not re-sent
+        const refreshPlaylists = async () => {
+            const resp = await axios.get('/api/playlists/summary');
+            libraryRevision = resp.data.revision;
+            setPlaylists(resp.data.playlists || []);
+            await Promise.all([refreshFavoriteKeys(), reloadActiveSongs()]);
+        };
+
+        // Apply only the changes made since the last known revision
+        const syncPlaylists = async () => {
+            if (libraryRevision === null) return refreshPlaylists();
+            const resp = await axios.get('/api/playlists/changes', { params: { since: libraryRevision } });
+            const delta = resp.data;
+            if (delta.reset) return refreshPlaylists();
+
+            const favId = favoritePlaylist.value && favoritePlaylist.value.id;
+            const deleted = new Set();
+            let reorderActive = false;
+            for (const change of delta.changes) {
+                const pid = change.playlist_id;
+                const isActive = pid === activePlaylistId.value;
+                if (change.op === 'delete') {
+                    deleted.add(pid);
+                    if (isActive) goSearch();
+                } else if (change.op === 'add') {
+                    const song = change.data;
+                    if (pid === favId) favoriteKeys.value.push([song.uuid, song.bvid, song.cid]);
+                    // Songs beyond the loaded pages arrive with the next page
+                    if (isActive && !activeSongsCursor.value) activeSongs.value.push(song);
+                } else if (change.op === 'remove') {
+                    const uuid = change.data.uuid;
+                    if (pid === favId) favoriteKeys.value = favoriteKeys.value.filter(k => k[0] !== uuid);
+                    if (isActive) activeSongs.value = activeSongs.value.filter(s => s.uuid !== uuid);
+                } else if ((change.op === 'reorder' || change.op === 'move') && isActive) {
+                    reorderActive = true;
+                }
+            }
+
+            const updated = new Map(delta.playlists.map(p => [p.id, p]));
+            const list = playlists.value
+                .filter(p => !deleted.has(p.id))
+                .map(p => updated.get(p.id) || p);
+            const known = new Set(list.map(p => p.id));
+            for (const p of delta.playlists) {
+                if (!known.has(p.id)) list.push(p);
+            }
+            setPlaylists(list);
+            libraryRevision = delta.revision;
+            if (reorderActive) await reloadActiveSongs();
+        };
+
+        const refreshFavoriteKeys = async () => {
+            if (!favoritePlaylist.value) {
+                favoriteKeys.value = [];
+                return;
+            }
+            const resp = await axios.get(`/api/playlists/${favoritePlaylist.value.id}/keys`);
+            favoriteKeys.value = resp.data.keys || [];
+        };
+
+        const findFavoriteKey = (bvid, cid) => {
+            return favoriteKeys.value.find(k => k[1] === bvid && k[2] === cid);
+        };
+
+        const fetchSongsPage = async (playlistId, cursor, limit = SONGS_PAGE_SIZE) => {
+            const resp = await axios.get(`/api/playlists/${playlistId}/songs`, { params: { cursor, limit } });
+            return resp.data;
+        };
+
+        // Reload the active playlist from the top, keeping as many songs as were already shown
+        const reloadActiveSongs = async () => {
+            const id = activePlaylistId.value;
+            if (!id) return;
+            const limit = Math.min(Math.max(activeSongs.value.length, SONGS_PAGE_SIZE), 500);
+            const page = await fetchSongsPage(id, null, limit);
+            if (activePlaylistId.value !== id) return;
+            activeSongs.value = page.items;
+            activeSongsCursor.value = page.next_cursor;
+        };
+
+        const loadMoreSongs = async (all = false) => {
+            const id = activePlaylistId.value;
+            if (!id || !activeSongsCursor.value || activeSongsLoading.value) return;
+            activeSongsLoading.value = true;
+            try {
+                do {
+                    const page = await fetchSongsPage(id, activeSongsCursor.value, all ? 500 : SONGS_PAGE_SIZE);
+                    if (activePlaylistId.value !== id) return;
+                    activeSongs.value = activeSongs.value.concat(page.items);
+                    activeSongsCursor.value = page.next_cursor;
+                } while (all && activeSongsCursor.value);
+            } finally {
+                activeSongsLoading.value = false;
+            }
+        };
+
+        const onContentScroll = (event) => {
+            if (currentView.value !== 'playlist') return;
+            const el = event.target;
+            if (el.scrollTop + el.clientHeight >= el.scrollHeight - 300) {
+                loadMoreSongs();
+            }
+        };
+
         // Navigation
         const goSearch = () => {
             currentView.value = 'search';
             activePlaylistId.value = null;
         };
 
-        const goPlaylist = (id) => {
+        const goPlaylist = async (id) => {
             currentView.value = 'playlist';
+            if (activePlaylistId.value === id) return;
             activePlaylistId.value = id;
+            activeSongs.value = [];
+            activeSongsCursor.value = null;
+            await reloadActiveSongs();
         };
 
         // Search
@@ -209,6 +403,8 @@ const App = {
                     params: {
                         keyword: searchKeyword.value,
                         page,
+                        // Covers are filled in by /covers/{key} as the images load
+                        lazy_covers: true,
                     },
                 });
                 const res = resp.data;
@@ -228,11 +424,26 @@ const App = {
             }
         };
 
+        const searchLibrary = async (keyword) => {
+            try {
+                const resp = await axios.get('/api/library/search', { params: { q: keyword, limit: 20 } });
+                if (keyword === searchKeyword.value) libraryResults.value = resp.data.items || [];
+            } catch (e) {
+                libraryResults.value = [];
+            }
+        };
+
         const doSearch = async () => {
             if (!searchKeyword.value) return;
+            // The local index answers in milliseconds, so show it without waiting for Bilibili
+            searchLibrary(searchKeyword.value);
             await fetchSearchPage(1);
         };
 
+        const playLibrarySong = (song) => {
+            player.loadPlaylist([song], 0);
+        };
+
         const nextSearchPage = async () => {
             if (searchLoading.value) return;
             if (!searchHasMore.value) return;
@@ -254,7 +465,7 @@ const App = {
                 });
                 if (value) {
                     await axios.post('/api/playlists', { name: value });
-                    await refreshPlaylists();
+                    await syncPlaylists();
                     ElMessage.success('Playlist created');
                 }
             } catch (e) {
@@ -271,7 +482,7 @@ const App = {
                 });
                 await axios.delete(`/api/playlists/${id}`);
                 if (activePlaylistId.value === id) goSearch();
-                await refreshPlaylists();
+                await syncPlaylists();
                 ElMessage.success('Playlist deleted');
             } catch (e) {
                 // Cancelled
@@ -281,18 +492,108 @@ const App = {
         const removeSong = async (uuid) => {
             if (!activePlaylistId.value) return;
             await axios.delete(`/api/playlists/${activePlaylistId.value}/songs/${uuid}`);
-            await refreshPlaylists(); // Refresh to get updated songs
+            await syncPlaylists();
+        };
+
+        // Import a Bilibili favorites folder or an UP owner's uploads into a new playlist
+        const importJobs = ref([]);
+
+        const parseImportSource = (text) => {
+            let m = text.match(/fid=(\d+)/) || text.match(/\bml(\d+)/);
+            if (m) return { source: 'favorites', id: Number(m[1]) };
+            m = text.match(/space\.bilibili\.com\/(\d+)/);
+            if (m) return { source: 'uploads', id: Number(m[1]) };
+            if (/^\d+$/.test(text.trim())) return { source: 'favorites', id: Number(text.trim()) };
+            return null;
+        };
+
+        const watchImport = async (job) => {
+            importJobs.value.push(job);
+            // Progress arrives as import events; re-read once in case the job finished before we listened
+            try {
+                onImportEvent((await axios.get(`/api/imports/${job.id}`)).data);
+            } catch (e) {
+                // Keep waiting for events
+            }
+        };
+
+        const onImportEvent = (data) => {
+            const job = importJobs.value.find(j => j.id === data.id);
+            if (!job) return;
+            Object.assign(job, data);
+            if (job.status === 'running') return;
+            importJobs.value = importJobs.value.filter(j => j.id !== job.id);
+            if (job.status === 'done') {
+                ElMessage.success(`Imported ${job.added} songs` + (job.skipped ? `, ${job.skipped} already in playlist` : ''));
+            } else if (job.status === 'failed') {
+                ElMessage.error(`Import stopped after ${job.added} songs: ${job.error}`);
+            }
+        };
+
+        const importPlaylist = async () => {
+            let value;
+            try {
+                ({ value } = await ElMessageBox.prompt(
+                    'Favorites folder link / ID, or UP owner space link',
+                    'Import from Bilibili',
+                    { confirmButtonText: 'Import', cancelButtonText: 'Cancel' },
+                ));
+            } catch (e) {
+                return; // Cancelled
+            }
+            const target = parseImportSource(value || '');
+            if (!target) {
+                ElMessage.warning('Unrecognized link');
+                return;
+            }
+            try {
+                const resp = await axios.post('/api/imports', target);
+                watchImport(reactive(resp.data.job));
+            } catch (e) {
+                ElMessage.error('Import failed');
+            }
+        };
+
+        const cancelImport = async (jobId) => {
+            await axios.delete(`/api/imports/${jobId}`);
+        };
+
+        // Queue every song of the playlist for offline download
+        const downloadPlaylist = async (playlistId) => {
+            try {
+                const resp = await axios.post('/api/downloads', { playlist_id: playlistId });
+                ElMessage.success(`Queued ${resp.data.queued} songs for download`);
+            } catch (e) {
+                ElMessage.error('Download failed');
+            }
         };
 
         // Player Interactions
-        const playSongInPlaylist = (index) => {
+        const playSongInPlaylist = async (index) => {
             if (!activePlaylist.value) return;
-            player.loadPlaylist(activePlaylist.value.songs, index);
+            // The play queue covers the whole playlist, not just the pages shown so far
+            await loadMoreSongs(true);
+            player.loadPlaylist(activeSongs.value, index);
+        };
+
+        // 视频信息在页面内缓存，收藏、详情、快速播放重复打开同一视频时不再请求后端
+        const videoInfoCache = new Map();
+        const getVideoInfo = (bvid) => {
+            if (!videoInfoCache.has(bvid)) {
+                const request = axios.get(`/api/videos/${bvid}`).then(resp => {
+                    if (resp.data.error) videoInfoCache.delete(bvid);
+                    return resp.data;
+                }, err => {
+                    videoInfoCache.delete(bvid);
+                    throw err;
+                });
+                videoInfoCache.set(bvid, request);
+            }
+            return videoInfoCache.get(bvid);
         };
 
         const quickPlay = async (bvid) => {
-            const resp = await axios.get(`/api/videos/${bvid}`);
-            const info = resp.data;
+            const info = await getVideoInfo(bvid);
             if (info.error) {
                 ElMessage.error(info.error);
                 return;
@@ -319,14 +620,12 @@ const App = {
         };
 
         const isFavoriteBvid = (bvid) => {
-            if (!favoritePlaylist.value || !favoritePlaylist.value.songs) return false;
-            return favoritePlaylist.value.songs.some(s => s.bvid === bvid);
+            return favoriteKeys.value.some(k => k[1] === bvid);
         };
 
         const toggleFavoriteFromSearch = async (item) => {
             try {
-                const resp = await axios.get(`/api/videos/${item.bvid}`);
-                const info = resp.data;
+                const info = await getVideoInfo(item.bvid);
                 if (info.error) {
                     ElMessage.error(info.error);
                     return;
@@ -341,13 +640,10 @@ const App = {
                 }
 
                 const fav = favoritePlaylist.value;
-                let existing = null;
-                if (fav.songs && fav.songs.length) {
-                    existing = fav.songs.find(s => s.bvid === info.bvid && s.cid === page.cid);
-                }
+                const existing = findFavoriteKey(info.bvid, page.cid);
 
                 if (existing) {
-                    await axios.delete(`/api/playlists/${fav.id}/songs/${existing.uuid}`);
+                    await axios.delete(`/api/playlists/${fav.id}/songs/${existing[0]}`);
                     ElMessage.success('Removed from My Favorite');
                 } else {
                     const song = {
@@ -362,29 +658,26 @@ const App = {
                     ElMessage.success('Added to My Favorite');
                 }
 
-                await refreshPlaylists();
+                await syncPlaylists();
             } catch (e) {
                 ElMessage.error('Favorite operation failed');
             }
         };
 
         const isCurrentFavorite = computed(() => {
-            if (!playerState.currentSong || !favoritePlaylist.value || !favoritePlaylist.value.songs) return false;
-            return favoritePlaylist.value.songs.some(s => s.bvid === playerState.currentSong.bvid && s.cid === playerState.currentSong.cid);
+            if (!playerState.currentSong) return false;
+            return !!findFavoriteKey(playerState.currentSong.bvid, playerState.currentSong.cid);
         });
 
         const toggleFavoriteCurrent = async () => {
             if (!playerState.currentSong || !favoritePlaylist.value) return;
             const fav = favoritePlaylist.value;
             const current = playerState.currentSong;
-            let existing = null;
-            if (fav.songs && fav.songs.length) {
-                existing = fav.songs.find(s => s.bvid === current.bvid && s.cid === current.cid);
-            }
+            const existing = findFavoriteKey(current.bvid, current.cid);
 
             try {
                 if (existing) {
-                    await axios.delete(`/api/playlists/${fav.id}/songs/${existing.uuid}`);
+                    await axios.delete(`/api/playlists/${fav.id}/songs/${existing[0]}`);
                     ElMessage.success('Removed from My Favorite');
                 } else {
                     const song = {
@@ -398,7 +691,7 @@ const App = {
                     await axios.post(`/api/playlists/${fav.id}/songs`, song);
                     ElMessage.success('Added to My Favorite');
                 }
-                await refreshPlaylists();
+                await syncPlaylists();
             } catch (e) {
                 ElMessage.error('Favorite operation failed');
             }
@@ -406,8 +699,7 @@ const App = {
 
         // Add to Playlist Logic
         const openVideoDetails = async (bvid) => {
-            const resp = await axios.get(`/api/videos/${bvid}`);
-            const info = resp.data;
+            const info = await getVideoInfo(bvid);
             if (info.error) {
                 ElMessage.error(info.error);
                 return;
@@ -417,36 +709,29 @@ const App = {
             videoDetailsVisible.value = true;
         };
 
-        const addToPlaylist = async (targetPlaylistId, songs) => {
-            for (const song of songs) {
-                await axios.post(`/api/playlists/${targetPlaylistId}/songs`, song);
+        const addToPlaylist = async (targetPlaylistId, selection) => {
+            // The server expands the parts from one video lookup and adds them in one transaction
+            const resp = await axios.post(`/api/playlists/${targetPlaylistId}/videos`, selection);
+            if (resp.data.error) {
+                ElMessage.error(resp.data.error);
+                return;
             }
-            ElMessage.success(`Added ${songs.length} songs`);
+            ElMessage.success(`Added ${resp.data.added} songs`);
             videoDetailsVisible.value = false;
-            await refreshPlaylists();
+            await syncPlaylists();
         };
 
         const handleAddSelected = async () => {
             if (!currentVideoDetails.value) return;
 
-            // If no pages selected, warn? Or add all?
-            // Let's say if none selected, add all.
-            let pagesToAdd = [];
-            if (selectedPages.value.length === 0) {
-                pagesToAdd = currentVideoDetails.value.pages;
-            } else {
-                pagesToAdd = currentVideoDetails.value.pages.filter(p => selectedPages.value.includes(p.cid));
+            // If none selected, add all parts
+            const selection = { bvid: currentVideoDetails.value.bvid };
+            if (selectedPages.value.length > 0) {
+                selection.pages = currentVideoDetails.value.pages
+                    .filter(p => selectedPages.value.includes(p.cid))
+                    .map(p => p.page);
             }
 
-            const songs = pagesToAdd.map(page => ({
-                bvid: currentVideoDetails.value.bvid,
-                cid: page.cid,
-                title: currentVideoDetails.value.pages.length > 1 ? page.part : currentVideoDetails.value.title,
-                artist: currentVideoDetails.value.owner,
-                duration: formatTime(page.duration),
-                cover: currentVideoDetails.value.pic
-            }));
-
             // Ask which playlist
             if (playlists.value.length === 0) {
                 ElMessage.warning("No playlists available. Create one first.");
@@ -463,17 +748,17 @@ const App = {
             // Better: Show a "Select Playlist" dialog.
             // I'll add a `playlistSelectionVisible` state.
 
-            playlistSelectionSongs.value = songs;
+            playlistSelection.value = selection;
             playlistSelectionVisible.value = true;
         };
 
         const playlistSelectionVisible = ref(false);
-        const playlistSelectionSongs = ref([]);
+        const playlistSelection = ref(null);
 
         const queueVisible = ref(false);
 
         const confirmAddToPlaylist = async (pid) => {
-            await addToPlaylist(pid, playlistSelectionSongs.value);
+            await addToPlaylist(pid, playlistSelection.value);
             playlistSelectionVisible.value = false;
         };
 
@@ -488,6 +773,14 @@ const App = {
         };
 
         // Utils
+        // Cached covers (/covers/{key}) accept ?size= and return the smallest thumbnail whose
+        // longest edge is at least that many pixels; other URLs are used as they are.
+        // Video covers are 16:9, so square boxes ask for about 16/9 of their width.
+        const thumb = (url, size) => {
+            if (!url || !url.startsWith('/covers/')) return url;
+            return `${url}?size=${Math.ceil(size * (window.devicePixelRatio || 1))}`;
+        };
+
         const formatTime = (seconds) => {
             if (!seconds || isNaN(seconds)) return "0:00";
             const m = Math.floor(seconds / 60);
@@ -504,6 +797,38 @@ const App = {
             }
         };
 
+        const applyQrStatus = async (status) => {
+            if (status === 'scan') {
+                qrStatusText.value = '已扫描，请在手机上确认登录';
+            } else if (status === 'confirm') {
+                qrStatusText.value = '请在手机上确认登录';
+            } else if (status === 'timeout') {
+                qrStatusText.value = '二维码已过期，请点击按钮重新获取';
+                qrSessionId.value = null;
+            } else if (status === 'done') {
+                qrStatusText.value = '登录成功';
+                qrSessionId.value = null;
+                ElMessage.success('登录成功');
+                await refreshLoginStatus();
+                loginDialogVisible.value = false;
+            }
+        };
+
+        const onLoginEvent = async (data) => {
+            if (data.flow === 'qr' && data.session_id === qrSessionId.value) {
+                await applyQrStatus(data.status);
+            } else if (data.flow === 'sms' && data.session_id === smsSessionId.value) {
+                if (data.status === 'geetest_done' && smsStep.value === 'geetest') {
+                    await sendSmsCode();
+                } else if (data.status === 'verify_geetest_done') {
+                    smsStatusText.value = '安全验证已完成，请输入短信验证码';
+                }
+            } else if (data.status === 'done' || data.status === 'logout') {
+                // Logged in or out from another window
+                await refreshLoginStatus();
+            }
+        };
+
         const startQrLogin = async () => {
             qrLoading.value = true;
             qrStatusText.value = '正在生成二维码...';
@@ -512,37 +837,7 @@ const App = {
                 qrSessionId.value = resp.data.session_id;
                 qrImage.value = resp.data.qrcode_image;
                 qrStatusText.value = '请使用 Bilibili 手机 App 扫码登录';
-                if (qrTimer) {
-                    clearInterval(qrTimer);
-                    qrTimer = null;
-                }
-                qrTimer = setInterval(async () => {
-                    if (!qrSessionId.value) return;
-                    try {
-                        const r = await axios.get('/api/login/qrcode/status', {
-                            params: { session_id: qrSessionId.value },
-                        });
-                        const status = r.data.status;
-                        if (status === 'scan') {
-                            qrStatusText.value = '已扫描，请在手机上确认登录';
-                        } else if (status === 'confirm') {
-                            qrStatusText.value = '请在手机上确认登录';
-                        } else if (status === 'timeout') {
-                            qrStatusText.value = '二维码已过期，请点击按钮重新获取';
-                            clearInterval(qrTimer);
-                            qrTimer = null;
-                        } else if (status === 'done') {
-                            qrStatusText.value = '登录成功';
-                            clearInterval(qrTimer);
-                            qrTimer = null;
-                            ElMessage.success('登录成功');
-                            await refreshLoginStatus();
-                            loginDialogVisible.value = false;
-                        }
-                    } catch (e) {
-                        // ignore single poll error
-                    }
-                }, 1500);
+                // Status changes arrive as login events
             } catch (e) {
                 qrStatusText.value = '生成二维码失败';
                 ElMessage.error('生成二维码失败');
@@ -719,10 +1014,7 @@ const App = {
         });
 
         watch(loginDialogVisible, (val) => {
-            if (!val && qrTimer) {
-                clearInterval(qrTimer);
-                qrTimer = null;
-            }
+            if (!val) qrSessionId.value = null;
         });
 
         return {
@@ -731,6 +1023,9 @@ const App = {
             currentView,
             activePlaylistId,
             activePlaylist,
+            activeSongs,
+            activeSongsCursor,
+            activeSongsLoading,
             favoritePlaylist,
             loginInfo,
             isLoggedIn,
@@ -741,6 +1036,8 @@ const App = {
             searchLoading,
             searchPage,
             searchHasMore,
+            libraryResults,
+            importJobs,
             playerState,
             videoDetailsVisible,
             currentVideoDetails,
@@ -765,9 +1062,15 @@ const App = {
             goPlaylist,
             doSearch,
             createPlaylist,
+            importPlaylist,
+            cancelImport,
             deletePlaylist,
             removeSong,
             playSongInPlaylist,
+            loadMoreSongs,
+            onContentScroll,
+            downloadPlaylist,
+            playLibrarySong,
             quickPlay,
             openVideoDetails,
             handleAddSelected,
@@ -800,7 +1103,8 @@ const App = {
 
             // Icons (if needed to pass to template, but we can use global registration or string names)
             // Utils
-            formatTime
+            formatTime,
+            thumb
         };
     }
 };